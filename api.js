@@ -18,6 +18,8 @@ class LinkPortalAPI {
         }
         this.baseURL = baseURL;
         this.currentUserId = null;
+        // 最近一次写入的标记（响应头 X-Write-Marker），之后的请求带回，后端在短时间内改读主库
+        this.writeMarker = null;
     }
 
     /**
@@ -28,11 +30,12 @@ class LinkPortalAPI {
         const timeout = options.timeout || 3000; // 默认3秒超时
         
         const config = {
+            ...options,
             headers: {
                 'Content-Type': 'application/json',
+                ...(this.writeMarker ? { 'X-Write-Marker': this.writeMarker } : {}),
                 ...options.headers
-            },
-            ...options
+            }
         };
 
         if (config.body && typeof config.body === 'object') {
@@ -47,12 +50,30 @@ class LinkPortalAPI {
         try {
             const response = await fetch(url, config);
             clearTimeout(timeoutId);
+            const writeMarker = response.headers.get('X-Write-Marker');
+            if (writeMarker) {
+                this.writeMarker = writeMarker;
+            }
             
             // 204 No Content 响应
             if (response.status === 204) {
                 return null;
             }
 
+            // 202 Accepted：操作已转为后台任务，等待完成后返回任务结果
+            if (response.status === 202) {
+                const accepted = await response.json();
+                return accepted.job_id ? this.waitForJob(accepted.job_id, options.onProgress) : accepted;
+            }
+
+            // 429 / 503：读请求按 Retry-After 等待后重试一次
+            const retryAfter = Number(response.headers.get('Retry-After'));
+            if ((response.status === 429 || response.status === 503) && !options.retried
+                && (config.method || 'GET') === 'GET' && retryAfter > 0 && retryAfter <= 3) {
+                await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+                return this.request(endpoint, { ...options, retried: true });
+            }
+
             if (!response.ok) {
                 const error = await response.json().catch(() => ({ detail: '请求失败' }));
                 throw new Error(error.detail || `HTTP ${response.status}`);
@@ -132,11 +153,19 @@ class LinkPortalAPI {
         const params = new URLSearchParams();
         if (options.category) params.append('category', options.category);
         if (options.search) params.append('search', options.search);
+        if (options.domain) params.append('domain', options.domain);
         
         const query = params.toString() ? `?${params.toString()}` : '';
         return this.request(`/users/${userId}/links${query}`);
     }
 
+    /**
+     * 按网站汇总链接数和点击数（sort: links / clicks / recent）
+     */
+    async getDomains(userId, sort = 'links') {
+        return this.request(`/users/${userId}/domains?sort=${encodeURIComponent(sort)}`);
+    }
+
     /**
      * 获取指定链接
      */
@@ -328,6 +357,106 @@ class LinkPortalAPI {
             }
         });
     }
+
+    // ========== 后台任务 ==========
+
+    /**
+     * 查询后台任务进度
+     */
+    async getJob(jobId) {
+        return this.request(`/jobs/${jobId}`);
+    }
+
+    /**
+     * 轮询后台任务直到结束，返回任务结果；onProgress(job) 在每次查询后调用
+     */
+    async waitForJob(jobId, onProgress = null, interval = 500) {
+        while (true) {
+            const job = await this.getJob(jobId);
+            if (onProgress) {
+                onProgress(job);
+            }
+            if (job.status === 'succeeded') {
+                return job.result;
+            }
+            if (job.status === 'failed' || job.status === 'cancelled') {
+                throw new Error(job.error || (job.status === 'cancelled' ? '任务已取消' : '任务执行失败'));
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+            interval = Math.min(interval * 1.5, 3000);
+        }
+    }
+
+    /**
+     * 清空访问历史（记录较多时在后台执行）
+     */
+    async clearAccessHistory(userId) {
+        return this.request(`/users/${userId}/access-history`, {
+            method: 'DELETE'
+        });
+    }
+
+    // ========== 网站图标 ==========
+
+    /**
+     * 获取服务端缓存的网站图标地址（host 可包含端口）
+     */
+    getFaviconUrl(host) {
+        return `${this.baseURL}/favicons/${encodeURIComponent(host)}`;
+    }
+
+    /**
+     * 一次获取用户所有链接的图标，返回 {域名: data URI}
+     */
+    async getFaviconBundle(userId) {
+        return this.request(`/users/${userId}/favicons`, { timeout: 15000 });
+    }
+
+    // ========== 公开分享 ==========
+
+    /**
+     * 获取公开分享地址（首次调用时生成），返回的 html_url / json_url 为完整地址
+     */
+    async getShareLink(userId) {
+        return this._absoluteShareLink(await this.request(`/users/${userId}/share`));
+    }
+
+    /**
+     * 更换分享令牌，旧地址失效
+     */
+    async resetShareLink(userId) {
+        return this._absoluteShareLink(await this.request(`/users/${userId}/share/reset`, { method: 'POST' }));
+    }
+
+    _absoluteShareLink(link) {
+        const origin = new URL(this.baseURL).origin;
+        return { ...link, html_url: origin + link.html_url, json_url: origin + link.json_url };
+    }
+
+    // ========== 变更推送 ==========
+
+    /**
+     * 订阅用户数据变更（SSE）
+     * handlers.onChange(event) 收到增量变更，handlers.onReset() 需要全量重新加载
+     * 断线后浏览器自动重连并携带 Last-Event-ID 续传，返回的 EventSource 可调用 close() 取消订阅
+     */
+    subscribeChanges(userId, handlers = {}) {
+        if (typeof EventSource === 'undefined') {
+            return null;
+        }
+        const source = new EventSource(`${this.baseURL}/users/${userId}/changes`);
+        source.addEventListener('change', (e) => {
+            if (handlers.onChange) {
+                handlers.onChange(JSON.parse(e.data));
+            }
+        });
+        source.addEventListener('reset', () => {
+            if (handlers.onReset) {
+                handlers.onReset();
+            }
+        });
+        return source;
+    }
 }
 
 // 导出 API 类（如果使用模块化）
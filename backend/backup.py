@@ -0,0 +1,308 @@
+"""
+用户数据备份与恢复
+
+备份在一个一致性快照中读取用户的设置、分类、链接和访问历史（MySQL 为 REPEATABLE READ 的只读事务，
+SQLite 为 WAL 下的读事务），边读边写入压缩的 NDJSON 归档：
+
+    {"format": ..., "version": 1, "user": {...}}        头部
+    {"table": "links", "columns": [...]}                 表头
+    ["名称", "https://...", ...]                          每行一个 JSON 数组，顺序与 columns 一致
+    {"end": true, "rows": {"links": 1200, ...}}          结尾，用于发现不完整的归档
+
+安装了 zstandard 时用 zstd 压缩，否则用 gzip（BACKUP_COMPRESSION）；恢复时按文件头识别。
+
+恢复在一个事务中完成：
+- 不保留原来的主键，user_id 换成目标用户；表之间通过 URL / 分类名称关联，不需要改写引用
+- 按自然键（设置每个用户一行、分类名称、链接 URL、访问历史整行）与现有数据配对：
+  相同的行跳过，不同的行按主键批量 UPDATE，多余的行删除，缺少的行批量 INSERT
+  （语句只编译一次，executemany 在 PyMySQL 上改写为多行 INSERT），只有少数行不同时只写这些行
+- 只恢复归档和当前库都有的列，不同迁移版本之间可以互相恢复
+- 有改动时在同一事务中更换分享快照版本并记录 backup/restore 事件，提交后清除读缓存，客户端收到事件后全量重新加载
+
+运行方式：
+    python backup.py dump --user 3 -o user3.ndjson.zst    # 备份
+    python backup.py restore user3.ndjson.zst --user 3    # 恢复到已有用户
+    python backup.py restore user3.ndjson.zst --new-user 名称
+    python backup.py inspect user3.ndjson.zst
+"""
+import gzip
+import io
+import json
+import os
+from collections import defaultdict, deque
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, bindparam, DateTime
+import crud
+import share
+from cache import invalidate_user
+from database import engine, SessionLocal, settings
+from migrations import latest_version
+from models import User, Link, Category, UserSettings, AccessHistory
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖
+    zstandard = None
+
+FORMAT = "link-portal-backup"
+VERSION = 1
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+
+USER_COLUMNS = ["name", "password_hash", "frecency_ref"]
+
+# (表, 配对用的自然键)；None 表示按整行配对
+TABLES = [
+    (UserSettings, ()),
+    (Category, ("name",)),
+    (Link, ("url",)),
+    (AccessHistory, None),
+]
+
+def _columns(model):
+    return [column for column in model.__table__.columns if column.name not in ("id", "user_id")]
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _decode(column, value):
+    if value is not None and isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    return value
+
+def _dumps(item) -> bytes:
+    return json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+def compression_of(name: str = None) -> str:
+    name = name or settings.BACKUP_COMPRESSION
+    if name == "auto":
+        return "zstd" if zstandard is not None else "gzip"
+    if name == "zstd" and zstandard is None:
+        raise ValueError("zstd 压缩需要安装 zstandard")
+    if name not in ("zstd", "gzip"):
+        raise ValueError(f"不支持的压缩方式: {name}")
+    return name
+
+def _open_write(path: str, compression: str):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, "wb"), closefd=True)
+    return gzip.open(path, "wb", compresslevel=GZIP_LEVEL)
+
+def _open_read(path: str):
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rb")
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("归档使用 zstd 压缩，需要安装 zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+# ========== 备份 ==========
+def _begin_snapshot(connection):
+    """开始只读的一致性快照；之后的所有查询读到同一时刻的数据"""
+    if connection.dialect.name == "mysql":
+        connection.exec_driver_sql("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+    elif connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("BEGIN")
+
+def dump_user(user_id: int, path: str, compression: str = None, engine=engine) -> dict:
+    """备份一个用户，返回各表的行数；先写入临时文件，完成后替换 path"""
+    compression = compression_of(compression)
+    rows = {}
+    tmp_path = f"{path}.tmp"
+    connection = engine.connect()
+    try:
+        if connection.dialect.name == "mysql":
+            connection.execution_options(isolation_level="REPEATABLE READ")
+        _begin_snapshot(connection)
+        user = connection.execute(
+            select(*[User.__table__.c[name] for name in USER_COLUMNS]).where(User.id == user_id)
+        ).first()
+        if user is None:
+            raise ValueError("用户不存在")
+        with _open_write(tmp_path, compression) as out:
+            out.write(_dumps({
+                "format": FORMAT,
+                "version": VERSION,
+                "schema": latest_version(),
+                "created_at": datetime.now().isoformat(),
+                "user_id": user_id,
+                "user": {name: _encode(value) for name, value in zip(USER_COLUMNS, user)},
+            }))
+            for model, _ in TABLES:
+                table = model.__table__
+                columns = _columns(model)
+                out.write(_dumps({"table": table.name, "columns": [column.name for column in columns]}))
+                result = connection.execute(
+                    select(*columns).where(table.c.user_id == user_id).order_by(table.c.id)
+                    .execution_options(yield_per=settings.BACKUP_CHUNK)
+                )
+                count = 0
+                for partition in result.partitions():
+                    out.write(b"".join(_dumps([_encode(value) for value in row]) for row in partition))
+                    count += len(partition)
+                rows[table.name] = count
+            out.write(_dumps({"end": True, "rows": rows}))
+        connection.rollback()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        connection.close()
+    return rows
+
+# ========== 恢复 ==========
+def load_archive(path: str) -> dict:
+    """读取整个归档：{"header": 头部, "tables": {表名: (列名, 行)}}"""
+    tables = {}
+    trailer = None
+    with io.TextIOWrapper(_open_read(path), encoding="utf-8") as stream:
+        header = json.loads(stream.readline() or "{}")
+        if header.get("format") != FORMAT:
+            raise ValueError("不是备份归档")
+        if header["version"] > VERSION:
+            raise ValueError(f"不支持的归档版本: {header['version']}")
+        rows = None
+        for line in stream:
+            item = json.loads(line)
+            if isinstance(item, list):
+                rows.append(item)
+            elif "table" in item:
+                rows = []
+                tables[item["table"]] = (item["columns"], rows)
+            elif item.get("end"):
+                trailer = item
+    if trailer is None or trailer["rows"] != {name: len(rows) for name, (_, rows) in tables.items()}:
+        raise ValueError("归档不完整")
+    return {"header": header, "tables": tables}
+
+def _target_user(db, header: dict, user_id: int = None, new_name: str = None) -> User:
+    archived = header["user"]
+    frecency_ref = _decode(User.__table__.c.frecency_ref, archived.get("frecency_ref"))
+    if user_id is not None:
+        user = crud.get_user(db, user_id)
+        if user is None:
+            raise ValueError("用户不存在")
+    else:
+        name = new_name or archived["name"]
+        user = crud.get_user_by_name(db, name)
+        if user is not None and new_name:
+            raise ValueError("用户名已存在")
+        if user is None:
+            user = User(name=name, password_hash=archived.get("password_hash"), frecency_ref=frecency_ref)
+            db.add(user)
+            db.flush()
+    # 链接的 frecency 是相对于参考时间的，与链接一起恢复
+    if frecency_ref is not None and user.frecency_ref != frecency_ref:
+        user.frecency_ref = frecency_ref
+        db.flush()
+    return user
+
+def _restore_table(db, model, key, user_id: int, names: list, rows: list) -> dict:
+    table = model.__table__
+    columns = [column for column in _columns(model) if column.name in names]
+    positions = [names.index(column.name) for column in columns]
+    key_positions = [i for i, column in enumerate(columns) if key is None or column.name in key]
+
+    def key_of(values):
+        return json.dumps([values[i] for i in key_positions], ensure_ascii=False, sort_keys=True)
+
+    current = defaultdict(deque)
+    for row in db.execute(select(table.c.id, *columns).where(table.c.user_id == user_id).order_by(table.c.id)):
+        values = [_encode(value) for value in row[1:]]
+        current[key_of(values)].append((row[0], values))
+
+    inserts, updates, unchanged = [], [], 0
+    for row in rows:
+        values = [row[i] for i in positions]
+        matches = current.get(key_of(values))
+        if matches:
+            row_id, existing = matches.popleft()
+            if existing == values:
+                unchanged += 1
+                continue
+            updates.append({"_id": row_id, **{c.name: _decode(c, v) for c, v in zip(columns, values)}})
+        else:
+            inserts.append({"user_id": user_id, **{c.name: _decode(c, v) for c, v in zip(columns, values)}})
+    deletes = [row_id for matches in current.values() for row_id, _ in matches]
+
+    chunk = settings.BACKUP_CHUNK
+    for i in range(0, len(deletes), chunk):
+        db.execute(delete(table).where(table.c.id.in_(deletes[i:i + chunk])))
+    if updates:
+        db.execute(update(table).where(table.c.id == bindparam("_id")), updates)
+    for i in range(0, len(inserts), chunk):
+        db.execute(insert(table), inserts[i:i + chunk])
+    return {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes), "unchanged": unchanged}
+
+def restore_user(path: str, user_id: int = None, new_name: str = None) -> dict:
+    """恢复归档；指定 user_id 时恢复到该用户，new_name 时新建用户，都不指定时按归档中的用户名"""
+    archive = load_archive(path)
+    db = SessionLocal()
+    try:
+        user = _target_user(db, archive["header"], user_id, new_name)
+        target = user.id
+        tables = {}
+        for model, key in TABLES:
+            if model.__tablename__ in archive["tables"]:
+                names, rows = archive["tables"][model.__tablename__]
+                tables[model.__tablename__] = _restore_table(db, model, key, target, names, rows)
+        changed = sum(stats["inserted"] + stats["updated"] + stats["deleted"] for stats in tables.values())
+        if changed:
+            crud.record_change(db, target, "backup", "restore", [], {"changed": changed})
+            share.invalidate(db, target)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    invalidate_user(target)
+    return {"user_id": target, "changed": changed, "tables": tables}
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+    parser = argparse.ArgumentParser(description="用户数据备份与恢复")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dump_parser = commands.add_parser("dump", help="备份一个用户")
+    dump_parser.add_argument("--user", type=int, required=True)
+    dump_parser.add_argument("-o", "--output", required=True)
+    dump_parser.add_argument("--compression", choices=["auto", "zstd", "gzip"])
+    restore_parser = commands.add_parser("restore", help="恢复归档")
+    restore_parser.add_argument("archive")
+    target = restore_parser.add_mutually_exclusive_group()
+    target.add_argument("--user", type=int, help="恢复到已有用户")
+    target.add_argument("--new-user", help="恢复为新用户")
+    inspect_parser = commands.add_parser("inspect", help="查看归档内容")
+    inspect_parser.add_argument("archive")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        if args.command == "dump":
+            rows = dump_user(args.user, args.output, args.compression)
+            print(f"已备份 {rows}，{os.path.getsize(args.output)} 字节，用时 {time.perf_counter() - start:.2f}s")
+        elif args.command == "restore":
+            result = restore_user(args.archive, user_id=args.user, new_name=args.new_user)
+            print(f"已恢复到用户 {result['user_id']}，写入 {result['changed']} 行，"
+                  f"用时 {time.perf_counter() - start:.2f}s")
+            for name, stats in result["tables"].items():
+                print(f"  {name}: {stats}")
+        else:
+            archive = load_archive(args.archive)
+            header = archive["header"]
+            print(f"用户 {header['user']['name']}（ID {header['user_id']}），备份于 {header['created_at']}，"
+                  f"迁移版本 {header['schema']}")
+            for name, (_, rows) in archive["tables"].items():
+                print(f"  {name}: {len(rows)} 行")
+    except ValueError as exc:
+        print(exc)
+        sys.exit(1)
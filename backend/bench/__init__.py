@@ -0,0 +1,9 @@
+"""
+性能基准与压测套件
+
+- datagen.py   可复现的合成数据生成器（批量插入）
+- scenarios.py 按 script.js 的真实调用顺序回放的场景脚本
+- run.py       命令行入口：运行场景、输出各接口吞吐与 p50/p95/p99、保存/对比 JSON 基线
+
+在 backend 目录下运行：python -m bench.run --help
+"""
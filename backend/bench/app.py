@@ -0,0 +1,38 @@
+"""
+把 FastAPI 应用绑定到基准测试数据库
+
+通过 dependency_overrides 替换 get_db，使压测不依赖 database.py 中配置的库。
+默认去掉限流中间件，避免压测请求被限流（bench/ratelimit_bench.py 单独测试限流）。
+也可作为 uvicorn 入口：BENCH_DB_URL=sqlite:///bench.sqlite3 uvicorn bench.app:app
+"""
+import os
+
+from sqlalchemy.orm import sessionmaker
+
+from database import get_db, get_read_db, make_engine
+
+
+def bind_app(engine, rate_limit: bool = False):
+    """让 app 的所有请求都使用 engine"""
+    from main import app
+    from ratelimit import RateLimitMiddleware
+
+    if not rate_limit:
+        app.user_middleware = [m for m in app.user_middleware if m.cls is not RateLimitMiddleware]
+        app.middleware_stack = None  # 下一个请求时按新的中间件列表重新构建
+
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_bench_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = get_bench_db
+    app.dependency_overrides[get_read_db] = get_bench_db
+    return app
+
+
+app = bind_app(make_engine(os.environ["BENCH_DB_URL"])) if os.getenv("BENCH_DB_URL") else None
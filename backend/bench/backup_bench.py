@@ -0,0 +1,159 @@
+"""
+备份与恢复测试
+
+在临时 SQLite 库上验证：
+- 备份读取的是同一时刻的快照，备份期间的写入不会出现在归档中
+- 恢复为新用户后各表内容与原用户一致，耗时与通过 API 逐个创建相比
+- 只有少数行不同时增量恢复只写这些行；内容相同时不写入任何行
+- 不完整的归档被拒绝
+
+    python -m bench.backup_bench
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="backup_bench_")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "backup.sqlite3")
+os.environ["SHARE_SNAPSHOT_DIR"] = os.path.join(_tmp, "snapshots")
+
+import argparse
+import json
+import time
+from sqlalchemy import select, func
+from fastapi.testclient import TestClient
+from database import engine, SessionLocal
+from models import User, Link, Category, AccessHistory, ChangeEvent
+import backup
+from bench.checks import check, report
+from bench.datagen import generate
+from bench.app import bind_app
+import main as app_main
+
+
+def contents(user_id):
+    """各表去掉主键和 user_id 后的内容（排序后比较）"""
+    result = {}
+    with engine.connect() as connection:
+        for model, _ in backup.TABLES:
+            columns = backup._columns(model)
+            rows = connection.execute(select(*columns).where(model.__table__.c.user_id == user_id))
+            result[model.__tablename__] = sorted(
+                json.dumps([backup._encode(value) for value in row], ensure_ascii=False) for row in rows)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="备份与恢复测试")
+    parser.add_argument("--links", type=int, default=5000)
+    parser.add_argument("--history", type=int, default=20000)
+    parser.add_argument("--api-links", type=int, default=300)
+    args = parser.parse_args(argv)
+    problems = []
+    prefix = app_main.API_PREFIX
+
+    user_ids = generate(engine, users=2, links=args.links, history=args.history)
+    source, other = sorted(user_ids.values())
+    path = os.path.join(_tmp, "source.ndjson.gz")
+
+    print("一致性快照：")
+    connection = engine.connect()
+    backup._begin_snapshot(connection)
+    before = connection.execute(select(func.count()).select_from(Link).where(Link.user_id == source)).scalar()
+    with SessionLocal() as db:
+        db.add(Link(user_id=source, name="快照之后", url="https://after.example/"))
+        db.commit()
+    during = connection.execute(select(func.count()).select_from(Link).where(Link.user_id == source)).scalar()
+    connection.rollback()
+    connection.close()
+    check(f"快照开始后的写入不可见（{before} / {during}）", before == during, problems)
+
+    print("备份：")
+    expected = contents(source)
+    start = time.perf_counter()
+    rows = backup.dump_user(source, path)
+    elapsed = time.perf_counter() - start
+    raw = sum(len(line) + 1 for table in expected.values() for line in table)
+    size = os.path.getsize(path)
+    check(f"{rows}（{elapsed * 1000:.0f}ms，{backup.compression_of()} {size} 字节，未压缩约 {raw} 字节）",
+          rows["links"] == args.links + 1 and rows["access_history"] == args.history and size < raw / 3, problems)
+
+    print("恢复为新用户：")
+    start = time.perf_counter()
+    result = backup.restore_user(path, new_name="restored")
+    restore_seconds = time.perf_counter() - start
+    restored = result["user_id"]
+    total_rows = sum(rows.values())
+    check(f"写入 {result['changed']} 行（{restore_seconds * 1000:.0f}ms）",
+          result["changed"] == total_rows and contents(restored) == expected, problems)
+    with SessionLocal() as db:
+        ref = db.query(User.frecency_ref).filter(User.id == source).scalar()
+        check("同时恢复 frecency 参考时间", db.query(User.frecency_ref).filter(User.id == restored).scalar() == ref,
+              problems)
+    try:
+        backup.restore_user(path, new_name="restored")
+        check("用户名已存在时拒绝", False, problems)
+    except ValueError:
+        check("用户名已存在时拒绝", True, problems)
+
+    client = TestClient(bind_app(engine))
+    start = time.perf_counter()
+    for i in range(args.api_links):
+        client.post(f"{prefix}/users/{other}/links", json={"name": f"API {i}", "url": f"https://api{i}.example/"})
+    api_per_row = (time.perf_counter() - start) / args.api_links
+    restore_per_row = restore_seconds / total_rows
+    check(f"每行 {restore_per_row * 1e6:.1f}µs，通过 API 创建链接每个 {api_per_row * 1e6:.1f}µs"
+          f"（{api_per_row / restore_per_row:.0f} 倍）", api_per_row >= 10 * restore_per_row, problems)
+
+    print("增量恢复：")
+    with SessionLocal() as db:
+        links = db.query(Link).filter(Link.user_id == restored).order_by(Link.id).limit(5).all()
+        for link in links[:3]:
+            link.name = link.name + "（已修改）"
+        for link in links[3:]:
+            db.delete(link)
+        db.add(Category(user_id=restored, name="备份之后新增"))
+        db.add(AccessHistory(user_id=restored, link_url="https://after.example/", link_name="备份之后"))
+        db.commit()
+        events = db.query(ChangeEvent).filter(ChangeEvent.user_id == restored).count()
+    start = time.perf_counter()
+    result = backup.restore_user(path, user_id=restored)
+    incremental_seconds = time.perf_counter() - start
+    link_stats = result["tables"]["links"]
+    check(f"只写有差异的行（{result['changed']} 行，{incremental_seconds * 1000:.0f}ms）",
+          link_stats == {"inserted": 2, "updated": 3, "deleted": 0, "unchanged": args.links - 4}
+          and result["tables"]["categories"]["deleted"] == 1
+          and result["tables"]["access_history"]["deleted"] == 1
+          and result["changed"] == 7 and contents(restored) == expected, problems)
+    with SessionLocal() as db:
+        event = db.query(ChangeEvent).filter(ChangeEvent.user_id == restored).order_by(ChangeEvent.id.desc()).first()
+        check("推送 backup/restore 事件", db.query(ChangeEvent).filter(ChangeEvent.user_id == restored).count()
+              == events + 1 and (event.entity, event.op) == ("backup", "restore"), problems)
+
+    result = backup.restore_user(path, user_id=restored)
+    with SessionLocal() as db:
+        quiet = db.query(ChangeEvent).filter(ChangeEvent.user_id == restored).count() == events + 1
+    check("内容相同时不写入", result["changed"] == 0 and quiet, problems)
+
+    print("归档校验：")
+    truncated = os.path.join(_tmp, "truncated.ndjson")
+    with backup._open_read(path) as f, open(truncated, "wb") as out:
+        lines = f.read().splitlines(keepends=True)
+        out.writelines(lines[:-1])
+    try:
+        backup.load_archive(truncated)
+        check("不完整的归档被拒绝", False, problems)
+    except ValueError as exc:
+        check(f"不完整的归档被拒绝（{exc}）", True, problems)
+    try:
+        backup.dump_user(999999, os.path.join(_tmp, "missing.ndjson.gz"))
+        check("用户不存在", False, problems)
+    except ValueError:
+        check("用户不存在", not os.path.exists(os.path.join(_tmp, "missing.ndjson.gz.tmp")), problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+跨进程缓存失效测试
+
+验证失效总线确实跨越进程边界：
+- local：两个进程打开同一个共享内存文件，一个进程发布的变更让另一个进程的缓存失效
+- redis：两个总线实例（相当于两个 worker）连接本地替身 Redis，一个发布的变更让另一个的缓存失效
+- redis 订阅连接断开期间 version() 返回 None，缓存被绕过；重连后 epoch 加一，断开前的缓存全部失效
+- redis 无响应时发布不阻塞写入方，失败记录日志，恢复后补发
+
+    python -m bench.cache_bench
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="cache_bench_")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "cache.sqlite3")
+
+import argparse
+import logging
+import multiprocessing
+import time
+from cache import LocalBus, RedisBus, UserCache
+from bench.checks import check, report
+from bench.standin_redis import StandinRedis
+
+USER = 7
+OTHER = 8
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def publish_local(path, user_id):
+    bus = LocalBus(path)
+    bus.publish(user_id)
+    return bus.version(user_id)
+
+
+class Loader:
+    """记录加载次数的 loader"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+
+def local(problems):
+    path = os.path.join(_tmp, "versions")
+    bus = LocalBus(path)
+    user_cache = UserCache(bus)
+    loads = {USER: Loader(), OTHER: Loader()}
+    for _ in range(2):
+        for user_id, loader in loads.items():
+            user_cache.get_or_load("links", user_id, None, loader)
+    check("同一进程内命中缓存", [loader.calls for loader in loads.values()] == [1, 1], problems)
+
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        remote_version = pool.apply(publish_local, (path, USER))
+    check(f"另一个进程发布后版本号一致（{bus.version(USER)} / {remote_version}）",
+          bus.version(USER) == remote_version == 1, problems)
+    for user_id, loader in loads.items():
+        user_cache.get_or_load("links", user_id, None, loader)
+    check(f"另一个进程的写入让本进程的缓存失效（加载次数 {[loader.calls for loader in loads.values()]}）",
+          [loader.calls for loader in loads.values()] == [2, 1], problems)
+
+
+def redis(problems, reconnect_timeout):
+    server = StandinRedis().start()
+    writer, reader = RedisBus(server.url), RedisBus(server.url)
+    check("两个总线实例完成订阅", wait_for(lambda: server.subscriber_count() == 2, 3), problems)
+    user_cache = UserCache(reader)
+    loader = Loader()
+    for _ in range(2):
+        user_cache.get_or_load("links", USER, None, loader)
+    check("订阅期间命中缓存", loader.calls == 1, problems)
+
+    before = reader.version(USER)
+    writer.publish(USER)
+    received = wait_for(lambda: reader.version(USER) != before, 2)
+    user_cache.get_or_load("links", USER, None, loader)
+    check(f"另一个实例发布的变更送达（{before} -> {reader.version(USER)}），缓存失效",
+          received and loader.calls == 2, problems)
+
+    epoch = reader.version(USER)[0]
+    server.refusing = True
+    server.drop()
+    disconnected = wait_for(lambda: reader.version(USER) is None, 2)
+    for _ in range(2):
+        user_cache.get_or_load("links", USER, None, loader)
+    check(f"订阅断开后 version() 返回 None，缓存被绕过（加载次数 {loader.calls}）",
+          disconnected and loader.calls == 4, problems)
+
+    server.refusing = False
+    reconnected = wait_for(lambda: reader.version(USER) is not None, reconnect_timeout)
+    version = reader.version(USER)
+    user_cache.get_or_load("links", USER, None, loader)
+    user_cache.get_or_load("links", USER, None, loader)
+    check(f"重连后 epoch 加一（{epoch} -> {version and version[0]}），断开前的缓存不再使用（加载次数 {loader.calls}）",
+          reconnected and version[0] == epoch + 1 and loader.calls == 5, problems)
+
+    writer.publish(OTHER)
+    check("重连后继续接收其他实例的变更",
+          wait_for(lambda: (reader.version(OTHER) or (0, 0))[1] == 1, 2), problems)
+
+    warnings = []
+    handler = logging.Handler(logging.WARNING)
+    handler.emit = warnings.append
+    logging.getLogger("uvicorn.error").addHandler(handler)
+    before = reader.version(USER)[1]
+    server.stalled = True
+    start = time.perf_counter()
+    for _ in range(20):
+        writer.publish(USER)
+    elapsed = time.perf_counter() - start
+    check(f"Redis 无响应时 20 次发布耗时 {elapsed * 1000:.1f}ms，不阻塞写入方", elapsed < 0.05, problems)
+    check("发布失败记录日志", wait_for(lambda: warnings, writer.publish_timeout + 1), problems)
+    server.stalled = False
+    flushed = writer.flush(timeout=15)
+    delivered = wait_for(lambda: reader.version(USER)[1] > before, 2)
+    check(f"恢复后补发（{before} -> {reader.version(USER)[1]}），同一用户的多次写入合并发布",
+          flushed and delivered and reader.version(USER)[1] - before <= 2, problems)
+    logging.getLogger("uvicorn.error").removeHandler(handler)
+    server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="跨进程缓存失效测试")
+    parser.add_argument("--reconnect-timeout", type=float, default=15)
+    args = parser.parse_args(argv)
+    problems = []
+
+    print("local 总线：")
+    local(problems)
+    print("redis 总线：")
+    redis(problems, args.reconnect_timeout)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+变更推送测试
+
+在临时 SQLite 库上验证：
+- 旧库迁移后已有事件的序号取主键，用户的当前序号取最大序号
+- 每个用户的事件序号连续递增，与其他用户互不影响
+- 多个线程同时写同一用户时序号不重复，推送按序号逐条送达、不丢事件
+- Last-Event-ID 续传只发送之后的事件；续传的事件已被清理时发送 reset
+- 从未打开推送的用户，过期事件同样由后台清理
+- 续传查询走 (user_id, seq) 索引
+
+    python -m bench.changefeed_bench
+"""
+import os
+import sys
+import tempfile
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="changefeed_bench_"), "changefeed.sqlite3")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = _db_path
+os.environ["MIGRATION_BACKFILL_SLEEP"] = "0"
+
+import argparse
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import engine, SessionLocal
+import changefeed
+import crud
+import schemas
+from migrations import MigrationRunner
+from models import Link, ChangeEvent
+from bench.checks import check, report
+from bench.datagen import generate
+
+
+def seqs(user_id):
+    with SessionLocal() as db:
+        return [row[0] for row in db.query(ChangeEvent.seq).filter(ChangeEvent.user_id == user_id).order_by(ChangeEvent.id)]
+
+
+async def collect(user_id, last_event_id, count):
+    """从推送中取 count 条事件"""
+    received = []
+    async for kind, payload in changefeed.iter_changes(user_id, last_event_id):
+        if kind == "ping":
+            break
+        received.append((kind, payload["id"]))
+        if len(received) >= count:
+            break
+    return received
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="变更推送测试")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=25, help="每个线程的写入次数")
+    args = parser.parse_args(argv)
+    problems = []
+
+    print("迁移回填：")
+    user_ids = generate(engine, users=2, links=50, history=0)
+    alice, bob = sorted(user_ids.values())
+    with SessionLocal() as db:
+        for i in range(6):
+            crud.create_category(db, schemas.CategoryCreate(name=f"分类 {i}"), alice if i % 3 else bob)
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_change_events_user_id_seq"))
+        connection.execute(text("ALTER TABLE change_events DROP COLUMN seq"))
+        connection.execute(text("ALTER TABLE users DROP COLUMN change_seq"))
+        connection.execute(text("DELETE FROM schema_migrations WHERE version = 11"))
+    MigrationRunner(engine, log=lambda message: None).upgrade()
+    with SessionLocal() as db:
+        events = db.query(ChangeEvent.id, ChangeEvent.seq).all()
+        latest = {user_id: crud.get_latest_change_seq(db, user_id) for user_id in (alice, bob)}
+    check("已有事件的序号取主键", events and all(seq == event_id for event_id, seq in events), problems)
+    check(f"用户当前序号取最大序号（{latest}）",
+          all(latest[user_id] == max(seqs(user_id)) for user_id in (alice, bob)), problems)
+
+    print("序号：")
+    start = {user_id: latest[user_id] for user_id in (alice, bob)}
+    with SessionLocal() as db:
+        for i in range(5):
+            crud.create_category(db, schemas.CategoryCreate(name=f"新分类 {i}"), alice)
+        crud.create_category(db, schemas.CategoryCreate(name="另一个用户"), bob)
+    check("用户内连续递增", seqs(alice)[-5:] == list(range(start[alice] + 1, start[alice] + 6)), problems)
+    check("与其他用户互不影响", seqs(bob)[-1] == start[bob] + 1, problems)
+
+    print("并发写入：")
+    with SessionLocal() as db:
+        link_ids = [row[0] for row in db.query(Link.id).filter(Link.user_id == alice).limit(args.threads)]
+    cursor = crud.get_latest_change_seq(SessionLocal(), alice)
+    errors = []
+
+    def writer(link_id):
+        try:
+            for i in range(args.writes):
+                with SessionLocal() as db:
+                    if i % 2:
+                        crud.increment_link_clicks(db, link_id, alice)
+                    else:
+                        crud.update_link(db, link_id, alice, schemas.LinkUpdate(note=f"第 {i} 次"))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=writer, args=(link_id,)) for link_id in link_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = len(link_ids) * args.writes
+    new = [seq for seq in seqs(alice) if seq > cursor]
+    check(f"{total} 次写入，序号不重复且连续", not errors and sorted(new) == list(range(cursor + 1, cursor + total + 1)),
+          problems)
+    received = asyncio.run(collect(alice, cursor, total))
+    check(f"推送按序号送达 {len(received)} 条", [seq for _, seq in received] == sorted(new), problems)
+
+    print("续传：")
+    middle = cursor + total // 2
+    resumed = asyncio.run(collect(alice, middle, total))
+    check("只发送 Last-Event-ID 之后的事件", [seq for _, seq in resumed] == list(range(middle + 1, cursor + total + 1)),
+          problems)
+    with SessionLocal() as db:
+        old = datetime.now() - timedelta(days=30)
+        db.query(ChangeEvent).filter(ChangeEvent.user_id == bob).update({ChangeEvent.created_at: old})
+        db.query(ChangeEvent).filter(ChangeEvent.user_id == alice, ChangeEvent.seq <= middle) \
+            .update({ChangeEvent.created_at: old})
+        db.commit()
+    pruned = changefeed.prune()
+    check(f"后台清理过期事件（{pruned} 条，包括从未打开推送的用户）", pruned > 0 and not seqs(bob), problems)
+    reset = asyncio.run(collect(alice, middle, 1))
+    check(f"续传的事件已被清理时发送 reset（{reset}）",
+          reset == [("reset", crud.get_latest_change_seq(SessionLocal(), alice))], problems)
+    check("事件全部清理后续传到当前序号不需要 reset",
+          changefeed._open_feed(bob, start[bob] + 1) == (start[bob] + 1, False), problems)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM change_events WHERE user_id = 1 AND seq > 5 ORDER BY seq LIMIT 10"))
+        plan = " ".join(str(row[-1]) for row in rows)
+    check(f"续传查询走 (user_id, seq) 索引（{plan}）",
+          "ix_change_events_user_id_seq" in plan and "TEMP B-TREE" not in plan, problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""
+验证脚本共用的检查函数
+
+    problems = []
+    check("说明", 条件, problems)
+    ...
+    return report(problems)
+"""
+
+
+def check(label, ok, problems):
+    """打印一项检查结果，不符合预期时记录到 problems"""
+    print(f"  {'OK ' if ok else 'ERR'} {label}")
+    if not ok:
+        problems.append(label)
+
+
+def report(problems) -> int:
+    """打印汇总并返回进程退出码"""
+    if problems:
+        print(f"不符合预期: {problems}")
+        return 1
+    print("全部符合预期")
+    return 0
@@ -0,0 +1,144 @@
+"""
+合成数据生成器
+
+使用固定随机种子生成 N 个用户，每个用户 M 个链接、若干分类、标签以及
+较长的访问历史，直接通过批量 INSERT 写入数据库（不经过 API），
+保证同一组参数在不同提交之间生成完全相同的数据。
+"""
+import random
+from datetime import datetime, timedelta
+
+import bcrypt
+from sqlalchemy import insert, select, func
+from sqlalchemy.orm import Session
+
+from database import Base
+from migrations import MigrationRunner, schema_migrations
+from frecency import replay_access_history
+from models import User, Link, Category, UserSettings, AccessHistory
+from domains import split_url
+
+# 所有合成用户共用的密码
+BENCH_PASSWORD = "bench-password"
+
+WORDS = [
+    "github", "python", "docs", "mail", "news", "video", "music", "cloud",
+    "search", "wiki", "blog", "shop", "map", "translate", "forum", "design",
+    "api", "status", "learn", "notes", "calendar", "drive", "photo", "chat",
+]
+TLDS = ["com", "org", "net", "io", "cn", "dev"]
+CATEGORY_NAMES = ["开发工具", "学习", "娱乐", "工作", "新闻", "购物", "社交", "设计"]
+TAG_NAMES = ["常用", "代码", "文档", "视频", "工具", "阅读", "收藏", "临时", "英文", "中文"]
+
+# 每批插入的行数
+CHUNK_SIZE = 1000
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _bulk_insert(db: Session, model, rows):
+    for chunk in _chunks(rows):
+        db.execute(insert(model), chunk)
+
+
+def user_name(index: int) -> str:
+    return f"bench_user_{index:05d}"
+
+
+def generate(engine, users: int = 10, links: int = 200, categories: int = 8,
+             history: int = 2000, seed: int = 42, drop: bool = True):
+    """生成合成数据，返回 {user_name: user_id}"""
+    rng = random.Random(seed)
+
+    if drop:
+        Base.metadata.drop_all(bind=engine)
+        schema_migrations.drop(engine, checkfirst=True)
+    MigrationRunner(engine, log=lambda message: None).upgrade()
+
+    # bcrypt 很慢，所有用户共用一个低成本哈希
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=4)).decode('utf-8')
+    base_time = datetime(2024, 1, 1)
+
+    with Session(engine) as db:
+        _bulk_insert(db, User, [
+            {"name": user_name(i), "password_hash": password_hash, "frecency_ref": base_time + timedelta(days=365)}
+            for i in range(users)
+        ])
+        db.flush()
+        user_ids = dict(db.query(User.name, User.id).filter(User.name.like("bench_user_%")).all())
+
+        link_rows, category_rows, settings_rows, history_rows = [], [], [], []
+        for name in sorted(user_ids):
+            user_id = user_ids[name]
+            cats = CATEGORY_NAMES[:max(1, min(categories, len(CATEGORY_NAMES)))]
+            for cat in cats:
+                category_rows.append({"user_id": user_id, "name": cat, "parent": None, "is_collapsed": False})
+
+            user_links = []
+            for j in range(links):
+                word = rng.choice(WORDS)
+                url = f"https://{word}{j}.{rng.choice(TLDS)}/{rng.choice(WORDS)}"
+                host, domain = split_url(url)
+                user_links.append((url, f"{word.title()} {j}"))
+                link_rows.append({
+                    "user_id": user_id,
+                    "name": f"{word.title()} {j}",
+                    "url": url,
+                    "icon": None,
+                    "note": f"{rng.choice(WORDS)} {rng.choice(WORDS)}",
+                    "category": rng.choice(cats),
+                    "tags": rng.sample(TAG_NAMES, rng.randint(0, 3)),
+                    "is_private": rng.random() < 0.2,
+                    "clicks": int(rng.paretovariate(1.2)) - 1,
+                    "last_access": base_time + timedelta(minutes=rng.randint(0, 525600)),
+                    "host": host,
+                    "domain": domain,
+                })
+
+            settings_rows.append({"user_id": user_id, "favorite_links": [u for u, _ in user_links[:5]]})
+
+            # 长尾访问历史：少数链接占据大部分访问
+            for k in range(history):
+                url, link_name = user_links[min(int(rng.paretovariate(1.0)) - 1, len(user_links) - 1)] if user_links else ("https://example.com", "Example")
+                history_rows.append({
+                    "user_id": user_id,
+                    "link_url": url,
+                    "link_name": link_name,
+                    "timestamp": base_time + timedelta(seconds=k * 37 + rng.randint(0, 30)),
+                })
+
+        _bulk_insert(db, Category, category_rows)
+        _bulk_insert(db, Link, link_rows)
+        _bulk_insert(db, UserSettings, settings_rows)
+        _bulk_insert(db, AccessHistory, history_rows)
+        db.commit()
+
+    # 按访问历史计算 frecency
+    with engine.connect() as connection:
+        high = connection.execute(select(func.max(Link.id))).scalar() or 0
+    for lo in range(0, high, 1000):
+        with engine.begin() as connection:
+            replay_access_history(connection, lo, lo + 1000)
+
+    return user_ids
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import make_engine
+
+    parser = argparse.ArgumentParser(description="生成基准测试数据")
+    parser.add_argument("--db-url", default="sqlite:///bench.sqlite3")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--links", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    ids = generate(make_engine(args.db_url), users=args.users, links=args.links,
+                   categories=args.categories, history=args.history, seed=args.seed)
+    print(f"已生成 {len(ids)} 个用户，每个用户 {args.links} 个链接、{args.history} 条访问历史")
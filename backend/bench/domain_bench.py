@@ -0,0 +1,143 @@
+"""
+链接域名测试
+
+在临时 SQLite 库上验证：
+- 旧库（没有 host / domain 字段）迁移后分批回填，结果与 domains.split_url 一致
+- 可注册域名的计算（多段后缀、端口、IP、localhost）
+- 按网站 / 主机过滤链接列表，按网站汇总链接数、点击数和失效链接数，都走 (user_id, domain) 索引
+- 创建、修改链接地址后 host / domain 随之更新
+
+    python -m bench.domain_bench
+"""
+import os
+import sys
+import tempfile
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="domain_bench_"), "domain.sqlite3")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = _db_path
+os.environ["MIGRATION_BACKFILL_SLEEP"] = "0"
+
+import argparse
+import time
+from datetime import datetime
+from sqlalchemy import text
+from fastapi.testclient import TestClient
+from database import engine, SessionLocal
+from cache import invalidate_user
+from domains import registrable_domain, split_url
+from migrations import MigrationRunner
+from models import Link
+from bench.checks import check, report
+from bench.datagen import generate
+from bench.app import bind_app
+import main as app_main
+
+
+def query_plan(sql, **params):
+    with engine.connect() as connection:
+        return " ".join(str(row[-1]) for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params))
+
+
+SITE_URLS = [
+    ("https://docs.python.org/3/", "docs.python.org", "python.org"),
+    ("https://www.python.org/", "www.python.org", "python.org"),
+    ("https://pypi.python.org/simple", "pypi.python.org", "python.org"),
+    ("https://news.bbc.co.uk/", "news.bbc.co.uk", "bbc.co.uk"),
+    ("https://alice.github.io/blog", "alice.github.io", "alice.github.io"),
+    ("http://localhost:8080/admin", "localhost:8080", "localhost"),
+    ("http://192.168.1.10/", "192.168.1.10", "192.168.1.10"),
+    ("HTTPS://WWW.Example.COM./", "www.example.com", "example.com"),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="链接域名测试")
+    parser.add_argument("--links", type=int, default=2000)
+    args = parser.parse_args(argv)
+    problems = []
+    prefix = app_main.API_PREFIX
+
+    print("迁移回填：")
+    user_ids = generate(engine, users=3, links=args.links, history=0)
+    user_id = sorted(user_ids.values())[0]
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_links_user_id_domain"))
+        connection.execute(text("ALTER TABLE links DROP COLUMN host"))
+        connection.execute(text("ALTER TABLE links DROP COLUMN domain"))
+        connection.execute(text("DELETE FROM schema_migrations WHERE version = 9"))
+    start = time.perf_counter()
+    MigrationRunner(engine, log=lambda message: None).upgrade()
+    elapsed = time.perf_counter() - start
+    with SessionLocal() as db:
+        rows = db.query(Link.url, Link.host, Link.domain).all()
+    check(f"回填 {len(rows)} 个链接（{elapsed * 1000:.0f}ms）",
+          rows and all((host, domain) == split_url(url) for url, host, domain in rows), problems)
+
+    print("可注册域名：")
+    for url, host, domain in SITE_URLS:
+        check(f"{url} -> {split_url(url)}", split_url(url) == (host, domain), problems)
+    check("无法解析的地址", split_url("not a url") == (None, None) and split_url("http://[::1") == (None, None)
+          and registrable_domain("") is None, problems)
+
+    client = TestClient(bind_app(engine))
+    links_url = f"{prefix}/users/{user_id}/links"
+
+    print("创建与修改：")
+    created = {}
+    for i, (url, host, domain) in enumerate(SITE_URLS):
+        response = client.post(links_url, json={"name": f"站点 {i}", "url": url})
+        created[url] = response.json()
+    check("创建链接时写入 host / domain",
+          all((created[url]["host"], created[url]["domain"]) == (host, domain) for url, host, domain in SITE_URLS),
+          problems)
+    moved = created[SITE_URLS[-1][0]]
+    updated = client.put(f"{links_url}/{moved['id']}", json={"url": "https://wiki.python.org/moin"}).json()
+    check("修改地址后更新", (updated["host"], updated["domain"]) == ("wiki.python.org", "python.org"), problems)
+    renamed = client.put(f"{links_url}/{moved['id']}", json={"name": "只改名称"}).json()
+    check("只修改名称时不变", renamed["domain"] == "python.org", problems)
+
+    print("过滤：")
+    site = client.get(links_url, params={"domain": "python.org"}).json()
+    check(f"按网站过滤（{len(site)} 个）", sorted(link["host"] for link in site)
+          == ["docs.python.org", "pypi.python.org", "wiki.python.org", "www.python.org"], problems)
+    host = client.get(links_url, params={"domain": "Docs.Python.org"}).json()
+    check("按主机过滤", [link["host"] for link in host] == ["docs.python.org"], problems)
+    check("其他网站不受影响", [link["host"] for link in client.get(links_url, params={"domain": "bbc.co.uk"}).json()]
+          == ["news.bbc.co.uk"], problems)
+    plan = query_plan("SELECT id FROM links WHERE user_id = :u AND domain = :d", u=user_id, d="python.org")
+    check(f"使用 (user_id, domain) 索引：{plan}", "ix_links_user_id_domain" in plan, problems)
+
+    print("汇总：")
+    site_ids = [link["id"] for link in site]
+    for link_id in site_ids[:2]:
+        client.post(f"{links_url}/{link_id}/click")
+    with SessionLocal() as db:
+        db.query(Link).filter(Link.id == site_ids[-1]).update({"http_status": 404, "checked_at": datetime.now()})
+        db.commit()
+    invalidate_user(user_id)
+    stats = client.get(f"{prefix}/users/{user_id}/domains", params={"limit": 100000}).json()
+    python_org = next(item for item in stats if item["domain"] == "python.org")
+    with SessionLocal() as db:
+        total = db.query(Link).filter(Link.user_id == user_id).count()
+        clicks = sum(link.clicks for link in db.query(Link).filter(Link.domain == "python.org", Link.user_id == user_id))
+    check(f"python.org：{python_org}", python_org["links"] == 4 and python_org["hosts"] == 4
+          and python_org["clicks"] == clicks >= 2 and python_org["broken"] == 1, problems)
+    check("各网站链接数之和等于链接总数", sum(item["links"] for item in stats) == total, problems)
+    check("默认按链接数排序", [item["links"] for item in stats] == sorted((item["links"] for item in stats),
+                                                                     reverse=True), problems)
+    by_clicks = client.get(f"{prefix}/users/{user_id}/domains", params={"sort": "clicks", "limit": 5}).json()
+    check("按点击数排序", len(by_clicks) == 5 and [item["clicks"] for item in by_clicks]
+          == sorted((item["clicks"] for item in by_clicks), reverse=True), problems)
+    check("不支持的排序方式返回 400",
+          client.get(f"{prefix}/users/{user_id}/domains", params={"sort": "x"}).status_code == 400, problems)
+    check("用户不存在返回 404", client.get(f"{prefix}/users/999999/domains").status_code == 404, problems)
+    plan = query_plan("SELECT domain, COUNT(id), SUM(clicks) FROM links WHERE user_id = :u AND domain IS NOT NULL "
+                      "GROUP BY domain", u=user_id)
+    check(f"汇总使用 (user_id, domain) 索引：{plan}", "ix_links_user_id_domain" in plan, problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
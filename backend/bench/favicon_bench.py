@@ -0,0 +1,168 @@
+"""
+图标缓存测试
+
+针对本地替身服务验证：并发请求同一域名只抓取一次、从首页 <link rel="icon"> 回退、
+抓取失败的域名被记录、超过容量上限后按最近使用时间淘汰。
+另外在默认（拒绝内网地址）配置下验证：重定向到 127.0.0.1、首页图标地址指向 127.0.0.1 / 元数据地址、
+解析结果中含内网地址的域名都不会被请求；公网地址之间的重定向正常跟随，请求直接发往校验过的 IP。
+
+    python -m bench.favicon_bench
+"""
+import os
+import sys
+import tempfile
+
+os.environ["FAVICON_ALLOW_PRIVATE_HOSTS"] = "true"
+
+import argparse
+import asyncio
+import socket
+import time
+import httpx
+import favicon
+from bench.standin_http import StandinServer, make_png
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="图标缓存测试")
+    parser.add_argument("--requests", type=int, default=50, help="同一域名的并发请求数")
+    args = parser.parse_args(argv)
+
+    primary = StandinServer().start()
+    # 没有 /favicon.ico，只能从首页的 <link rel="icon"> 找到图标
+    fallback = StandinServer().start()
+    fallback.routes["/favicon.ico"] = lambda request: (404, b"", {})
+    fallback.routes["/"] = lambda request: (200, b'<html><head><link rel="shortcut icon" href="/static/i.png"></head></html>',
+                                            {"Content-Type": "text/html"})
+    fallback.routes["/static/i.png"] = lambda request: (200, make_png(48, (255, 0, 0, 255)), {"Content-Type": "image/png"})
+    broken = StandinServer().start()
+    broken.routes["/favicon.ico"] = lambda request: (500, b"", {})
+
+    failures = 0
+    store = favicon.FaviconStore(tempfile.mkdtemp(), max_bytes=64 * 1024 * 1024)
+    service = favicon.FaviconService(store)
+
+    async def run():
+        nonlocal failures
+        domain = f"127.0.0.1:{primary.port}"
+        start = time.perf_counter()
+        results = await asyncio.gather(*(service.get(domain) for _ in range(args.requests)))
+        cold = time.perf_counter() - start
+        fetches = len([r for r in primary.requests if r[1] == "/favicon.ico"])
+        print(f"{args.requests} 个并发请求，实际抓取 {fetches} 次，用时 {cold * 1000:.1f}ms")
+        failures += fetches != 1 or any(r is None for r in results)
+
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            await service.get(domain)
+        print(f"命中缓存平均 {(time.perf_counter() - start) / args.requests * 1000:.3f}ms")
+
+        icon = await service.get(f"127.0.0.1:{fallback.port}")
+        print(f"首页 link 回退: {'成功' if icon else '失败'}")
+        failures += icon is None
+
+        missing = await service.get(f"127.0.0.1:{broken.port}")
+        before = len(broken.requests)
+        await service.get(f"127.0.0.1:{broken.port}")
+        print(f"失败域名再次请求的抓取次数: {len(broken.requests) - before}")
+        failures += missing is not None or len(broken.requests) != before
+
+        bundle = await service.bundle([domain, f"127.0.0.1:{fallback.port}", f"127.0.0.1:{broken.port}"])
+        print(f"打包 {len(bundle)} 个图标")
+        failures += len(bundle) != 2
+        await service.client.aclose()
+
+    asyncio.run(run())
+    failures += ssrf(primary)
+
+    # 淘汰：容量只够放一个图标
+    small = favicon.FaviconStore(tempfile.mkdtemp(), max_bytes=1)
+    small.save("a.example", make_png(16, (1, 2, 3, 255)), "image/png")
+    small.save("b.example", make_png(16, (4, 5, 6, 255)), "image/png")
+    remaining = len(list(small._objects()))
+    print(f"超过容量后剩余对象数: {remaining}")
+    failures += remaining != 0
+
+    for server in (primary, fallback, broken):
+        server.shutdown()
+    print("全部符合预期" if not failures else f"{failures} 项不符合预期")
+    return 1 if failures else 0
+
+
+# 公网域名用假的解析结果和 MockTransport 模拟，内部服务是 127.0.0.1 上的真实替身
+PUBLIC = {
+    "good.example": ["93.184.216.34"],
+    "moved.example": ["93.184.216.35"],
+    "redirect.example": ["93.184.216.36"],
+    "href.example": ["93.184.216.37"],
+    "rebind.example": ["93.184.216.38", "10.0.0.5"],
+    "metadata.example": ["169.254.169.254"],
+}
+
+
+def ssrf(internal: StandinServer) -> int:
+    failures = 0
+    internal_url = f"http://127.0.0.1:{internal.port}"
+    seen = []
+
+    def handler(request: httpx.Request):
+        host = request.headers["host"]
+        seen.append((request.url.host, host, request.extensions.get("sni_hostname")))
+        if request.url.host not in {address for addresses in PUBLIC.values() for address in addresses}:
+            # 校验失效时才会走到这里：假装内部服务返回了图标
+            return httpx.Response(200, content=make_png(16), headers={"Content-Type": "image/png"})
+        if host == "good.example":
+            return httpx.Response(200, content=make_png(16), headers={"Content-Type": "image/png"})
+        if host == "moved.example":
+            return httpx.Response(301, headers={"Location": "https://good.example/favicon.ico"})
+        if host == "redirect.example":
+            return httpx.Response(302, headers={"Location": f"{internal_url}/favicon.ico"})
+        if host == "href.example":
+            if request.url.path == "/favicon.ico":
+                return httpx.Response(404)
+            html = (f'<link rel="icon" href="{internal_url}/favicon.ico">'
+                    f'<link rel="icon" href="http://metadata.example/latest/icon.png">'
+                    f'<link rel="icon" href="http://[::ffff:127.0.0.1]:{internal.port}/favicon.ico">')
+            return httpx.Response(200, content=html.encode(), headers={"Content-Type": "text/html"})
+        return httpx.Response(200, content=make_png(16), headers={"Content-Type": "image/png"})
+
+    async def resolve(host, port):
+        if host not in PUBLIC:
+            raise socket.gaierror(host)
+        return PUBLIC[host]
+
+    async def run():
+        nonlocal failures
+        service = favicon.FaviconService(favicon.FaviconStore(tempfile.mkdtemp(), max_bytes=1 << 20),
+                                         client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+                                         resolve=resolve, allow_private=False)
+        before = len(internal.requests)
+        results = {domain: await service.get(domain)
+                   for domain in ("good.example", "moved.example", "redirect.example", "href.example",
+                                  "rebind.example", "metadata.example", f"127.0.0.1:{internal.port}")}
+        for domain, icon in results.items():
+            print(f"  {domain}: {'取得图标' if icon else '无图标'}")
+        leaked = [entry for entry in seen if not favicon.is_public_address(entry[0])]
+        pinned = all(entry[0] in PUBLIC.get(entry[1].split(":")[0], []) for entry in seen)
+        sni = any(entry == ("93.184.216.34", "good.example", "good.example") for entry in seen)
+        print(f"内网地址请求: 替身服务 {len(internal.requests) - before} 次，其他 {len(leaked)} 次；"
+              f"请求直接发往校验过的 IP: {pinned}，HTTPS 保留 SNI: {sni}")
+        failures += (results["good.example"] is None or results["moved.example"] is None
+                     or any(icon is not None for domain, icon in results.items()
+                            if domain not in ("good.example", "moved.example")))
+        failures += len(internal.requests) != before or bool(leaked) or not pinned or not sni
+        await service.client.aclose()
+
+    print("内网地址防护：")
+    asyncio.run(run())
+    addresses = ["127.0.0.1", "10.0.0.5", "169.254.169.254", "192.168.1.1", "100.64.0.1", "0.0.0.0",
+                 "224.0.0.1", "240.0.0.1", "::1", "fe80::1", "fc00::1", "::ffff:10.0.0.1"]
+    rejected = [address for address in addresses if not favicon.is_public_address(address)]
+    print(f"  拒绝 {len(rejected)}/{len(addresses)} 个内网 / 保留地址，允许 93.184.216.34: "
+          f"{favicon.is_public_address('93.184.216.34')}")
+    failures += len(rejected) != len(addresses) or not favicon.is_public_address("93.184.216.34")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(main())
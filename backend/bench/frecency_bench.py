@@ -0,0 +1,170 @@
+"""
+frecency 测试
+
+在临时 SQLite 库上验证：
+- 旧库（没有 frecency 字段）迁移后按 access_history 回填分数
+- 点击只增加一次权重，近期少量点击可以超过很久以前的大量点击
+- sort=frecency 使用 (user_id, frecency) 索引取前 K 个
+- 重归一化后分数整体缩放、排序不变，并推送 rescale 事件
+- 点击读取参考时间之后、写入之前发生的重归一化会等待点击提交，点击的权重不会加到新的尺度上
+
+    python -m bench.frecency_bench
+"""
+import os
+import sys
+import tempfile
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="frecency_bench_"), "frecency.sqlite3")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = _db_path
+os.environ["MIGRATION_BACKFILL_SLEEP"] = "0"
+
+import argparse
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from fastapi.testclient import TestClient
+from database import engine, settings, SessionLocal
+import crud
+import frecency
+import migrations
+from migrations import MigrationRunner
+from models import User, Link, AccessHistory, ChangeEvent
+from bench.checks import check, report
+from bench.datagen import generate
+from bench.app import bind_app
+import main as app_main
+
+
+def expected_scores(db, user_id):
+    """直接按定义计算 Σ exp(λ·(t − ref))，没有访问历史时按 clicks 次点击发生在 last_access 计算"""
+    rate = math.log(2) / (settings.FRECENCY_HALF_LIFE_DAYS * 86400)
+    ref = db.query(User.frecency_ref).filter(User.id == user_id).scalar()
+    scores = {}
+    for link in db.query(Link).filter(Link.user_id == user_id):
+        times = [t for (t,) in db.query(AccessHistory.timestamp).filter(
+            AccessHistory.user_id == user_id, AccessHistory.link_url == link.url)]
+        if not times and link.clicks and link.last_access:
+            times = [link.last_access] * link.clicks
+        scores[link.id] = sum(math.exp(rate * (t - ref).total_seconds()) for t in times)
+    return scores
+
+
+def same_scores(a, b):
+    scale = max(a.values()) or 1.0
+    return a.keys() == b.keys() and all(abs(a[i] - b[i]) <= 1e-9 * scale for i in a)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="frecency 测试")
+    parser.add_argument("--links", type=int, default=300)
+    parser.add_argument("--history", type=int, default=3000)
+    args = parser.parse_args(argv)
+    problems = []
+
+    print("迁移回填：")
+    user_ids = generate(engine, users=3, links=args.links, history=args.history)
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_links_user_id_frecency"))
+        connection.execute(text("ALTER TABLE links DROP COLUMN frecency"))
+        connection.execute(text("ALTER TABLE users DROP COLUMN frecency_ref"))
+        connection.execute(text("DELETE FROM schema_migrations WHERE version = 6"))
+    MigrationRunner(engine, log=lambda message: None).upgrade()
+    user_id = sorted(user_ids.values())[0]
+    with SessionLocal() as db:
+        expected = expected_scores(db, user_id)
+        stored = dict(db.query(Link.id, Link.frecency).filter(Link.user_id == user_id).all())
+    check("回填分数与按定义计算一致", same_scores(expected, stored), problems)
+
+    print("点击：")
+    app = bind_app(engine)
+    client = TestClient(app)
+    prefix = app_main.API_PREFIX
+    links = client.get(f"{prefix}/users/{user_id}/links", params={"limit": 5000}).json()
+    old, new = links[-1]["id"], links[-2]["id"]
+    now = datetime.now()
+    with SessionLocal() as db:
+        db.query(User).filter(User.id == user_id).update({User.frecency_ref: now.replace(microsecond=0) - timedelta(days=1)})
+        db.query(Link).filter(Link.user_id == user_id).update({Link.frecency: 0})
+        # 120 天前的 10 次点击
+        db.query(Link).filter(Link.id == old).update({
+            Link.frecency: 10 * crud.frecency_weight(now - timedelta(days=120), now - timedelta(days=1))})
+        db.commit()
+    for _ in range(2):
+        client.post(f"{prefix}/users/{user_id}/links/{new}/click")
+    top = client.get(f"{prefix}/users/{user_id}/links", params={"sort": "frecency", "limit": 2}).json()
+    check("近期 2 次点击排在 120 天前 10 次点击之前", [l["id"] for l in top] == [new, old], problems)
+    weight = crud.frecency_weight(datetime.now(), now.replace(microsecond=0) - timedelta(days=1))
+    check("每次点击增加 exp(λ·(now − ref))", abs(top[0]["frecency"] - 2 * weight) < 1e-6, problems)
+    check("不支持的排序方式返回 400",
+          client.get(f"{prefix}/users/{user_id}/links", params={"sort": "x"}).status_code == 400, problems)
+
+    with engine.connect() as connection:
+        plan = " ".join(str(row[-1]) for row in connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM links WHERE user_id = :u ORDER BY frecency DESC, id DESC LIMIT 10"
+        ), {"u": user_id}))
+    check(f"top-K 查询使用索引（{plan}）", "ix_links_user_id_frecency" in plan and "TEMP B-TREE" not in plan, problems)
+
+    print("重归一化：")
+    with SessionLocal() as db:
+        db.query(User).filter(User.id == user_id).update(
+            {User.frecency_ref: datetime.now().replace(microsecond=0) - timedelta(days=400)})
+        db.commit()
+        before = dict(db.query(Link.id, Link.frecency).filter(Link.user_id == user_id).all())
+    renormalized = frecency.renormalize_due()
+    with SessionLocal() as db:
+        after = dict(db.query(Link.id, Link.frecency).filter(Link.user_id == user_id).all())
+        ref = db.query(User.frecency_ref).filter(User.id == user_id).scalar()
+        event = db.query(ChangeEvent).filter(ChangeEvent.user_id == user_id).order_by(ChangeEvent.id.desc()).first()
+    factor = event.fields.get("factor") if event and event.entity == "frecency" else None
+    check(f"重归一化了 {renormalized} 个用户，参考时间已更新", renormalized >= 1 and datetime.now() - ref < timedelta(minutes=1), problems)
+    check("分数按同一系数缩放", factor is not None and all(
+        abs(after[i] - before[i] * factor) <= 1e-9 * max(1.0, before[i]) for i in before), problems)
+    rank = lambda scores: sorted(scores, key=lambda i: (-scores[i], -i))
+    check("排序不变", rank(before) == rank(after), problems)
+    check("再次执行不做任何事", frecency.renormalize_due() == 0, problems)
+
+    print("点击与重归一化并发：")
+    with SessionLocal() as db:
+        score = db.query(Link.frecency).filter(Link.id == new).scalar()
+        ref = db.query(User.frecency_ref).filter(User.id == user_id).scalar()
+    target = ref + timedelta(days=60)
+    weight_of = crud.frecency_weight
+    read_ref = threading.Event()
+
+    def slow_weight(at, base):
+        # 点击线程读取参考时间后暂停，让重归一化在这期间执行
+        if threading.current_thread().name == "click":
+            read_ref.set()
+            time.sleep(0.3)
+        return weight_of(at, base)
+
+    def click():
+        with SessionLocal() as db:
+            crud.increment_link_clicks(db, new, user_id)
+
+    crud.frecency_weight = slow_weight
+    try:
+        clicker = threading.Thread(target=click, name="click")
+        clicker.start()
+        read_ref.wait()
+        with SessionLocal() as db:
+            start = time.perf_counter()
+            factor = crud.renormalize_frecency(db, user_id, now=target)
+            waited = time.perf_counter() - start
+        clicker.join()
+    finally:
+        crud.frecency_weight = weight_of
+    with SessionLocal() as db:
+        link = db.query(Link).filter(Link.id == new).one()
+    expected = (score + weight_of(link.last_access, ref)) * factor
+    check(f"重归一化等待点击提交（{waited * 1000:.0f}ms），分数 {link.frecency:.6g} = {expected:.6g}",
+          abs(link.frecency - expected) <= 1e-9 * expected, problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+后台任务测试
+
+在临时 SQLite 库上验证：
+- 大批量操作、删除用户、清空访问历史返回 202，请求耗时不随数据量增长，任务完成后结果正确
+- 小批量操作仍在请求内执行
+- 按优先级领取；多个 worker 并发领取不会重复
+- 停止后从 checkpoint 继续，不重复处理已完成的批次；崩溃留下的任务超时后被接手
+- 每批修改与进度在同一事务中提交
+- 取消、失败重试
+
+    python -m bench.jobs_bench
+"""
+import os
+import sys
+import tempfile
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="jobs_bench_"), "jobs.sqlite3")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = _db_path
+os.environ["JOB_INLINE_LIMIT"] = "100"
+os.environ["JOB_CHUNK"] = "200"
+os.environ["JOB_RETRY_SECONDS"] = "0"
+os.environ["LINK_CHECK_ENABLED"] = "false"
+
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from database import engine, SessionLocal, settings
+from models import User, Link, AccessHistory, Job
+import jobs
+from bench.checks import check, report
+from bench.datagen import generate
+from bench.app import bind_app
+import main as app_main
+
+
+def wait_for(client, response, timeout=60):
+    job_id = response.json()["job_id"]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"{app_main.API_PREFIX}/jobs/{job_id}").json()
+        if job["status"] in jobs.FINISHED:
+            return job
+        time.sleep(0.05)
+    return job
+
+
+# 测试用任务：按批处理 0..total-1，记录处理过的批次
+processed = []
+stop_after = {"chunks": None, "event": None}
+
+@jobs.handler("bench.count")
+def run_count(db, job):
+    offset = job.checkpoint.get("offset", 0)
+    job.total = job.params["total"]
+    while offset < job.total:
+        processed.append(offset)
+        offset = min(offset + job.params["chunk"], job.total)
+        if stop_after["chunks"] is not None and len(processed) >= stop_after["chunks"]:
+            stop_after["event"].set()
+        yield {"offset": offset}, offset
+    return {"count": job.total}
+
+@jobs.handler("bench.fail")
+def run_fail(db, job):
+    raise RuntimeError("模拟失败")
+    yield
+
+
+def submit(kind, priority=jobs.PRIORITY_NORMAL, **params):
+    with SessionLocal() as db:
+        return jobs.submit(db, kind, params=params, priority=priority).id
+
+
+def job_row(job_id):
+    with SessionLocal() as db:
+        return db.query(Job).filter(Job.id == job_id).one()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="后台任务测试")
+    parser.add_argument("--links", type=int, default=3000)
+    args = parser.parse_args(argv)
+    problems = []
+    prefix = app_main.API_PREFIX
+
+    user_ids = generate(engine, users=3, links=args.links, history=3000)
+    first, second, third = sorted(user_ids.values())
+    app = bind_app(engine)
+
+    print("接口：")
+    with TestClient(app) as client:
+        with SessionLocal() as db:
+            urls = [url for (url,) in db.query(Link.url).filter(Link.user_id == first)]
+        start = time.perf_counter()
+        response = client.post(f"{prefix}/users/{first}/links/batch/category",
+                               json={"link_urls": urls, "category": "后台任务"})
+        elapsed = time.perf_counter() - start
+        check(f"{len(urls)} 个链接的批量操作返回 202（{elapsed * 1000:.1f}ms）",
+              response.status_code == 202 and response.headers["location"] == response.json()["status_url"], problems)
+        job = wait_for(client, response)
+        with SessionLocal() as db:
+            remaining = db.query(Link).filter(Link.user_id == first, Link.category != "后台任务").count()
+        check(f"任务完成（{job['done']}/{job['total']}，{job['result']['message']}）",
+              job["status"] == "succeeded" and job["progress"] == 1.0 and remaining == 0, problems)
+
+        small = client.post(f"{prefix}/users/{first}/links/batch/tags", json={"link_urls": urls[:10], "tags": ["x"]})
+        check("小批量操作在请求内执行", small.status_code == 200 and "message" in small.json(), problems)
+
+        response = client.delete(f"{prefix}/users/{second}/access-history")
+        job = wait_for(client, response)
+        with SessionLocal() as db:
+            left = db.query(AccessHistory).filter(AccessHistory.user_id == second).count()
+        check(f"清空访问历史（{job['result']['deleted']} 条）",
+              response.status_code == 202 and job["status"] == "succeeded" and left == 0, problems)
+
+        response = client.delete(f"{prefix}/users/{third}")
+        job = wait_for(client, response)
+        with SessionLocal() as db:
+            gone = db.query(User).filter(User.id == third).count() == 0
+            orphans = db.query(Link).filter(Link.user_id == third).count()
+        check(f"删除用户（{job['result']['deleted']} 行）",
+              response.status_code == 202 and job["status"] == "succeeded" and gone and orphans == 0, problems)
+        check("不存在的任务返回 404", client.get(f"{prefix}/jobs/999999").status_code == 404, problems)
+
+    print("领取：")
+    low = submit("bench.count", total=10, chunk=10)
+    high = submit("bench.count", priority=jobs.PRIORITY_INTERACTIVE, total=10, chunk=10)
+    claimed = [jobs.claim_next("w1").id, jobs.claim_next("w1").id]
+    check("优先级高的任务先执行", claimed == [high, low], problems)
+
+    ids = [submit("bench.count", total=10, chunk=10) for _ in range(40)]
+    def claim_all(worker):
+        got = []
+        while (job := jobs.claim_next(worker)) is not None:
+            got.append(job.id)
+        return got
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(claim_all, [f"w{i}" for i in range(4)]))
+    flat = [job_id for got in results for job_id in got]
+    check(f"4 个 worker 并发领取 {len(flat)} 个任务，没有重复",
+          len(flat) == len(set(flat)) and set(flat) == set(ids), problems)
+
+    print("中断与继续：")
+    job_id = submit("bench.count", total=1000, chunk=100)
+    processed.clear()
+    stop_after.update(chunks=3, event=threading.Event())
+    status = jobs.execute(jobs.claim_next("w1"), "w1", stop_after["event"])
+    row = job_row(job_id)
+    check(f"停止后放回队列（checkpoint={row.checkpoint}，进度 {row.done}/{row.total}）",
+          status == "queued" and row.status == "queued" and row.checkpoint == {"offset": 300}, problems)
+    processed.clear()
+    stop_after.update(chunks=None, event=None)
+    status = jobs.execute(jobs.claim_next("w2"), "w2")
+    row = job_row(job_id)
+    check("从 checkpoint 继续", status == "succeeded" and processed[0] == 300
+          and row.done == 1000 and row.result == {"count": 1000}, problems)
+
+    job_id = submit("bench.count", total=1000, chunk=100)
+    crashed = jobs.claim_next("crashed")
+    check("未超时的执行中任务不会被接手", jobs.claim_next("w3") is None, problems)
+    with SessionLocal() as db:
+        db.query(Job).filter(Job.id == job_id).update(
+            {"heartbeat_at": datetime.now() - timedelta(seconds=settings.JOB_STALE_SECONDS + 1)})
+        db.commit()
+    taken = jobs.claim_next("w3")
+    check("崩溃留下的任务超时后被接手", taken is not None and taken.id == job_id, problems)
+    check("原 worker 不能再保存进度", jobs.execute(crashed, "crashed") == "lost"
+          and jobs.execute(taken, "w3") == "succeeded", problems)
+
+    print("取消与失败：")
+    job_id = submit("bench.count", total=1000, chunk=100)
+    job = jobs.claim_next("w1")
+    with TestClient(app) as client:
+        cancelled = client.delete(f"{prefix}/jobs/{job_id}").json()
+    processed.clear()
+    check("取消后在下一批停止", cancelled["status"] == "cancelled"
+          and jobs.execute(job, "w1") == "lost" and len(processed) == 1, problems)
+
+    with SessionLocal() as db:
+        urls = [url for (url,) in db.query(Link.url).filter(Link.user_id == first)]
+        job_id = jobs.submit(db, "links.batch", user_id=first, total=len(urls),
+                             params={"action": "category", "link_urls": urls, "category": "取消前"}).id
+    job = jobs.claim_next("w1")
+    with SessionLocal() as db:
+        jobs.cancel(db, job_id)
+    status = jobs.execute(job, "w1")
+    with SessionLocal() as db:
+        written = db.query(Link).filter(Link.user_id == first, Link.category == "取消前").count()
+    check(f"本批修改与进度在同一事务中提交，取消后本批一并回滚（已写入 {written} 行）",
+          status == "lost" and written == 0, problems)
+
+    job_id = submit("bench.fail")
+    statuses = [jobs.execute(jobs.claim_next("w1"), "w1") for _ in range(settings.JOB_MAX_ATTEMPTS)]
+    row = job_row(job_id)
+    check(f"失败重试 {settings.JOB_MAX_ATTEMPTS} 次后标记失败（{row.error}）",
+          statuses[-1] == "failed" and statuses[:-1] == ["queued"] * (settings.JOB_MAX_ATTEMPTS - 1)
+          and row.status == "failed", problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
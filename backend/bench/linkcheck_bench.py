@@ -0,0 +1,272 @@
+"""
+失效链接检查测试
+
+在 SQLite 临时库中写入指向本地替身服务的链接（慢速、重定向、失败、不支持 HEAD 等），
+运行一轮检查并核对每个链接的结果，同时输出耗时和替身服务观察到的最大并发数。
+另外验证：链接很多的主机不会拖慢其他主机的检查、重定向的每一跳都遵守主机间隔、
+检查期间修改了地址的链接不会被旧地址的结果覆盖、到期链接的查询直接使用 next_check_at 索引、
+指向内网地址（包括重定向到内网地址）的链接不会被请求，记为跳过、
+空闲的主机状态会被清理，占用中的主机不会。
+
+    python -m bench.linkcheck_bench --links 200
+"""
+import os
+import sys
+import tempfile
+
+# 必须在导入 database 之前设置
+_db_path = os.path.join(tempfile.mkdtemp(), "linkcheck.sqlite3")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = _db_path
+os.environ["LINK_CHECK_ALLOW_PRIVATE_HOSTS"] = "true"  # 替身服务在 127.0.0.1 上；ssrf() 中单独关闭
+
+import argparse
+import asyncio
+import socket
+import time
+import httpx
+from sqlalchemy import insert, text
+from database import engine, SessionLocal
+import crud
+import schemas
+from migrations import MigrationRunner
+from models import User, Link
+import linkcheck
+from bench.standin_http import StandinServer
+
+# 路径 -> 期望的 (http_status, 是否有 final_url)
+EXPECTED = {
+    "/ok": (200, False),
+    "/slow?delay=0.5": (200, False),
+    "/redirect": (200, True),
+    "/redirect-loop": (0, False),
+    "/notfound": (404, False),
+    "/error": (500, False),
+    "/head-not-allowed": (200, False),
+    "/drop": (0, False),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="失效链接检查测试")
+    parser.add_argument("--links", type=int, default=80)
+    parser.add_argument("--per-host", type=int, default=2)
+    parser.add_argument("--host-delay", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    server = StandinServer().start()
+    MigrationRunner(engine, log=lambda message: None).upgrade()
+    paths = list(EXPECTED)
+    with SessionLocal() as db:
+        db.execute(insert(User), [{"name": "linkcheck", "password_hash": None}])
+        user_id = db.query(User.id).scalar()
+        # 通过 query 参数区分 URL，使每个链接都真正发出请求
+        db.execute(insert(Link), [{
+            "user_id": user_id,
+            "name": f"link {i}",
+            "url": f"http://127.0.0.1:{server.port}{paths[i % len(paths)]}{'&' if '?' in paths[i % len(paths)] else '?'}n={i}",
+        } for i in range(args.links)])
+        db.commit()
+
+    async def run():
+        checker = linkcheck.LinkChecker(per_host=args.per_host, host_delay=args.host_delay, timeout=3)
+        try:
+            first = await linkcheck.check_due_links(checker)
+            second = await linkcheck.check_due_links(checker)
+            return first, second
+        finally:
+            await checker.close()
+
+    start = time.perf_counter()
+    checked, rechecked = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    print(f"检查 {checked} 个链接，用时 {elapsed:.2f}s；替身服务最大并发 {server.max_in_flight}（单主机上限 {args.per_host}）")
+    print(f"第二轮到期链接数 {rechecked}（应为 0：结果已按退避时间排期）")
+
+    failures = 0
+    with SessionLocal() as db:
+        for link in db.query(Link).order_by(Link.id):
+            path = link.url.split(str(server.port), 1)[1].rsplit("n=", 1)[0].rstrip("?&")
+            status, redirected = EXPECTED[path]
+            if link.http_status != status or bool(link.final_url) != redirected or link.next_check_at is None:
+                failures += 1
+                print(f"  不符合预期: {link.url} status={link.http_status} final_url={link.final_url}")
+    if server.max_in_flight > args.per_host or rechecked:
+        failures += 1
+    failures += scheduling(server)
+    failures += host_eviction()
+    failures += url_change(server, user_id)
+    failures += due_query_plan()
+    failures += ssrf(server, user_id)
+    print("全部符合预期" if not failures else f"{failures} 项不符合预期")
+    server.shutdown()
+    return 1 if failures else 0
+
+
+def scheduling(server: StandinServer) -> int:
+    """全局并发 4、单主机并发 1、间隔 0.3s：同一主机 12 个链接，另一主机（localhost）1 个链接"""
+    failures = 0
+    busy = [f"http://127.0.0.1:{server.port}/ok?busy={i}" for i in range(12)]
+    idle = f"http://localhost:{server.port}/ok?idle=1"
+
+    async def run():
+        checker = linkcheck.LinkChecker(concurrency=4, per_host=1, host_delay=0.3, timeout=3)
+        start = time.perf_counter()
+        finished = {}
+
+        async def one(url):
+            await checker.check(url)
+            finished[url] = time.perf_counter() - start
+
+        try:
+            await asyncio.gather(*(one(url) for url in busy + [idle]))
+            redirect_start = len(server.requests)
+            await checker.check(f"http://127.0.0.1:{server.port}/redirect?hop=1")
+            hops = [entry[3] for entry in server.requests[redirect_start:]]
+        finally:
+            await checker.close()
+        return finished, time.perf_counter() - start, hops
+
+    finished, total, hops = asyncio.run(run())
+    print(f"繁忙主机 12 个链接共用时 {max(finished[url] for url in busy):.2f}s，"
+          f"空闲主机的链接 {finished[idle]:.2f}s 完成")
+    failures += finished[idle] > 0.3
+    gaps = [b - a for a, b in zip(hops, hops[1:])]
+    print(f"重定向 {len(hops)} 跳，间隔 {[round(gap, 2) for gap in gaps]}s（主机间隔 0.3s）")
+    failures += len(hops) != 2 or any(gap < 0.29 for gap in gaps)
+    return failures
+
+
+def host_eviction() -> int:
+    """依次请求 2000 个不同主机后，只保留仍在使用或仍在间隔内的主机状态"""
+    async def run():
+        limiter = linkcheck.HostLimiter(per_host=1, delay=0.05)
+        await limiter.acquire("held.example")
+        for i in range(2000):
+            await limiter.acquire(f"host{i}.example")
+            limiter.release(f"host{i}.example")
+        peak = len(limiter)
+        await asyncio.sleep(1.05)  # 超过扫描周期（至少 1 秒）
+        await limiter.acquire("recent.example")
+        limiter.release("recent.example")
+        remaining = sorted(limiter._hosts)
+        limiter.release("held.example")
+        return peak, remaining
+
+    peak, remaining = asyncio.run(run())
+    print(f"主机状态：请求 2000 个主机后最多保留 {peak} 个，空闲超过间隔后剩余 {remaining}")
+    return remaining != ["held.example", "recent.example"]
+
+
+def url_change(server: StandinServer, user_id: int) -> int:
+    """检查进行中修改地址：旧地址的结果不写回；修改地址清空旧的检查结果"""
+    failures = 0
+    old_url = f"http://127.0.0.1:{server.port}/notfound?edit=1"
+    new_url = f"http://127.0.0.1:{server.port}/ok?edit=1"
+    with SessionLocal() as db:
+        link = crud.create_link(db, schemas.LinkCreate(name="edit", url=f"http://127.0.0.1:{server.port}/ok?edit=0"),
+                                user_id)
+        link_id = link.id
+        db.query(Link).filter(Link.id != link_id).update({"next_check_at": linkcheck.datetime(2999, 1, 1)})
+        link.url, link.http_status, link.etag, link.check_failures = old_url, 404, '"old"', 3
+        link.next_check_at = linkcheck.datetime(2000, 1, 1)
+        db.commit()
+
+    async def run():
+        checker = linkcheck.LinkChecker(timeout=3)
+        original = checker.check
+
+        async def check_and_edit(url, etag=None, last_modified=None):
+            result = await original(url, etag, last_modified)
+            with SessionLocal() as db:  # 模拟检查期间用户修改了地址
+                crud.update_link(db, link_id, user_id, schemas.LinkUpdate(url=new_url))
+            return result
+
+        checker.check = check_and_edit
+        try:
+            return await linkcheck.check_due_links(checker)
+        finally:
+            await checker.close()
+
+    checked = asyncio.run(run())
+    with SessionLocal() as db:
+        link = db.query(Link).filter(Link.id == link_id).one()
+        fields = (link.url, link.http_status, link.etag, link.checked_at, link.check_failures, link.next_check_at)
+    print(f"检查期间修改地址：检查 {checked} 个，修改后 {fields[1:]}")
+    failures += checked != 1 or fields != (new_url, None, None, None, 0, None)
+    due = linkcheck.load_due_links(10)
+    failures += [row["url"] for row in due] != [new_url]
+    return failures
+
+
+def due_query_plan() -> int:
+    plans = []
+    with engine.connect() as connection:
+        for condition in ("next_check_at IS NULL", "next_check_at <= '2030-01-01' ORDER BY next_check_at"):
+            rows = connection.execute(text(f"EXPLAIN QUERY PLAN SELECT id FROM links WHERE {condition} LIMIT 10"))
+            plans.append(" ".join(str(row[-1]) for row in rows))
+    print(f"到期链接查询计划：{plans}")
+    return not all("ix_links_next_check_at" in plan and "TEMP B-TREE" not in plan for plan in plans)
+
+
+def ssrf(server: StandinServer, user_id: int) -> int:
+    """关闭 allow_private：内网目标和重定向到内网的链接不发出请求，记为跳过且不计入失效"""
+    failures = 0
+    internal = f"http://127.0.0.1:{server.port}/ok?ssrf=1"
+    public = {"good.example": ["93.184.216.34"], "redirect.example": ["93.184.216.35"],
+              "metadata.example": ["10.0.0.5"], "mixed.example": ["93.184.216.36", "127.0.0.1"]}
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append((request.url.host, request.headers["host"]))
+        if request.headers["host"] == "redirect.example":
+            return httpx.Response(302, headers={"Location": internal})
+        return httpx.Response(200)
+
+    async def resolve(host, port):
+        if host not in public:
+            raise socket.gaierror(host)
+        return public[host]
+
+    urls = {
+        "http://good.example/": 200,
+        "http://redirect.example/": linkcheck.SKIPPED_STATUS,
+        internal: linkcheck.SKIPPED_STATUS,
+        "http://169.254.169.254/latest/meta-data/": linkcheck.SKIPPED_STATUS,
+        "http://metadata.example/": linkcheck.SKIPPED_STATUS,
+        "http://mixed.example/": linkcheck.SKIPPED_STATUS,
+        f"http://localhost:{server.port}/ok": linkcheck.SKIPPED_STATUS,
+        "http://[::ffff:10.0.0.1]/": linkcheck.SKIPPED_STATUS,
+        "http://missing.example/": 0,
+    }
+    with SessionLocal() as db:
+        db.query(Link).update({"next_check_at": linkcheck.datetime(2999, 1, 1)})
+        for url in urls:
+            crud.create_link(db, schemas.LinkCreate(name="ssrf", url=url), user_id)
+
+    async def run():
+        checker = linkcheck.LinkChecker(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+                                        host_delay=0, timeout=3, resolve=resolve, allow_private=False)
+        try:
+            return await linkcheck.check_due_links(checker)
+        finally:
+            await checker.close()
+
+    before = len(server.requests)
+    checked = asyncio.run(run())
+    with SessionLocal() as db:
+        rows = {link.url: (link.http_status, link.check_failures, link.final_url)
+                for link in db.query(Link).filter(Link.url.in_(list(urls)), Link.user_id == user_id)}
+        health = crud.get_link_health(db, user_id)
+    wrong = {url: rows.get(url) for url, status in urls.items() if rows.get(url, (None,))[0] != status}
+    leaked = [entry for entry in seen if entry[0] != "93.184.216.34" and entry[0] != "93.184.216.35"]
+    print(f"内网地址防护：检查 {checked} 个，跳过 {health['skipped']} 个，替身服务收到 "
+          f"{len(server.requests) - before} 次请求，发往内网地址 {len(leaked)} 次，不符合预期 {wrong}")
+    failures += checked != len(urls) or bool(wrong) or bool(leaked) or len(server.requests) != before
+    failures += health["skipped"] != len(urls) - 2
+    failures += any(rows[url][1] for url, status in urls.items() if status == linkcheck.SKIPPED_STATUS)
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(main())
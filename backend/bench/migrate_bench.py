@@ -0,0 +1,118 @@
+"""
+数据库迁移测试
+
+在临时 SQLite 库上验证：
+- 新库执行全部迁移，重复执行不做任何事
+- 没有迁移记录的旧库（缺少后加的字段和索引）可以直接升级
+- --dry-run 不修改表结构、不执行回填，并给出预计耗时
+- 数据回填中断后从 checkpoint 继续，而不是从头开始
+- 启动时的版本检查耗时
+
+    python -m bench.migrate_bench
+"""
+import os
+import sys
+import tempfile
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="migrate_bench_"), "migrate.sqlite3")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = _db_path
+os.environ["MIGRATION_BACKFILL_SLEEP"] = "0"
+
+import argparse
+import time
+from sqlalchemy import inspect, text
+from database import engine
+import migrations
+from migrations import MigrationRunner, Migration, AddColumn, Backfill, schema_migrations
+from bench.checks import check, report
+from bench.datagen import generate
+
+
+def quiet(message):
+    pass
+
+
+def columns(table):
+    return {c["name"] for c in inspect(engine).get_columns(table)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数据库迁移测试")
+    parser.add_argument("--links", type=int, default=5000)
+    args = parser.parse_args(argv)
+    problems = []
+
+    print("新库：")
+    generate(engine, users=5, links=args.links // 5, history=100)
+    check("全部版本已完成", migrations.pending_versions(engine) == [], problems)
+    check("重复执行不做任何事", MigrationRunner(engine, log=quiet).upgrade() == [], problems)
+
+    print("旧库（无迁移记录，缺少后加的字段）：")
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_links_next_check_at"))
+        for column in ("http_status", "final_url", "checked_at", "etag", "last_modified", "check_failures", "next_check_at"):
+            connection.execute(text(f"ALTER TABLE links DROP COLUMN {column}"))
+        connection.execute(text("ALTER TABLE user_settings DROP COLUMN page_subtitle"))
+    schema_migrations.drop(engine)
+    check("检测到待执行版本", migrations.pending_versions(engine) == [m.version for m in migrations.MIGRATIONS], problems)
+    try:
+        migrations.ensure_schema(engine)
+        check("版本落后时拒绝启动", False, problems)
+    except migrations.SchemaOutdatedError:
+        check("版本落后时拒绝启动", True, problems)
+    MigrationRunner(engine, log=quiet).upgrade()
+    check("字段已补齐", {"next_check_at", "check_failures"} <= columns("links")
+          and "page_subtitle" in columns("user_settings"), problems)
+    check("索引已补齐", "ix_links_next_check_at" in {i["name"] for i in inspect(engine).get_indexes("links")}, problems)
+
+    print("回填（中断后继续）：")
+    calls = []
+    fail_after = {"chunks": 3}
+
+    def fill_name_length(connection, lo, hi):
+        calls.append(lo)
+        if len(calls) > fail_after["chunks"]:
+            raise KeyboardInterrupt
+        return connection.execute(text(
+            "UPDATE links SET name_length = LENGTH(name) WHERE id > :lo AND id <= :hi AND name_length IS NULL"
+        ), {"lo": lo, "hi": hi}).rowcount
+
+    extra = migrations.MIGRATIONS + [Migration(99, "add_name_length", [
+        AddColumn("links", "name_length", "INTEGER"),
+        Backfill("name_length", "links", fill_name_length, chunk=500),
+    ])]
+    runner = MigrationRunner(engine, migrations=extra, log=quiet)
+    runner.dry_run()
+    check("dry-run 不修改表结构", "name_length" not in columns("links"), problems)
+    check("dry-run 不执行回填", not calls, problems)
+
+    calls.clear()
+    try:
+        runner.upgrade()
+    except KeyboardInterrupt:
+        pass
+    with engine.connect() as connection:
+        state = connection.execute(schema_migrations.select().where(schema_migrations.c.version == 99)).first()
+    check(f"中断后记录进度（checkpoint={state.checkpoint}）", state.status == "running" and state.checkpoint is not None, problems)
+    check("中断的版本仍为待执行", 99 in migrations.pending_versions(engine, extra), problems)
+
+    calls.clear()
+    fail_after["chunks"] = 10 ** 9
+    runner.upgrade()
+    check("从 checkpoint 继续", calls and calls[0] == state.checkpoint, problems)
+    with engine.connect() as connection:
+        missing = connection.execute(text("SELECT COUNT(*) FROM links WHERE name_length IS NULL")).scalar()
+    check("回填完成", missing == 0 and migrations.pending_versions(engine, extra) == [], problems)
+
+    print("启动检查：")
+    start = time.perf_counter()
+    for _ in range(100):
+        migrations.ensure_schema(engine)
+    print(f"  ensure_schema 平均 {(time.perf_counter() - start) * 10:.2f}ms")
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
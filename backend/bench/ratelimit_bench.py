@@ -0,0 +1,203 @@
+"""
+限流与过载保护测试
+
+在临时 SQLite 库上验证：
+- 令牌桶按 (用户, 类别) 计数：超出后返回 429 + Retry-After，其他用户、其他类别不受影响，令牌按速率恢复
+- 经过可信代理的匿名请求（分享页）按转发头中的客户端 IP 分别计数，伪造的转发头不能绕过限流
+- 同一台机器上的多个进程通过 local 后端共用令牌桶
+- Redis 不可用时退回进程内令牌桶，不阻塞请求
+- 并发上限与过载保护返回 503 + Retry-After
+- 搜索请求的语句超时：超时返回 503，之后同一连接上的普通请求不受影响
+
+    python -m bench.ratelimit_bench
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="ratelimit_bench_")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "ratelimit.sqlite3")
+os.environ["RATE_LIMIT_CONCURRENCY_WAIT"] = "0.1"
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from database import engine
+import ratelimit
+from ratelimit import RateLimitMiddleware, MemoryBuckets, LocalBuckets, RedisBuckets
+from bench.checks import check, report
+from bench.datagen import generate
+from bench.app import bind_app
+import main as app_main
+
+PREFIX = app_main.API_PREFIX
+
+
+async def slow_app(scope, receive, send):
+    """每个请求耗时 0.3 秒的替身应用"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            await send({"type": message["type"] + ".complete"})
+            if message["type"] == "lifespan.shutdown":
+                return
+    await asyncio.sleep(0.3)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def take_redis(stalled: bool):
+    """5 个并发请求取容量 3 的桶，同时用一个定时任务测量事件循环是否被阻塞"""
+    server = None
+    url = "redis://127.0.0.1:1/0"
+    if stalled:
+        # 接受连接但从不回复
+        server = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+        url = f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}/0"
+    store = RedisBuckets(url)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(store.take_async("click:u1", 1, 3) for _ in range(5)))
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    if server is not None:
+        server.close()
+    return results, elapsed, ticks
+
+
+def take_local(path):
+    store = LocalBuckets(path)
+    return sum(store.take("click:u1", 0.001, 10) == 0 for _ in range(20))
+
+
+def statuses(client, path, n, **kwargs):
+    return [client.get(path, **kwargs).status_code for _ in range(n)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="限流与过载保护测试")
+    parser.add_argument("--links", type=int, default=20000)
+    args = parser.parse_args(argv)
+    problems = []
+
+    user_ids = generate(engine, users=2, links=args.links, history=0)
+    first, second = sorted(user_ids.values())
+    app = bind_app(engine)
+
+    print("令牌桶：")
+    limited = RateLimitMiddleware(app, PREFIX, store=MemoryBuckets(), limits={"click": (2, 5), "read": (100, 100)},
+                                  concurrency={}, timeouts={}, max_in_flight=None)
+    with TestClient(limited) as client:
+        link_id = client.get(f"{PREFIX}/users/{first}/links", params={"limit": 1}).json()[0]["id"]
+        click = f"{PREFIX}/users/{first}/links/{link_id}/click"
+        responses = [client.post(click) for _ in range(8)]
+        codes = [r.status_code for r in responses]
+        check(f"桶容量 5：{codes}", codes == [200] * 5 + [429] * 3
+              and responses[-1].headers.get("retry-after") == "1", problems)
+        check("其他类别不受影响", client.get(f"{PREFIX}/users/{first}/links", params={"limit": 1}).status_code == 200,
+              problems)
+        other = client.get(f"{PREFIX}/users/{second}/links", params={"limit": 1}).json()[0]["id"]
+        check("其他用户不受影响",
+              client.post(f"{PREFIX}/users/{second}/links/{other}/click").status_code == 200, problems)
+        time.sleep(0.55)
+        check("按速率恢复令牌", client.post(click).status_code == 200 and client.post(click).status_code == 429,
+              problems)
+        start = time.perf_counter()
+        for _ in range(200):
+            client.post(click)
+        print(f"  被限流的请求平均 {(time.perf_counter() - start) / 200 * 1000:.2f}ms（经过 TestClient）")
+
+    classifier = ratelimit.RouteClassifier(PREFIX)
+    check("搜索单独计数", classifier.classify("GET", f"{PREFIX}/users/1/links", b"search=abc") == ("search", "u1")
+          and classifier.classify("GET", f"{PREFIX}/users/1/links", b"search=") == ("read", "u1")
+          and classifier.classify("GET", f"{PREFIX}/users/1/changes", b"") is None, problems)
+
+    print("代理之后的客户端地址：")
+    resolve = ratelimit.ClientAddress("10.0.0.0/8,127.0.0.1")
+
+    def scope(peer, forwarded=None):
+        headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+        return {"type": "http", "client": (peer, 1234), "headers": headers}
+
+    cases = {
+        "直接连接": (scope("203.0.113.5"), "203.0.113.5"),
+        "不可信的连接方带转发头": (scope("203.0.113.5", "198.51.100.1"), "203.0.113.5"),
+        "经过可信代理": (scope("10.0.0.2", "198.51.100.1"), "198.51.100.1"),
+        "客户端伪造最左侧地址": (scope("10.0.0.2", "1.2.3.4, 198.51.100.1, 10.0.0.9"), "198.51.100.1"),
+        "格式错误的转发头": (scope("10.0.0.2", "bogus"), "10.0.0.2"),
+    }
+    wrong = {label: resolve(request) for label, (request, expected) in cases.items() if resolve(request) != expected}
+    check(f"按转发头取客户端 IP（不符合: {wrong}）", not wrong, problems)
+
+    behind_proxy = RateLimitMiddleware(slow_app, PREFIX, store=MemoryBuckets(), limits={"public": (0.001, 3)},
+                                       concurrency={}, timeouts={}, max_in_flight=None, client_address=resolve)
+
+    async def via_proxy(scope, receive, send):
+        # TestClient 的连接方固定为 "testclient"，这里改成代理的地址
+        await behind_proxy({**scope, "client": ("10.0.0.2", 1234)}, receive, send)
+
+    with TestClient(via_proxy) as client:
+        share = f"{PREFIX}/share/abc"
+        visitors = [statuses(client, share, 3, headers={"X-Forwarded-For": f"198.51.100.{i}"}) for i in range(5)]
+        again = client.get(share, headers={"X-Forwarded-For": "198.51.100.0"}).status_code
+        spoofed = client.get(share, headers={"X-Forwarded-For": "1.1.1.1, 198.51.100.0"}).status_code
+    check(f"分享页按访客分别计数（{visitors}），同一访客超出后 {again}，伪造转发头 {spoofed}",
+          all(codes == [200] * 3 for codes in visitors) and again == 429 and spoofed == 429, problems)
+
+    print("共享状态：")
+    path = os.path.join(_tmp, "buckets")
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        taken = pool.map(take_local, [path, path])
+    check(f"两个进程共用容量 10 的桶，共取得 {sum(taken)} 个令牌", sum(taken) == 10, problems)
+
+    for label, stalled in (("Redis 不可用", False), ("Redis 无响应", True)):
+        results, elapsed, ticks = asyncio.run(take_redis(stalled))
+        check(f"{label}时退回进程内令牌桶（{elapsed * 1000:.1f}ms，期间事件循环运行 {ticks} 次）",
+              sorted(r == 0 for r in results) == [False] * 2 + [True] * 3 and elapsed < 0.5
+              and ticks >= int(elapsed / 0.01) // 2, problems)
+
+    print("并发上限与过载保护：")
+    capped = RateLimitMiddleware(slow_app, PREFIX, store=None, concurrency={"search": 1}, timeouts={},
+                                 max_in_flight=None)
+    with TestClient(capped) as client, ThreadPoolExecutor(4) as executor:
+        codes = list(executor.map(lambda _: client.get(f"{PREFIX}/users/1/links", params={"search": "x"}).status_code,
+                                  range(4)))
+    check(f"搜索并发上限 1：{sorted(codes)}", sorted(codes) == [200, 503, 503, 503], problems)
+
+    shedding = RateLimitMiddleware(slow_app, PREFIX, store=None, concurrency={}, timeouts={}, max_in_flight=2)
+    with TestClient(shedding) as client, ThreadPoolExecutor(5) as executor:
+        responses = list(executor.map(lambda i: client.get(f"{PREFIX}/users/{i}/links"), range(5)))
+        health = client.get("/health").status_code
+    codes = sorted(r.status_code for r in responses)
+    check(f"处理中请求达到上限后返回 503：{codes}", codes == [200, 200, 503, 503, 503]
+          and all(r.headers.get("retry-after") for r in responses if r.status_code == 503), problems)
+    check("健康检查不受过载保护影响", health == 200, problems)
+
+    print("语句超时：")
+    timed = RateLimitMiddleware(app, PREFIX, store=None, concurrency={}, timeouts={"search": 1}, max_in_flight=None)
+    with TestClient(timed, raise_server_exceptions=False) as client:
+        start = time.perf_counter()
+        response = client.get(f"{PREFIX}/users/{first}/links", params={"search": "不存在的关键字", "limit": 5000})
+        elapsed = time.perf_counter() - start
+        check(f"搜索超时返回 503（{elapsed * 1000:.1f}ms，{response.json().get('detail')}）",
+              response.status_code == 503 and response.headers.get("retry-after"), problems)
+        codes = statuses(client, f"{PREFIX}/users/{first}/links", 5, params={"limit": 5000})
+        check("之后的普通请求不受影响", codes == [200] * 5, problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+读写分离测试
+
+主库和副本都是临时 SQLite 文件，副本是写入前的快照（模拟复制延迟），验证：
+- 写请求的响应带有 X-Write-Marker，带回该标记的读请求在 REPLICA_STICKY_SECONDS 内读主库
+- 标记只依赖客户端，换一个 worker（新的路由实例）同样生效；过期后恢复读副本
+- 只读会话在副本上找不到用户设置时到主库确认，不会重复创建
+- 并发读取缺少设置的用户只创建一行
+- 启用读缓存时，缓存未命中读主库，不会把副本上的旧数据以新版本号缓存下来
+
+    python -m bench.replica_bench
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="replica_bench_")
+_replica_path = os.path.join(_tmp, "replica.sqlite3")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "primary.sqlite3")
+os.environ["DB_REPLICA_URLS"] = f"sqlite:///{_replica_path}"
+os.environ["REPLICA_STICKY_SECONDS"] = "1"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+import argparse
+import threading
+import time
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+import cache
+import crud
+import database
+from database import engine, SessionLocal, ReplicaRouter, WRITE_MARKER_HEADER
+from bench.checks import check, report
+from bench.datagen import generate
+import main as app_main
+
+PREFIX = app_main.API_PREFIX
+
+
+def settings_rows(user_id):
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT COUNT(*) FROM user_settings WHERE user_id = :u"), {"u": user_id}).scalar()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="读写分离测试")
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args(argv)
+    problems = []
+
+    user_ids = generate(engine, users=2, links=10, history=0)
+    alice, bob = sorted(user_ids.values())
+    with engine.connect() as connection:
+        connection.exec_driver_sql(f"VACUUM INTO '{_replica_path}'")
+
+    print("写入标记：")
+    client = TestClient(app_main.app)
+    response = client.post(f"{PREFIX}/users", json={"name": "新用户", "password": "secret123"})
+    marker = response.headers.get(WRITE_MARKER_HEADER)
+    new_user = response.json()["id"]
+    check(f"写请求返回 {WRITE_MARKER_HEADER}（{marker}）", response.status_code == 201 and marker is not None, problems)
+    status = client.get(f"{PREFIX}/users/{new_user}/settings").status_code
+    check(f"不带标记读副本（尚未复制，{status}）", status == 404, problems)
+    status = client.get(f"{PREFIX}/users/{new_user}/settings", headers={WRITE_MARKER_HEADER: marker}).status_code
+    check(f"带回标记读主库（{status}）", status == 200, problems)
+    other_worker = ReplicaRouter([], sticky_seconds=database.settings.REPLICA_STICKY_SECONDS, retry_seconds=30)
+    check("其他 worker 同样认可该标记", other_worker.is_sticky(marker), problems)
+    read = client.get(f"{PREFIX}/users/{alice}/links")
+    check("读请求不返回标记", read.status_code == 200 and WRITE_MARKER_HEADER not in read.headers, problems)
+    time.sleep(database.settings.REPLICA_STICKY_SECONDS + 0.5)
+    status = client.get(f"{PREFIX}/users/{new_user}/settings", headers={WRITE_MARKER_HEADER: marker}).status_code
+    check(f"标记过期后恢复读副本（{status}）", status == 404, problems)
+
+    print("用户设置：")
+    with database.replica_router.replicas[0].begin() as connection:
+        connection.execute(text("DELETE FROM user_settings WHERE user_id = :u"), {"u": alice})
+    db = SessionLocal()
+    db.info["read_only"] = True
+    try:
+        settings = crud.get_user_settings(db, alice)
+        error = None
+    except Exception as exc:
+        settings, error = None, exc
+    finally:
+        db.close()
+    check(f"副本缺少设置时使用主库已有的设置（{error!r}）",
+          settings is not None and settings_rows(alice) == 1, problems)
+
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM user_settings WHERE user_id = :u"), {"u": bob})
+    errors = []
+
+    def reader():
+        with SessionLocal() as session:
+            try:
+                crud.get_user_settings(session, bob)
+            except Exception as exc:
+                errors.append(exc)
+
+    threads = [threading.Thread(target=reader) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    check(f"{args.threads} 个并发读取只创建一行（{settings_rows(bob)} 行，错误 {errors}）",
+          not errors and settings_rows(bob) == 1, problems)
+
+    print("读缓存：")
+    cache.bus = cache.MemoryBus()
+    cache.user_cache = cache.UserCache(cache.bus)
+    link = client.get(f"{PREFIX}/users/{alice}/links").json()[0]
+    response = client.put(f"{PREFIX}/users/{alice}/links/{link['id']}", json={"name": "改名后的链接"})
+    check("写入成功", response.status_code == 200, problems)
+    names = []
+    for _ in range(2):
+        links = client.get(f"{PREFIX}/users/{alice}/links").json()  # 其他客户端：不带写入标记
+        names.append(next(item["name"] for item in links if item["id"] == link["id"]))
+    check(f"不带标记的读取也不会缓存副本上的旧数据（{names}）", names == ["改名后的链接"] * 2, problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
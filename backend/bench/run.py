@@ -0,0 +1,237 @@
+"""
+基准测试入口
+
+示例（在 backend 目录下）：
+    # 进程内（ASGI）运行，保存基线
+    python -m bench.run --users 20 --links 500 --save bench/baselines/main.json
+
+    # 修改 crud.py 后与基线对比，p95 退化超过阈值时返回非零退出码
+    python -m bench.run --users 20 --links 500 --compare bench/baselines/main.json
+
+    # 通过本地 uvicorn 运行
+    python -m bench.run --mode uvicorn --port 8765
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from database import make_engine
+from bench import datagen
+from bench.app import bind_app
+from bench.scenarios import Recorder, BenchClient, SCENARIOS
+
+API_PREFIX = os.getenv("API_PREFIX", "/api/v1")
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder: Recorder, wall: float):
+    """汇总每个接口的吞吐与延迟分位数（毫秒）"""
+    endpoints = {}
+    total = 0
+    for label, values in sorted(recorder.samples.items()):
+        values = sorted(values)
+        total += len(values)
+        endpoints[label] = {
+            "count": len(values),
+            "errors": recorder.errors.get(label, 0),
+            "rps": round(len(values) / wall, 2) if wall else 0.0,
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return {
+        "wall_s": round(wall, 3),
+        "requests": total,
+        "rps": round(total / wall, 2) if wall else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(summary):
+    print(f"\n总请求数 {summary['requests']}，耗时 {summary['wall_s']}s，吞吐 {summary['rps']} req/s\n")
+    header = f"{'接口':<46}{'次数':>7}{'错误':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    for label, stats in summary["endpoints"].items():
+        print(f"{label:<48}{stats['count']:>7}{stats['errors']:>6}{stats['rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+
+
+def compare(summary, baseline, threshold: float, floor_ms: float = 1.0):
+    """与基线对比，返回退化的接口列表"""
+    regressions = []
+    for label, stats in summary["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(label)
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            before, after = base[key], stats[key]
+            if after > before * (1 + threshold) and after - before > floor_ms:
+                regressions.append((label, key, before, after))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+class UvicornHttp:
+    """requests.Session 包装，补全 base_url"""
+
+    def __init__(self, base_url: str):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, **kwargs):
+        return self.session.request(method, self.base_url + path, **kwargs)
+
+
+def start_uvicorn(db_url: str, port: int):
+    env = dict(os.environ, BENCH_DB_URL=db_url)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench.app:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    import requests
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("uvicorn 启动超时")
+
+
+def run(args):
+    engine = make_engine(args.db_url)
+    if not args.skip_generate:
+        start = time.perf_counter()
+        user_ids = datagen.generate(engine, users=args.users, links=args.links, categories=args.categories,
+                                    history=args.history, seed=args.seed)
+        print(f"生成数据 {len(user_ids)} 个用户，用时 {time.perf_counter() - start:.2f}s")
+    names = [datagen.user_name(i) for i in range(args.users)]
+
+    proc = None
+    if args.mode == "inprocess":
+        from fastapi.testclient import TestClient
+        app = bind_app(engine)
+        make_http = lambda: TestClient(app)
+    else:
+        base_url = args.base_url
+        if not base_url:
+            proc = start_uvicorn(args.db_url, args.port)
+            base_url = f"http://127.0.0.1:{args.port}"
+        make_http = lambda: UvicornHttp(base_url)
+
+    scenario = SCENARIOS[args.scenario]
+    recorders = []
+    failures = []
+
+    def worker(index: int):
+        recorder = Recorder()
+        recorders.append(recorder)
+        client = BenchClient(make_http(), recorder, prefix=API_PREFIX)
+        rng = random.Random(args.seed * 1000 + index)
+        try:
+            for i in range(args.iterations):
+                scenario(client, names[(index + i * args.concurrency) % len(names)], rng)
+        except Exception as e:
+            failures.append(e)
+
+    try:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+    if failures:
+        raise failures[0]
+
+    recorder = Recorder()
+    for r in recorders:
+        recorder.merge(r)
+    summary = summarize(recorder, wall)
+    summary["meta"] = {
+        "revision": git_revision(),
+        "mode": args.mode,
+        "scenario": args.scenario,
+        "dialect": engine.dialect.name,
+        "users": args.users,
+        "links": args.links,
+        "history": args.history,
+        "seed": args.seed,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+    }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="链接门户后端基准测试")
+    parser.add_argument("--db-url", default="sqlite:///bench.sqlite3", help="基准测试数据库（会被清空重建）")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--base-url", help="uvicorn 模式下使用已启动的服务，而不是自动启动")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="session")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--links", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=5, help="每个并发线程执行的会话数")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--skip-generate", action="store_true", help="复用已有数据，不重新生成")
+    parser.add_argument("--save", help="把结果保存为 JSON 基线")
+    parser.add_argument("--compare", help="与 JSON 基线对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的相对退化比例")
+    args = parser.parse_args(argv)
+
+    summary = run(args)
+    print_report(summary)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存到 {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline, args.threshold)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项性能退化（基线 {baseline.get('meta', {}).get('revision')}）：")
+            for label, key, before, after in regressions:
+                print(f"  {label} {key}: {before} -> {after}")
+            return 1
+        print("\n与基线相比无明显退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+场景脚本
+
+按 script.js / api.js 的真实调用顺序回放：
+登录 -> 并行加载（链接、分类、设置、访问历史）-> 边输入边搜索 -> 点击链接
+-> 批量操作（每次写操作后前端都会调用 loadLinksOrder() 重新拉取全部链接）
+"""
+import random
+import time
+from collections import defaultdict
+
+from bench.datagen import BENCH_PASSWORD, WORDS, TAG_NAMES, CATEGORY_NAMES
+
+
+class Recorder:
+    """按接口记录每次请求的耗时（秒）与失败次数"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, label: str, elapsed: float, ok: bool):
+        self.samples[label].append(elapsed)
+        if not ok:
+            self.errors[label] += 1
+
+    def merge(self, other: "Recorder"):
+        for label, values in other.samples.items():
+            self.samples[label].extend(values)
+        for label, count in other.errors.items():
+            self.errors[label] += count
+
+
+class BenchClient:
+    """对 TestClient / requests.Session 的薄封装，统一加上 API 前缀并计时"""
+
+    def __init__(self, http, recorder: Recorder, prefix: str = "/api/v1"):
+        self.http = http
+        self.recorder = recorder
+        self.prefix = prefix
+
+    def call(self, label: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        response = self.http.request(method, self.prefix + path, **kwargs)
+        self.recorder.record(label, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+
+def bootstrap(client: BenchClient, user_id: int):
+    """对应 script.js 初始化时 Promise.all 并行加载的四个请求"""
+    links = client.call("GET /users/{id}/links", "GET", f"/users/{user_id}/links").json()
+    client.call("GET /users/{id}/categories", "GET", f"/users/{user_id}/categories")
+    client.call("GET /users/{id}/settings", "GET", f"/users/{user_id}/settings")
+    client.call("GET /users/{id}/access-history", "GET", f"/users/{user_id}/access-history", params={"limit": 100})
+    return links
+
+
+def search_as_you_type(client: BenchClient, user_id: int, rng: random.Random):
+    """逐字输入一个关键词，每个前缀触发一次搜索"""
+    word = rng.choice(WORDS)
+    for i in range(1, len(word) + 1):
+        client.call("GET /users/{id}/links?search", "GET", f"/users/{user_id}/links",
+                    params={"search": word[:i]})
+
+
+def clicks(client: BenchClient, user_id: int, links, rng: random.Random, count: int = 5):
+    """点击链接：记录点击 + 写访问历史"""
+    for link in rng.sample(links, min(count, len(links))):
+        client.call("POST /users/{id}/links/{id}/click", "POST", f"/users/{user_id}/links/{link['id']}/click")
+        client.call("POST /users/{id}/access-history", "POST", f"/users/{user_id}/access-history",
+                    json={"link_url": link["url"], "link_name": link["name"]})
+
+
+def batch_ops(client: BenchClient, user_id: int, links, rng: random.Random, size: int = 20):
+    """批量修改分类 / 标签 / 分享设置，每次写入后重新加载链接"""
+    urls = [link["url"] for link in rng.sample(links, min(size, len(links)))]
+    client.call("POST /users/{id}/links/batch/category", "POST", f"/users/{user_id}/links/batch/category",
+                json={"link_urls": urls, "category": rng.choice(CATEGORY_NAMES)})
+    client.call("GET /users/{id}/links", "GET", f"/users/{user_id}/links")
+    client.call("POST /users/{id}/links/batch/tags", "POST", f"/users/{user_id}/links/batch/tags",
+                json={"link_urls": urls, "tags": rng.sample(TAG_NAMES, 2)})
+    client.call("GET /users/{id}/links", "GET", f"/users/{user_id}/links")
+    client.call("POST /users/{id}/links/batch/share", "POST", f"/users/{user_id}/links/batch/share",
+                json={"link_urls": urls, "is_private": rng.random() < 0.5})
+    client.call("GET /users/{id}/links", "GET", f"/users/{user_id}/links")
+
+
+def edit_cycle(client: BenchClient, user_id: int, rng: random.Random):
+    """新建、修改、删除一个链接（对应编辑弹窗的保存与删除）"""
+    url = f"https://bench-{rng.randrange(1 << 30)}.example.com"
+    created = client.call("POST /users/{id}/links", "POST", f"/users/{user_id}/links",
+                          json={"name": "Bench", "url": url, "category": rng.choice(CATEGORY_NAMES)})
+    client.call("GET /users/{id}/links", "GET", f"/users/{user_id}/links")
+    if created.status_code >= 400:
+        return
+    link_id = created.json()["id"]
+    client.call("PUT /users/{id}/links/{id}", "PUT", f"/users/{user_id}/links/{link_id}",
+                json={"note": "edited", "tags": rng.sample(TAG_NAMES, 1)})
+    client.call("GET /users/{id}/links", "GET", f"/users/{user_id}/links")
+    client.call("DELETE /users/{id}/links/{id}", "DELETE", f"/users/{user_id}/links/{link_id}")
+    client.call("GET /users/{id}/links", "GET", f"/users/{user_id}/links")
+
+
+def user_session(client: BenchClient, name: str, rng: random.Random):
+    """一个完整的用户会话"""
+    result = client.call("POST /auth/login", "POST", "/auth/login",
+                         json={"name": name, "password": BENCH_PASSWORD}).json()
+    if not result.get("success"):
+        raise RuntimeError(f"登录失败: {name}")
+    user_id = result["user"]["id"]
+
+    links = bootstrap(client, user_id)
+    search_as_you_type(client, user_id, rng)
+    if links:
+        clicks(client, user_id, links, rng)
+        batch_ops(client, user_id, links, rng)
+    edit_cycle(client, user_id, rng)
+
+
+def browse_session(client: BenchClient, name: str, rng: random.Random):
+    """只读为主的会话：登录、加载、搜索、点击，不做批量写入"""
+    result = client.call("POST /auth/login", "POST", "/auth/login",
+                         json={"name": name, "password": BENCH_PASSWORD}).json()
+    if not result.get("success"):
+        raise RuntimeError(f"登录失败: {name}")
+    user_id = result["user"]["id"]
+
+    links = bootstrap(client, user_id)
+    search_as_you_type(client, user_id, rng)
+    if links:
+        clicks(client, user_id, links, rng, count=2)
+
+
+SCENARIOS = {
+    "session": user_session,
+    "browse": browse_session,
+}
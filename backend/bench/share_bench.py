@@ -0,0 +1,192 @@
+"""
+公开分享页测试
+
+在临时 SQLite 库和临时快照目录上验证：
+- 无效令牌返回 404，更换令牌后旧地址失效
+- 分享内容不包含私有链接，支持按分类过滤
+- 快照生成后的请求不访问数据库
+- If-None-Match 命中返回 304；gzip / brotli 正文解压后与未压缩正文一致
+- 修改非私有链接后快照失效；只修改私有链接时 ETag 不变
+- 不存在的分类返回 404，不访问数据库也不生成文件
+- 模拟另一台机器（独立的快照目录和令牌缓存）：修改内容、更换令牌、删除用户后，
+  缓存过期即生效；旧版本快照被删除，已删除用户的快照由 sweep() 清理
+
+    python -m bench.share_bench
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="share_bench_")
+os.environ["DB_ENGINE"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "share.sqlite3")
+os.environ["SHARE_SNAPSHOT_DIR"] = os.path.join(_tmp, "snapshots")
+
+import argparse
+import contextlib
+import gzip
+import json
+import time
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from database import engine, SessionLocal
+from models import Link
+import share
+from bench.checks import check, report
+from bench.datagen import generate
+from bench.app import bind_app
+import main as app_main
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="公开分享页测试")
+    parser.add_argument("--links", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args(argv)
+    problems = []
+
+    user_ids = generate(engine, users=2, links=args.links, history=0)
+    user_id = sorted(user_ids.values())[0]
+    client = TestClient(bind_app(engine))
+    prefix = app_main.API_PREFIX
+    queries = QueryCounter(engine)
+
+    print("令牌：")
+    check("无效令牌返回 404", client.get(f"{prefix}/share/not-a-token").status_code == 404, problems)
+    check("格式错误的令牌返回 404", client.get(f"{prefix}/share/bad~token").status_code == 404, problems)
+    link = client.get(f"{prefix}/users/{user_id}/share").json()
+    token = link["token"]
+    check("重复获取返回同一令牌", client.get(f"{prefix}/users/{user_id}/share").json()["token"] == token, problems)
+
+    print("内容：")
+    with SessionLocal() as db:
+        public = db.query(Link).filter(Link.user_id == user_id, Link.is_private == False).count()
+        private_link = db.query(Link).filter(Link.user_id == user_id, Link.is_private == True).first()
+        public_link = db.query(Link).filter(Link.user_id == user_id, Link.is_private == False).first()
+    data = client.get(link["json_url"]).json()
+    urls = {item["url"] for item in data["links"]}
+    check(f"只包含非私有链接（{len(data['links'])}/{args.links}）",
+          len(data["links"]) == public and private_link is not None and private_link.url not in urls, problems)
+    html_response = client.get(link["html_url"])
+    check("HTML 页面", html_response.status_code == 200
+          and html_response.headers["content-type"].startswith("text/html"), problems)
+    category = public_link.category
+    filtered = client.get(link["json_url"], params={"category": category}).json()
+    check("按分类过滤", filtered["links"] and all(item["category"] == category for item in filtered["links"]), problems)
+
+    print("快照读取：")
+    client.get(link["json_url"])
+    before = queries.count
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        client.get(link["json_url"], headers={"Accept-Encoding": "identity"})
+    elapsed = time.perf_counter() - start
+    check(f"{args.requests} 次请求访问数据库 {queries.count - before} 次"
+          f"（平均 {elapsed / args.requests * 1000:.2f}ms）", queries.count == before, problems)
+
+    identity = client.get(link["json_url"], headers={"Accept-Encoding": "identity"})
+    etag = identity.headers["etag"]
+    check("Cache-Control 与 Vary", "stale-while-revalidate" in identity.headers["cache-control"]
+          and identity.headers.get("vary") == "Accept-Encoding", problems)
+    check("If-None-Match 返回 304", client.get(
+        link["json_url"], headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 304, problems)
+
+    # TestClient 会自动解压响应，这里直接读取快照文件比较
+    key = share._snapshot_key(None)
+    epoch = share.tokens.lookup(token)[1]
+    raw = share.store.load_body(token, epoch, key, "json")
+    for encoding in share.encodings():
+        response = client.get(link["json_url"], headers={"Accept-Encoding": encoding})
+        compressed = share.store.load_body(token, epoch, key, "json", encoding)
+        decompress = gzip.decompress if encoding == "gzip" else share.brotli.decompress
+        check(f"{encoding}（{len(compressed)}/{len(raw)} 字节）",
+              response.headers.get("content-encoding") == encoding
+              and response.headers["etag"] != etag
+              and decompress(compressed) == raw == identity.content, problems)
+
+    print("分类参数：")
+    files = sum(len(names) for _, _, names in os.walk(share.store.root))
+    before = queries.count
+    statuses = {client.get(link["json_url"], params={"category": f"不存在的分类 {i}"}).status_code for i in range(50)}
+    check(f"不存在的分类返回 404（访问数据库 {queries.count - before} 次）",
+          statuses == {404} and queries.count == before
+          and sum(len(names) for _, _, names in os.walk(share.store.root)) == files, problems)
+    before = queries.count
+    other = next(item["category"] for item in data["links"] if item["category"] != category)
+    filtered = client.get(link["json_url"], params={"category": other}).json()
+    check("分类页从完整快照生成，不访问数据库",
+          queries.count == before and filtered["links"] and all(item["category"] == other for item in filtered["links"]),
+          problems)
+
+    print("失效：")
+    client.put(f"{prefix}/users/{user_id}/links/{private_link.id}", json={"note": "仅私有链接变化"})
+    after_private = client.get(link["json_url"], headers={"Accept-Encoding": "identity"})
+    check("只修改私有链接时 ETag 不变", after_private.headers["etag"] == etag, problems)
+    client.put(f"{prefix}/users/{user_id}/links/{public_link.id}", json={"name": "新的名称"})
+    after_public = client.get(link["json_url"], headers={"Accept-Encoding": "identity"})
+    names = {item["name"] for item in json.loads(after_public.content)["links"]}
+    check("修改非私有链接后内容更新", after_public.headers["etag"] != etag and "新的名称" in names, problems)
+    client.put(f"{prefix}/users/{user_id}/links/{public_link.id}", json={"is_private": True})
+    hidden = json.loads(client.get(link["json_url"]).content)
+    check("设为私有后从分享中移除", public_link.url not in {item["url"] for item in hidden["links"]}, problems)
+    client.put(f"{prefix}/users/{user_id}/settings", json={"page_title": "分享标题"})
+    check("修改页面标题后更新", client.get(link["json_url"]).json()["title"] == "分享标题", problems)
+
+    versions = os.listdir(os.path.dirname(share.store._dir(token, 0)))
+    check(f"只保留当前版本的快照（{versions}）", versions == [str(share.tokens.lookup(token)[1])], problems)
+
+    print("另一台机器：")
+    remote_store = share.SnapshotStore(os.path.join(_tmp, "remote"))
+    remote_tokens = share.TokenCache(ttl=0.2)
+
+    @contextlib.contextmanager
+    def remote():
+        local = share.store, share.tokens
+        share.store, share.tokens = remote_store, remote_tokens
+        try:
+            yield
+        finally:
+            share.store, share.tokens = local
+
+    def remote_get(url):
+        with remote():
+            return client.get(url)
+
+    check("远端生成快照", remote_get(link["json_url"]).json()["title"] == "分享标题", problems)
+    client.put(f"{prefix}/users/{user_id}/settings", json={"page_title": "本机修改"})
+    time.sleep(0.25)
+    check("本机修改在缓存过期后生效", remote_get(link["json_url"]).json()["title"] == "本机修改", problems)
+
+    reset = client.post(f"{prefix}/users/{user_id}/share/reset").json()
+    check("更换令牌后旧地址 404", client.get(link["json_url"]).status_code == 404
+          and client.get(reset["json_url"]).status_code == 200, problems)
+    time.sleep(0.25)
+    check("远端旧令牌在缓存过期后 404", remote_get(link["json_url"]).status_code == 404
+          and remote_get(reset["json_url"]).status_code == 200, problems)
+
+    other_user = sorted(user_ids.values())[1]
+    other_link = client.get(f"{prefix}/users/{other_user}/share").json()
+    remote_get(other_link["json_url"])
+    client.delete(f"{prefix}/users/{other_user}")
+    time.sleep(0.25)
+    check("删除用户后远端 404", remote_get(other_link["json_url"]).status_code == 404, problems)
+    with remote():
+        removed = share.sweep()
+    remaining = os.listdir(os.path.join(remote_store.root, "pages"))
+    check(f"sweep() 清理已失效令牌的快照（删除 {removed} 个目录）",
+          remaining == [share._token_dir(reset["token"])], problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
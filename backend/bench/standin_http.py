@@ -0,0 +1,138 @@
+"""
+本地替身 HTTP 服务
+
+为失效链接检查、图标代理等需要访问外部网站的功能提供可控的响应：
+    /ok                 200，带 ETag / Last-Modified，支持条件请求返回 304
+    /slow?delay=秒      延迟后返回 200
+    /redirect           301 -> /ok
+    /redirect-loop      无限重定向
+    /notfound           404
+    /error              500
+    /head-not-allowed   HEAD 返回 405，GET 返回 200
+    /drop               不返回响应直接断开连接
+    /favicon.ico        16x16 PNG 图标
+
+    python -m bench.standin_http --port 8900
+"""
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+ETAG = '"standin-v1"'
+
+
+def make_png(size: int = 16, rgba=(30, 144, 255, 255)) -> bytes:
+    """生成纯色 PNG"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    raw = b"".join(b"\x00" + bytes(rgba) * size for _ in range(size))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+FAVICON = make_png()
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD" and body:
+            self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.requests.append((self.command, self.path, self.headers.get("Host"), time.monotonic()))
+        try:
+            self._route()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _route(self):
+        parsed = urlsplit(self.path)
+        path = parsed.path
+        query = parse_qs(parsed.query)
+        routes = self.server.routes
+        if path in routes:
+            status, body, headers = routes[path](self)
+            self._send(status, body, headers)
+        elif path == "/ok":
+            if self.headers.get("If-None-Match") == ETAG or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                self._send(304, headers={"ETag": ETAG})
+            else:
+                self._send(200, b"ok", {"ETag": ETAG, "Last-Modified": LAST_MODIFIED, "Content-Type": "text/plain"})
+        elif path == "/slow":
+            time.sleep(float(query.get("delay", ["1"])[0]))
+            self._send(200, b"slow")
+        elif path == "/redirect":
+            self._send(301, headers={"Location": "/ok"})
+        elif path == "/redirect-loop":
+            self._send(302, headers={"Location": "/redirect-loop"})
+        elif path == "/notfound":
+            self._send(404, b"not found")
+        elif path == "/error":
+            self._send(500, b"error")
+        elif path == "/head-not-allowed":
+            if self.command == "HEAD":
+                self._send(405)
+            else:
+                self._send(200, b"get only")
+        elif path == "/favicon.ico":
+            self._send(200, FAVICON, {"Content-Type": "image/png"})
+        elif path == "/drop":
+            self.close_connection = True
+            self.connection.close()
+        else:
+            self._send(404, b"unknown")
+
+    do_GET = _handle
+    do_HEAD = _handle
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(("127.0.0.1", port), StandinHandler)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+        # 额外路由：path -> handler(request) -> (status, body, headers)
+        self.routes = {}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="本地替身 HTTP 服务")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+    server = StandinServer(args.port)
+    print(f"替身服务运行在 http://127.0.0.1:{server.port}")
+    server.serve_forever()
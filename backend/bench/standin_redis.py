@@ -0,0 +1,135 @@
+"""
+本地替身 Redis 服务
+
+只实现失效总线用到的 RESP 命令：AUTH、PING、SUBSCRIBE、PUBLISH。
+测试可以控制服务的行为：
+    drop()              断开所有现有连接
+    refusing = True     新连接在发出第一条命令后立即断开（模拟 Redis 不可用）
+    stalled = True      接受命令但从不回复（模拟 Redis 无响应）
+
+    python -m bench.standin_redis --port 6390
+"""
+import socket
+import threading
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+def encode(value) -> bytes:
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+    data = value if isinstance(value, bytes) else str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class StandinRedisHandler(StreamRequestHandler):
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line.startswith(b"*"):
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _write(self, data: bytes):
+        with self.lock:
+            self.wfile.write(data)
+
+    def handle(self):
+        server = self.server
+        self.lock = threading.Lock()
+        with server.lock:
+            server.connections.add(self.connection)
+        try:
+            while True:
+                args = self._read_command()
+                if not args:
+                    return
+                command = args[0].upper()
+                with server.lock:
+                    server.commands.append(command.decode())
+                if server.refusing:
+                    return
+                if server.stalled:
+                    continue
+                if command == b"AUTH":
+                    self._write(b"+OK\r\n")
+                elif command == b"PING":
+                    self._write(b"+PONG\r\n")
+                elif command == b"SUBSCRIBE":
+                    with server.lock:
+                        for channel in args[1:]:
+                            server.subscribers.setdefault(channel, []).append(self)
+                    for index, channel in enumerate(args[1:], 1):
+                        self._write(encode([b"subscribe", channel, index]))
+                elif command == b"PUBLISH":
+                    with server.lock:
+                        receivers = list(server.subscribers.get(args[1], []))
+                    delivered = 0
+                    for receiver in receivers:
+                        try:
+                            receiver._write(encode([b"message", args[1], args[2]]))
+                            delivered += 1
+                        except OSError:
+                            pass
+                    self._write(encode(delivered))
+                else:
+                    self._write(b"-ERR unknown command\r\n")
+        except (OSError, ValueError):
+            pass
+        finally:
+            with server.lock:
+                server.connections.discard(self.connection)
+                for receivers in server.subscribers.values():
+                    if self in receivers:
+                        receivers.remove(self)
+
+
+class StandinRedis(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(("127.0.0.1", port), StandinRedisHandler)
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.subscribers = {}
+        self.commands = []
+        self.refusing = False
+        self.stalled = False
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def subscriber_count(self) -> int:
+        with self.lock:
+            return sum(len(receivers) for receivers in self.subscribers.values())
+
+    def drop(self):
+        """断开所有现有连接"""
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="本地替身 Redis 服务")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    server = StandinRedis(args.port)
+    print(f"替身 Redis 运行在 {server.url}")
+    server.serve_forever()
@@ -0,0 +1,172 @@
+"""
+启动耗时测量
+
+在独立子进程中导入 main（包含引擎创建），再用 TestClient 启动应用并依次统计：
+导入耗时、startup 事件耗时（不等待数据库）、就绪耗时（结构检查 + 连接池预热，轮询 /health/ready）、
+首个请求耗时，以及存活 / 就绪探针的耗时。测量前会先执行迁移。未设置 DB_ENGINE 时使用临时 SQLite 文件，
+测量其他数据库时通过环境变量指定，例如：
+
+    python -m bench.startup --runs 5
+    DB_ENGINE=mysql DB_HOST=127.0.0.1 python -m bench.startup
+
+另外在数据库不可达（MySQL 127.0.0.1:1）时启动一次，验证启动不被阻塞、存活检查正常、就绪检查返回 503；
+在未迁移的空库上启动一次，验证进入 failed 状态、就绪检查返回 503，执行迁移后不需要重启即可就绪；
+自动迁移抛出其他异常时同样退避重试，排除后就绪。
+"""
+import os
+import sys
+import tempfile
+
+if "DB_ENGINE" not in os.environ:
+    os.environ["DB_ENGINE"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="startup_bench_"), "startup.sqlite3")
+
+import argparse
+import json
+import subprocess
+from bench.checks import check, report
+
+CHILD = r"""
+import json, os, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    started = time.perf_counter()
+    live = client.get("/health/live").status_code
+    live_ms = (time.perf_counter() - started) * 1000
+    deadline = time.monotonic() + float(os.environ.get("BENCH_READY_WAIT", "10"))
+    ready = client.get("/health/ready")
+    while ready.status_code != 200 and ready.json().get("phase") != "failed" and time.monotonic() < deadline:
+        time.sleep(0.005)
+        ready = client.get("/health/ready")
+    became_ready = time.perf_counter()
+    response = client.get(main.API_PREFIX + "/users", params={"limit": 1})
+    first = time.perf_counter()
+    probes = []
+    for _ in range(200):
+        t = time.perf_counter()
+        client.get("/health/ready")
+        probes.append(time.perf_counter() - t)
+    checks = main.lifecycle.readiness.checks
+    recovered = None
+    if os.environ.get("BENCH_MIGRATE_AFTER") and ready.json().get("phase") == "failed":
+        # 进程运行期间执行迁移，等待重新检查后就绪
+        import subprocess, sys
+        subprocess.check_call([sys.executable, "migrations.py"], stdout=subprocess.DEVNULL)
+        migrated = time.monotonic()
+        while time.monotonic() < migrated + 10:
+            recovered = client.get("/health/ready")
+            if recovered.status_code == 200:
+                break
+            time.sleep(0.01)
+        recovered = {"status": recovered.status_code, "phase": recovered.json().get("phase"),
+                     "ms": round((time.monotonic() - migrated) * 1000, 2)}
+print(json.dumps({
+    "dialect": main.engine.dialect.name,
+    "import_ms": round((imported - start) * 1000, 2),
+    "startup_ms": round((started - imported) * 1000, 2),
+    "ready_ms": round((became_ready - started) * 1000, 2),
+    "first_request_ms": round((first - became_ready) * 1000, 2),
+    "first_status": response.status_code,
+    "live_status": live,
+    "live_ms": round(live_ms, 2),
+    "ready_status": ready.status_code,
+    "ready": ready.json(),
+    "probe_ms": round(sum(probes) / len(probes) * 1000, 3),
+    "probe_db_checks": checks,
+    "recovered": recovered,
+}))
+"""
+
+
+# 自动迁移前两次抛出非数据库异常，之后成功
+RETRY_CHILD = r"""
+import asyncio, json
+import lifecycle, migrations
+calls = []
+def flaky(engine):
+    calls.append(1)
+    if len(calls) <= 2:
+        raise RuntimeError("自动迁移失败")
+migrations.ensure_schema = flaky
+async def run():
+    startup = lifecycle.Lifecycle()
+    startup.start()
+    phases = []
+    for _ in range(500):
+        if not phases or phases[-1] != startup.phase:
+            phases.append(startup.phase)
+        if startup.ready:
+            break
+        await asyncio.sleep(0.01)
+    await startup.stop()
+    return phases, startup.attempts
+phases, attempts = asyncio.run(run())
+print(json.dumps({"phases": phases, "attempts": attempts}))
+"""
+
+
+def run_child(env, script=CHILD):
+    output = subprocess.check_output([sys.executable, "-c", script], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def measure(runs: int):
+    subprocess.check_call([sys.executable, "migrations.py"], env=dict(os.environ), stdout=subprocess.DEVNULL)
+    return [run_child(dict(os.environ)) for _ in range(runs)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量应用启动耗时")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+    problems = []
+
+    results = measure(args.runs)
+    for r in results:
+        print(f"[{r['dialect']}] 导入 {r['import_ms']}ms，startup {r['startup_ms']}ms，就绪 {r['ready_ms']}ms"
+              f"（{r['ready'].get('startup')}），首个请求 {r['first_request_ms']}ms（状态 {r['first_status']}），"
+              f"就绪探针平均 {r['probe_ms']}ms（200 次中访问数据库 {r['probe_db_checks']} 次）")
+    best = min(results, key=lambda r: r["import_ms"] + r["startup_ms"] + r["ready_ms"])
+    print(f"最佳：导入 {best['import_ms']}ms + startup {best['startup_ms']}ms + 就绪 {best['ready_ms']}ms")
+    check("启动后就绪", all(r["ready_status"] == 200 and r["first_status"] == 200 for r in results), problems)
+    check("就绪检查结果被缓存", all(r["probe_db_checks"] <= 3 for r in results), problems)
+
+    print("数据库不可达：")
+    env = dict(os.environ, DB_ENGINE="mysql", DB_HOST="127.0.0.1", DB_PORT="1", JOB_ENABLED="false",
+               FRECENCY_RENORMALIZE_ENABLED="false", BENCH_READY_WAIT="1")
+    down = run_child(env)
+    print(f"  startup {down['startup_ms']}ms，存活 {down['live_status']}（{down['live_ms']}ms），"
+          f"就绪 {down['ready_status']}：{down['ready']}")
+    check("startup 不等待数据库", down["startup_ms"] < 1000, problems)
+    check("存活检查正常", down["live_status"] == 200, problems)
+    check("就绪检查返回 503", down["ready_status"] == 503 and down["ready"]["phase"] == "starting"
+          and "error" in down["ready"], problems)
+
+    print("结构版本落后：")
+    empty = os.path.join(tempfile.mkdtemp(prefix="startup_bench_"), "empty.sqlite3")
+    env = dict(os.environ, DB_ENGINE="sqlite", SQLITE_PATH=empty, SCHEMA_AUTO_MIGRATE="false", BENCH_READY_WAIT="5",
+               STARTUP_RETRY_SECONDS="0.2", BENCH_MIGRATE_AFTER="1")
+    outdated = run_child(env)
+    print(f"  就绪 {outdated['ready_status']}（{outdated['ready_ms']}ms）：{outdated['ready'].get('error')}")
+    check("进入 failed 状态", outdated["ready_status"] == 503 and outdated["ready"]["phase"] == "failed"
+          and outdated["live_status"] == 200, problems)
+    recovered = outdated["recovered"]
+    print(f"  执行迁移后：{recovered}")
+    check("迁移完成后不需要重启即可就绪", recovered is not None and recovered["status"] == 200
+          and recovered["phase"] == "ready", problems)
+
+    print("自动迁移出错：")
+    env = dict(os.environ, DB_ENGINE="sqlite", SQLITE_PATH=empty, STARTUP_RETRY_SECONDS="0.05")
+    retried = run_child(env, RETRY_CHILD)
+    print(f"  阶段 {retried['phases']}，尝试 {retried['attempts']} 次")
+    check("非数据库异常同样退避重试，之后就绪", "failed" in retried["phases"] and retried["phases"][-1] == "ready"
+          and retried["attempts"] == 3, problems)
+
+    return report(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,400 @@
+"""
+读缓存与跨进程失效总线
+
+缓存以用户为粒度：每个用户有一个版本号，crud.py 的所有写操作在提交后调用
+invalidate_user() 让版本号加一；缓存条目记录加载时的版本号，版本不一致即视为失效。
+
+失效总线（CACHE_BACKEND）：
+- none    不缓存（默认）
+- memory  进程内版本号，仅适用于单进程部署
+- local   共享内存（mmap 文件）版本号，适用于同一台机器上的多个 worker；
+          subscribe() 只能收到本进程的写入（其他 worker 的写入只体现在版本号上）
+- redis   Redis 发布/订阅（只使用 RESP 协议的 PUBLISH/SUBSCRIBE），适用于多台机器
+"""
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from database import settings, use_primary
+
+logger = logging.getLogger("uvicorn.error")
+
+# ========== 失效总线 ==========
+class InvalidationBus:
+    """失效总线基类"""
+
+    def version(self, user_id: int):
+        """返回用户当前版本号；返回 None 表示暂时无法保证一致性，调用方应绕过缓存"""
+        raise NotImplementedError
+
+    def publish(self, user_id: int):
+        """用户数据已变更"""
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        """注册回调 callback(user_id)，在变更发布后调用；能否收到其他进程的变更取决于总线"""
+        raise NotImplementedError
+
+class MemoryBus(InvalidationBus):
+    """进程内总线"""
+
+    def __init__(self):
+        self._versions = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def version(self, user_id: int):
+        return self._versions.get(user_id, 0)
+
+    def publish(self, user_id: int):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        for callback in list(self._callbacks):
+            callback(user_id)
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+class LocalBus(InvalidationBus):
+    """同机多进程总线：版本号保存在 mmap 共享文件中，按 user_id 取模分槽
+
+    不同用户落在同一槽位只会导致多余的失效，不会读到旧数据。
+    读版本号只是一次内存读取，不需要系统调用。
+    """
+
+    SLOT = struct.Struct("Q")
+
+    def __init__(self, path: str, slots: int = 65536):
+        self.slots = slots
+        size = slots * self.SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._file = os.fdopen(fd, "r+b")
+        except Exception:
+            os.close(fd)
+            raise
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._callbacks = []
+
+    def _offset(self, user_id: int) -> int:
+        return (user_id % self.slots) * self.SLOT.size
+
+    def version(self, user_id: int):
+        return self.SLOT.unpack_from(self._map, self._offset(user_id))[0]
+
+    def publish(self, user_id: int):
+        offset = self._offset(user_id)
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            current = self.SLOT.unpack_from(self._map, offset)[0]
+            self.SLOT.pack_into(self._map, offset, current + 1)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        for callback in list(self._callbacks):
+            callback(user_id)
+
+    def subscribe(self, callback):
+        # 共享内存没有推送通道，只能通知本进程；其他进程通过版本号感知变更
+        self._callbacks.append(callback)
+
+def _encode_command(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+def _parse_line(line: bytes):
+    """解析一行 RESP 响应，返回 (类型, 值)；"$" / "*" 的值为长度，需要继续读取"""
+    if not line:
+        raise ConnectionError("Redis 连接已关闭")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return kind, rest.decode()
+    if kind == b"-":
+        raise ConnectionError(rest.decode())
+    if kind in (b":", b"$", b"*"):
+        return kind, int(rest)
+    raise ConnectionError(f"无法解析的 Redis 响应: {line!r}")
+
+class _RespConnection:
+    """最小的 RESP 客户端，只实现发布/订阅所需的命令"""
+
+    def __init__(self, url: str, timeout: float = None):
+        parsed = urlparse(url)
+        self.sock = socket.create_connection((parsed.hostname or "localhost", parsed.port or 6379), timeout=2)
+        self.sock.settimeout(timeout)
+        self.reader = self.sock.makefile("rb")
+        if parsed.password:
+            self.command("AUTH", parsed.password)
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read()
+
+    def send(self, *args):
+        self.sock.sendall(_encode_command(args))
+
+    def read(self):
+        kind, value = _parse_line(self.reader.readline())
+        if kind == b"$":
+            return None if value < 0 else self.reader.read(value + 2)[:-2]
+        if kind == b"*":
+            return None if value < 0 else [self.read() for _ in range(value)]
+        return value
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class _AsyncRespConnection:
+    """asyncio 版本的 RESP 客户端，在事件循环中使用，不阻塞其他请求；超时由调用方用 asyncio.wait_for 控制"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, url: str):
+        parsed = urlparse(url)
+        reader, writer = await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+        connection = cls(reader, writer)
+        if parsed.password:
+            await connection.command("AUTH", parsed.password)
+        return connection
+
+    async def command(self, *args):
+        self.writer.write(_encode_command(args))
+        await self.writer.drain()
+        return await self.read()
+
+    async def read(self):
+        kind, value = _parse_line(await self.reader.readline())
+        if kind == b"$":
+            return None if value < 0 else (await self.reader.readexactly(value + 2))[:-2]
+        if kind == b"*":
+            return None if value < 0 else [await self.read() for _ in range(value)]
+        return value
+
+    def close(self):
+        try:
+            self.writer.close()
+        except (OSError, RuntimeError):
+            pass  # 事件循环已关闭
+
+class RedisBus(InvalidationBus):
+    """跨主机总线：后台线程 PUBLISH 用户ID，另一个后台线程 SUBSCRIBE 并在本地累加版本号
+
+    订阅连接断开期间无法得知其他进程的写入，此时 version() 返回 None，缓存被绕过；
+    重连成功后整体版本（epoch）加一，之前的缓存全部失效。
+    """
+
+    def __init__(self, url: str, channel: str = "link_portal:invalidate", publish_timeout: float = 0.5):
+        self.url = url
+        self.channel = channel
+        self._versions = {}
+        self._epoch = 0
+        self._connected = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.publish_timeout = publish_timeout
+        self._pending = set()
+        self._publishing = False
+        self._pending_changed = threading.Condition()
+        self._thread = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+        self._thread.start()
+        self._publisher = threading.Thread(target=self._publish_pending, name="cache-invalidation-publish",
+                                           daemon=True)
+        self._publisher.start()
+
+    def version(self, user_id: int):
+        if not self._connected:
+            return None
+        return (self._epoch, self._versions.get(user_id, 0))
+
+    def _bump(self, user_id: int):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        for callback in list(self._callbacks):
+            callback(user_id)
+
+    def publish(self, user_id: int):
+        # 先让本进程立即失效，保证读到自己的写入；发布交给后台线程，不阻塞写请求
+        self._bump(user_id)
+        with self._pending_changed:
+            self._pending.add(user_id)
+            self._pending_changed.notify()
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待已提交的失效消息发布完成，返回是否全部发出"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending_changed:
+            while self._pending or self._publishing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_changed.wait(remaining)
+        return True
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+    def _publish_pending(self):
+        """后台发布失效消息
+
+        待发布的用户 ID 保存在集合中，同一用户的多次写入只发布一次，占用的内存以用户数为上限。
+        每条命令最多等待 publish_timeout 秒；发布失败的用户留在集合中，退避后重新连接并重发，
+        其他进程在此期间可能读到旧数据（最多到 CACHE_TTL_SECONDS）。
+        """
+        connection = None
+        backoff = 0.5
+        while True:
+            with self._pending_changed:
+                while not self._pending:
+                    self._publishing = False
+                    self._pending_changed.notify_all()
+                    self._pending_changed.wait()
+                batch = self._pending
+                self._pending = set()
+                self._publishing = True
+            sent = set()
+            try:
+                if connection is None:
+                    connection = _RespConnection(self.url, timeout=self.publish_timeout)
+                for user_id in batch:
+                    connection.command("PUBLISH", self.channel, user_id)
+                    sent.add(user_id)
+                backoff = 0.5
+            except (OSError, ConnectionError) as error:
+                if connection is not None:
+                    connection.close()
+                connection = None
+                with self._pending_changed:
+                    self._pending |= batch - sent
+                    unsent = len(self._pending)
+                logger.warning("缓存失效消息发布失败，%s 个用户待重发，%s 秒后重试：%s", unsent, backoff, error)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10)
+
+    def _listen(self):
+        backoff = 0.5
+        while True:
+            connection = None
+            try:
+                connection = _RespConnection(self.url)
+                connection.command("SUBSCRIBE", self.channel)
+                with self._lock:
+                    self._epoch += 1
+                self._connected = True
+                backoff = 0.5
+                while True:
+                    message = connection.read()
+                    if isinstance(message, list) and len(message) == 3 and message[0] == b"message":
+                        try:
+                            user_id = int(message[2])
+                        except ValueError:
+                            continue
+                        # 本进程发布的消息也会收到，多一次失效无害
+                        self._bump(user_id)
+            except (OSError, ConnectionError):
+                self._connected = False
+                if connection is not None:
+                    connection.close()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10)
+
+def create_bus(backend: str):
+    if backend == "memory":
+        return MemoryBus()
+    if backend == "local":
+        return LocalBus(settings.CACHE_LOCAL_PATH)
+    if backend == "redis":
+        return RedisBus(settings.CACHE_REDIS_URL, publish_timeout=settings.CACHE_REDIS_PUBLISH_TIMEOUT)
+    return None
+
+# ========== 缓存 ==========
+class UserCache:
+    """按用户版本号校验的 LRU 缓存，TTL 作为兜底"""
+
+    def __init__(self, bus: InvalidationBus, max_entries: int = 10000, ttl: float = 300):
+        self.bus = bus
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, namespace: str, user_id: int, key, loader):
+        """命中且版本一致时返回缓存值，否则调用 loader()；loader 返回 None 时不缓存"""
+        version = self.bus.version(user_id)
+        if version is None:
+            return loader()
+
+        cache_key = (namespace, user_id, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if entry[0] == version and entry[1] > now:
+                    self._entries.move_to_end(cache_key)
+                    return entry[2]
+                del self._entries[cache_key]
+
+        # 使用加载前读取的版本号：加载期间发生的写入会让这条缓存立即过期
+        value = loader()
+        if value is not None:
+            with self._lock:
+                self._entries[cache_key] = (version, now + self.ttl, value)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+bus = create_bus(settings.CACHE_BACKEND)
+user_cache = UserCache(bus, settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL_SECONDS) if bus is not None else None
+
+_local_callbacks = []
+
+def invalidate_user(user_id: int):
+    """crud.py 写操作提交后调用"""
+    if bus is not None:
+        bus.publish(user_id)
+    else:
+        for callback in list(_local_callbacks):
+            callback(user_id)
+
+def subscribe(callback):
+    """订阅用户数据变更通知 callback(user_id)；未配置总线或使用 local 总线时只能收到本进程的写入"""
+    if bus is not None:
+        bus.subscribe(callback)
+    else:
+        _local_callbacks.append(callback)
+
+def cached(namespace: str, user_id: int, key, loader, db=None):
+    """未启用缓存时直接调用 loader()
+
+    db 为 loader 使用的会话：需要加载时改读主库。副本可能落后于失效总线上的版本号，
+    从副本读到的旧数据会以新版本号缓存到 TTL 过期
+    """
+    if user_cache is None:
+        return loader()
+    if db is not None:
+        load = loader
+
+        def loader():
+            use_primary(db)
+            return load()
+    return user_cache.get_or_load(namespace, user_id, key, loader)
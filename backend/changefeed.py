@@ -0,0 +1,180 @@
+"""
+变更推送（SSE / WebSocket）
+
+crud.py 的写操作在同一事务中写入 change_events 表，提交后通过 cache.invalidate_user()
+发出通知。每个连接在收到本用户的通知（或轮询超时）后，从数据库读取上次推送之后的事件：
+
+- 事件按用户内的序号（change_events.seq）推送，序号在用户行锁下分配，提交顺序与序号顺序一致，
+  按序号续传不会漏掉提交较晚的事件（见 crud.record_change）
+- 序号即 SSE 的 id，断线重连时浏览器自动携带 Last-Event-ID 续传
+- 续传的事件已被清理、或积压超过 CHANGE_FEED_MAX_BACKLOG 时发送 reset，客户端应全量重新加载
+- 等待发送期间到达的多次通知会合并为一次查询，慢客户端不会让服务端无限堆积数据
+- 超过 CHANGE_FEED_RETENTION_HOURS 的事件由后台每 CHANGE_FEED_PRUNE_INTERVAL_MINUTES 分钟分批清理
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, select, update
+from starlette.concurrency import run_in_threadpool
+import crud
+from cache import subscribe
+from database import SessionLocal, settings
+from models import User, ChangeEvent
+
+class ChangeFeedHub:
+    """按用户登记等待中的连接，收到通知时唤醒（可在任意线程调用 notify）"""
+
+    def __init__(self):
+        self._waiters = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def register(self, user_id: int):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters[user_id].add(waiter)
+        return waiter
+
+    def unregister(self, user_id: int, waiter):
+        with self._lock:
+            waiters = self._waiters.get(user_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[user_id]
+
+    def notify(self, user_id: int):
+        with self._lock:
+            waiters = list(self._waiters.get(user_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+hub = ChangeFeedHub()
+subscribe(hub.notify)
+
+def event_payload(event):
+    return {
+        "id": event.seq,
+        "entity": event.entity,
+        "op": event.op,
+        "ids": event.ids or [],
+        "fields": event.fields or {},
+    }
+
+def _open_feed(user_id: int, last_event_id):
+    """确定起始位置，返回 (起始序号, 是否需要 reset)"""
+    db = SessionLocal()
+    try:
+        latest = crud.get_latest_change_seq(db, user_id=user_id)
+        if last_event_id is None:
+            return latest, False
+        if last_event_id == latest or crud.get_change_event(db, user_id=user_id, seq=last_event_id):
+            return last_event_id, False
+        return latest, True
+    finally:
+        db.close()
+
+def _fetch(user_id: int, after_seq: int, limit: int):
+    db = SessionLocal()
+    try:
+        return [event_payload(e) for e in crud.get_change_events(db, user_id=user_id, after_seq=after_seq, limit=limit)]
+    finally:
+        db.close()
+
+def _latest(user_id: int):
+    db = SessionLocal()
+    try:
+        return crud.get_latest_change_seq(db, user_id=user_id)
+    finally:
+        db.close()
+
+def prune() -> int:
+    """分批删除所有用户超过保留时间的事件，返回删除的条数"""
+    before = datetime.now() - timedelta(hours=settings.CHANGE_FEED_RETENTION_HOURS)
+    total = 0
+    db = SessionLocal()
+    try:
+        while True:
+            deleted = crud.prune_change_events(db, before=before)
+            total += deleted
+            if deleted == 0:
+                return total
+    finally:
+        db.close()
+
+async def run_forever():
+    while True:
+        try:
+            await run_in_threadpool(prune)
+        except Exception:
+            pass  # 数据库暂时不可用等情况，下一轮重试
+        await asyncio.sleep(settings.CHANGE_FEED_PRUNE_INTERVAL_MINUTES * 60)
+
+def user_exists(user_id: int) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.get_user(db, user_id) is not None
+    finally:
+        db.close()
+
+async def iter_changes(user_id: int, last_event_id=None, is_disconnected=None):
+    """产生 ("change", payload) / ("reset", payload) / ("ping", None)"""
+    loop_waiter = hub.register(user_id)
+    event = loop_waiter[1]
+    try:
+        last, reset = await run_in_threadpool(_open_feed, user_id, last_event_id)
+        if reset:
+            yield "reset", {"id": last}
+        while True:
+            if is_disconnected is not None and await is_disconnected():
+                return
+            # 先清除再查询，查询期间到达的通知不会丢失
+            event.clear()
+            events = await run_in_threadpool(_fetch, user_id, last, settings.CHANGE_FEED_MAX_BACKLOG + 1)
+            if len(events) > settings.CHANGE_FEED_MAX_BACKLOG:
+                last = await run_in_threadpool(_latest, user_id)
+                yield "reset", {"id": last}
+                continue
+            for payload in events:
+                last = payload["id"]
+                yield "change", payload
+            if events:
+                continue
+            try:
+                await asyncio.wait_for(event.wait(), timeout=settings.CHANGE_FEED_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                yield "ping", None
+    finally:
+        hub.unregister(user_id, loop_waiter)
+
+async def sse_stream(user_id: int, last_event_id=None, is_disconnected=None):
+    """SSE 格式的事件流"""
+    yield "retry: 3000\n\n"
+    async for kind, payload in iter_changes(user_id, last_event_id, is_disconnected):
+        if kind == "ping":
+            yield ": ping\n\n"
+            continue
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        yield f"id: {payload['id']}\nevent: {kind}\ndata: {data}\n\n"
+
+# ========== 回填（migrations.py 使用） ==========
+def backfill_event_seqs(connection, lo: int, hi: int) -> int:
+    """已有事件的序号取主键（同一用户内同样递增）"""
+    events = ChangeEvent.__table__
+    return connection.execute(
+        update(events).where(and_(events.c.id > lo, events.c.id <= hi, events.c.seq.is_(None)))
+        .values(seq=events.c.id)
+    ).rowcount
+
+def backfill_user_seqs(connection, lo: int, hi: int) -> int:
+    """用户的当前序号取已有事件的最大序号，新事件从这之后继续编号"""
+    users, events = User.__table__, ChangeEvent.__table__
+    latest = select(func.coalesce(func.max(events.c.seq), 0)).where(events.c.user_id == users.c.id).scalar_subquery()
+    return connection.execute(
+        update(users).where(and_(users.c.id > lo, users.c.id <= hi, users.c.change_seq < latest))
+        .values(change_seq=latest)
+    ).rowcount
@@ -1,9 +1,17 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, func, case
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
-from models import User, Link, Category, UserSettings, AccessHistory
+from datetime import datetime, date
+import math
+from models import User, Link, Category, UserSettings, AccessHistory, ChangeEvent, Job
 import schemas
 import bcrypt
+from cache import invalidate_user
+import share
+import domains
+import linkcheck
+from database import settings, lock_for_write
 
 # ========== 用户相关 ==========
 def get_user(db: Session, user_id: int):
@@ -19,7 +27,7 @@ def create_user(db: Session, user: schemas.UserCreate):
     # 密码为必填，进行哈希处理
     password_hash = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
     
-    db_user = User(name=user.name, password_hash=password_hash)
+    db_user = User(name=user.name, password_hash=password_hash, frecency_ref=datetime.now().replace(microsecond=0))
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
@@ -50,20 +58,31 @@ def authenticate_user(db: Session, name: str, password: str):
 def delete_user(db: Session, user_id: int):
     db_user = get_user(db, user_id)
     if db_user:
+        share_token = db_user.share_token
         db.delete(db_user)
         db.commit()
+        invalidate_user(user_id)
+        if share_token:
+            share.store.remove(share_token)  # 其他机器上的快照由 share.sweep() 清理
     return db_user
 
 # ========== 链接相关 ==========
 def get_link(db: Session, link_id: int, user_id: int):
     return db.query(Link).filter(and_(Link.id == link_id, Link.user_id == user_id)).first()
 
-def get_links(db: Session, user_id: int, skip: int = 0, limit: int = 1000, category: Optional[str] = None, search: Optional[str] = None):
+def get_links(db: Session, user_id: int, skip: int = 0, limit: int = 1000, category: Optional[str] = None,
+              search: Optional[str] = None, sort: Optional[str] = None, domain: Optional[str] = None):
     query = db.query(Link).filter(Link.user_id == user_id)
     
     if category and category != "全部":
         query = query.filter(Link.category == category)
     
+    if domain:
+        site, host = domains.filter_of(domain)
+        query = query.filter(Link.domain == site)
+        if host:
+            query = query.filter(Link.host == host)
+    
     if search:
         query = query.filter(
             or_(
@@ -73,8 +92,33 @@ def get_links(db: Session, user_id: int, skip: int = 0, limit: int = 1000, categ
             )
         )
     
+    if sort == "frecency":
+        # 直接按 (user_id, frecency) 索引倒序扫描取前 limit 个
+        query = query.order_by(Link.frecency.desc(), Link.id.desc())
+    
     return query.offset(skip).limit(limit).all()
 
+def get_link_hosts(db: Session, user_id: int):
+    return [row[0] for row in db.query(Link.host).filter(Link.user_id == user_id, Link.host.isnot(None)).distinct()]
+
+def get_domain_stats(db: Session, user_id: int, sort: str = "links", limit: int = 100):
+    """按可注册域名汇总链接数、点击数和失效链接数（sort: links / clicks / recent）"""
+    links = func.count(Link.id).label("links")
+    clicks = func.coalesce(func.sum(Link.clicks), 0).label("clicks")
+    last_access = func.max(Link.last_access).label("last_access")
+    broken = func.coalesce(func.sum(case(
+        (and_(Link.checked_at.isnot(None), or_(Link.http_status.is_(None), Link.http_status == 0,
+                                               Link.http_status >= 400)), 1),
+        else_=0,
+    )), 0).label("broken")
+    order = {"links": links, "clicks": clicks, "recent": last_access}[sort]
+    rows = db.query(
+        Link.domain, func.count(func.distinct(Link.host)).label("hosts"), links, clicks, broken, last_access,
+    ).filter(Link.user_id == user_id, Link.domain.isnot(None)).group_by(Link.domain).order_by(
+        order.desc(), Link.domain
+    ).limit(limit).all()
+    return [row._asdict() for row in rows]
+
 def get_link_by_url(db: Session, url: str, user_id: int):
     return db.query(Link).filter(and_(Link.url == url, Link.user_id == user_id)).first()
 
@@ -89,8 +133,14 @@ def create_link(db: Session, link: schemas.LinkCreate, user_id: int):
         tags=link.tags,
         is_private=link.is_private
     )
+    db_link.host, db_link.domain = domains.split_url(link.url)
     db.add(db_link)
+    db.flush()
+    record_change(db, user_id, "link", "upsert", [db_link.id], link.dict())
+    if not link.is_private:
+        share.invalidate(db, user_id)
     db.commit()
+    invalidate_user(user_id)
     db.refresh(db_link)
     return db_link
 
@@ -100,30 +150,84 @@ def update_link(db: Session, link_id: int, user_id: int, link_update: schemas.Li
         return None
     
     update_data = link_update.dict(exclude_unset=True)
+    was_shared = not db_link.is_private
+    url_changed = "url" in update_data and update_data["url"] != db_link.url
     for field, value in update_data.items():
         setattr(db_link, field, value)
+    if url_changed:
+        db_link.host, db_link.domain = domains.split_url(db_link.url)
+        # 旧地址的检查结果不适用于新地址，清空后在下一轮优先检查
+        for column in ("http_status", "final_url", "checked_at", "etag", "last_modified", "next_check_at"):
+            setattr(db_link, column, None)
+        db_link.check_failures = 0
     
+    record_change(db, user_id, "link", "upsert", [link_id], update_data)
+    if was_shared or not db_link.is_private:
+        share.invalidate(db, user_id)
     db.commit()
+    invalidate_user(user_id)
     db.refresh(db_link)
     return db_link
 
 def delete_link(db: Session, link_id: int, user_id: int):
     db_link = get_link(db, link_id, user_id)
     if db_link:
+        was_shared = not db_link.is_private
         db.delete(db_link)
+        record_change(db, user_id, "link", "delete", [link_id])
+        if was_shared:
+            share.invalidate(db, user_id)
         db.commit()
+        invalidate_user(user_id)
     return db_link
 
 def increment_link_clicks(db: Session, link_id: int, user_id: int):
-    db_link = get_link(db, link_id, user_id)
+    # 先锁定链接行再锁定用户行（_frecency_ref），与其他写操作的加锁顺序一致（见 record_change）
+    lock_for_write(db)
+    db_link = db.query(Link).filter(and_(Link.id == link_id, Link.user_id == user_id)).with_for_update().first()
     if db_link:
+        now = datetime.now()
+        weight = frecency_weight(now, _frecency_ref(db, user_id, now))
         db_link.clicks += 1
-        from datetime import datetime
-        db_link.last_access = datetime.now()
+        db_link.last_access = now
+        db_link.frecency = Link.frecency + weight
+        db.flush()
+        record_change(db, user_id, "link", "upsert", [link_id],
+                      {"clicks": db_link.clicks, "last_access": db_link.last_access, "frecency": db_link.frecency})
         db.commit()
+        invalidate_user(user_id)
         db.refresh(db_link)
     return db_link
 
+def get_link_health(db: Session, user_id: int, limit: int = 100):
+    """统计链接健康状况，返回统计数据和最多 limit 个失效链接
+
+    计数用一次聚合查询完成，只加载失效链接本身
+    """
+    checked = Link.checked_at.isnot(None)
+    broken = and_(checked, or_(Link.http_status.is_(None), Link.http_status == 0, Link.http_status >= 400))
+    skipped = and_(checked, Link.http_status == linkcheck.SKIPPED_STATUS)
+    redirected = and_(checked, Link.final_url.isnot(None), Link.final_url != "",
+                      Link.http_status != 0, Link.http_status < 400)
+
+    def count(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    row = db.query(
+        func.count(Link.id), count(checked), count(broken), count(skipped), count(redirected),
+    ).filter(Link.user_id == user_id).one()
+    total, checked_count, broken_count, skipped_count, redirected_count = row
+    broken_links = db.query(Link).filter(Link.user_id == user_id, broken).order_by(Link.id).limit(limit).all()
+    return {
+        "total": total,
+        "checked": checked_count,
+        "healthy": checked_count - broken_count - skipped_count,
+        "redirected": redirected_count,
+        "broken": broken_count,
+        "skipped": skipped_count,
+        "broken_links": broken_links,
+    }
+
 # ========== 分类相关 ==========
 def get_categories(db: Session, user_id: int):
     return db.query(Category).filter(Category.user_id == user_id).all()
@@ -139,7 +243,10 @@ def create_category(db: Session, category: schemas.CategoryCreate, user_id: int)
         is_collapsed=category.is_collapsed
     )
     db.add(db_category)
+    db.flush()
+    record_change(db, user_id, "category", "upsert", [db_category.id], category.dict())
     db.commit()
+    invalidate_user(user_id)
     db.refresh(db_category)
     return db_category
 
@@ -149,9 +256,13 @@ def update_category(db: Session, category_id: int, user_id: int, name: str, pare
         return None
     
     db_category.name = name
+    changed = {"name": name}
     if parent is not None:
         db_category.parent = parent
+        changed["parent"] = parent
+    record_change(db, user_id, "category", "upsert", [category_id], changed)
     db.commit()
+    invalidate_user(user_id)
     db.refresh(db_category)
     return db_category
 
@@ -159,20 +270,35 @@ def delete_category(db: Session, category_id: int, user_id: int):
     db_category = get_category(db, category_id, user_id)
     if db_category:
         db.delete(db_category)
+        record_change(db, user_id, "category", "delete", [category_id])
         db.commit()
+        invalidate_user(user_id)
     return db_category
 
 # ========== 用户设置相关 ==========
 def get_user_settings(db: Session, user_id: int):
     settings = db.query(UserSettings).filter(UserSettings.user_id == user_id).first()
-    if not settings:
-        return create_user_settings(db, user_id)
-    return settings
+    if settings:
+        return settings
+    # 只读会话可能读的是还没复制到的副本：改到主库确认后再创建
+    lock_for_write(db)
+    settings = db.query(UserSettings).filter(UserSettings.user_id == user_id).first()
+    if settings:
+        return settings
+    return create_user_settings(db, user_id)
 
 def create_user_settings(db: Session, user_id: int):
     db_settings = UserSettings(user_id=user_id)
     db.add(db_settings)
+    try:
+        db.flush()
+    except IntegrityError:
+        # 并发请求已经创建（user_settings.user_id 唯一）
+        db.rollback()
+        return db.query(UserSettings).filter(UserSettings.user_id == user_id).one()
+    record_change(db, user_id, "settings", "upsert", [db_settings.id])
     db.commit()
+    invalidate_user(user_id)
     db.refresh(db_settings)
     return db_settings
 
@@ -185,7 +311,11 @@ def update_user_settings(db: Session, user_id: int, settings_update: schemas.Use
     for field, value in update_data.items():
         setattr(db_settings, field, value)
     
+    record_change(db, user_id, "settings", "upsert", [db_settings.id], update_data)
+    if "page_title" in update_data or "page_subtitle" in update_data:
+        share.invalidate(db, user_id)
     db.commit()
+    invalidate_user(user_id)
     db.refresh(db_settings)
     return db_settings
 
@@ -197,39 +327,234 @@ def create_access_history(db: Session, user_id: int, history: schemas.AccessHist
         link_name=history.link_name
     )
     db.add(db_history)
+    db.flush()
+    record_change(db, user_id, "access_history", "upsert", [db_history.id],
+                  {"link_url": history.link_url, "link_name": history.link_name})
     db.commit()
+    invalidate_user(user_id)
     db.refresh(db_history)
     return db_history
 
 def get_access_history(db: Session, user_id: int, limit: int = 100):
     return db.query(AccessHistory).filter(AccessHistory.user_id == user_id).order_by(AccessHistory.timestamp.desc()).limit(limit).all()
 
+def _access_history_filter(user_id: int, before: Optional[datetime]):
+    conditions = [AccessHistory.user_id == user_id]
+    if before is not None:
+        conditions.append(AccessHistory.timestamp < before)
+    return and_(*conditions)
+
+def count_access_history(db: Session, user_id: int, before: Optional[datetime] = None):
+    return db.query(AccessHistory).filter(_access_history_filter(user_id, before)).count()
+
+def purge_access_history(db: Session, user_id: int, before: Optional[datetime] = None, limit: int = 1000,
+                         commit: bool = True):
+    """删除最多 limit 条访问历史（before 为空时不限时间），返回删除的条数；commit 同批量操作"""
+    ids = [row[0] for row in db.query(AccessHistory.id).filter(
+        _access_history_filter(user_id, before)
+    ).order_by(AccessHistory.id).limit(limit)]
+    if not ids:
+        return 0
+    deleted = db.query(AccessHistory).filter(AccessHistory.id.in_(ids)).delete(synchronize_session=False)
+    record_change(db, user_id, "access_history", "delete", ids)
+    if commit:
+        db.commit()
+        invalidate_user(user_id)
+    return deleted
+
 # ========== 批量操作 ==========
-def batch_update_category(db: Session, user_id: int, link_urls: List[str], category: str):
+# commit=False 时不提交：后台任务把本批修改与任务进度在同一事务中提交，提交后再调用 invalidate_user()
+def _link_ids_by_urls(db: Session, user_id: int, link_urls: List[str]):
+    return [row[0] for row in db.query(Link.id).filter(
+        and_(Link.user_id == user_id, Link.url.in_(link_urls))
+    ).all()]
+
+def batch_update_category(db: Session, user_id: int, link_urls: List[str], category: str, commit: bool = True):
+    link_ids = _link_ids_by_urls(db, user_id, link_urls)
     updated = db.query(Link).filter(
         and_(Link.user_id == user_id, Link.url.in_(link_urls))
     ).update({"category": category}, synchronize_session=False)
-    db.commit()
+    if link_ids:
+        record_change(db, user_id, "link", "upsert", link_ids, {"category": category})
+    share.invalidate(db, user_id)
+    if commit:
+        db.commit()
+        invalidate_user(user_id)
     return updated
 
-def batch_update_tags(db: Session, user_id: int, link_urls: List[str], tags: List[str]):
+def batch_update_tags(db: Session, user_id: int, link_urls: List[str], tags: List[str], commit: bool = True):
+    link_ids = _link_ids_by_urls(db, user_id, link_urls)
     updated = db.query(Link).filter(
         and_(Link.user_id == user_id, Link.url.in_(link_urls))
     ).update({"tags": tags}, synchronize_session=False)
-    db.commit()
+    if link_ids:
+        record_change(db, user_id, "link", "upsert", link_ids, {"tags": tags})
+    share.invalidate(db, user_id)
+    if commit:
+        db.commit()
+        invalidate_user(user_id)
     return updated
 
-def batch_update_share(db: Session, user_id: int, link_urls: List[str], is_private: bool):
+def batch_update_share(db: Session, user_id: int, link_urls: List[str], is_private: bool, commit: bool = True):
+    link_ids = _link_ids_by_urls(db, user_id, link_urls)
     updated = db.query(Link).filter(
         and_(Link.user_id == user_id, Link.url.in_(link_urls))
     ).update({"is_private": is_private}, synchronize_session=False)
-    db.commit()
+    if link_ids:
+        record_change(db, user_id, "link", "upsert", link_ids, {"is_private": is_private})
+    share.invalidate(db, user_id)
+    if commit:
+        db.commit()
+        invalidate_user(user_id)
     return updated
 
-def batch_delete_links(db: Session, user_id: int, link_urls: List[str]):
+def batch_delete_links(db: Session, user_id: int, link_urls: List[str], commit: bool = True):
+    link_ids = _link_ids_by_urls(db, user_id, link_urls)
     deleted = db.query(Link).filter(
         and_(Link.user_id == user_id, Link.url.in_(link_urls))
     ).delete(synchronize_session=False)
-    db.commit()
+    if link_ids:
+        record_change(db, user_id, "link", "delete", link_ids)
+    share.invalidate(db, user_id)
+    if commit:
+        db.commit()
+        invalidate_user(user_id)
     return deleted
 
+# ========== 使用频率（frecency） ==========
+def frecency_weight(at: datetime, ref: datetime) -> float:
+    """at 时刻的一次点击相对于参考时间 ref 的权重 exp(λ·(at − ref))"""
+    rate = math.log(2) / (settings.FRECENCY_HALF_LIFE_DAYS * 86400)
+    return math.exp(rate * (at - ref).total_seconds())
+
+def _frecency_ref(db: Session, user_id: int, now: datetime):
+    """读取用户的参考时间并锁定到事务结束（与重归一化互斥），尚未设置时设为当前时间
+
+    必须在读取之前加锁：否则读取后、写入前完成的重归一化会移动参考时间，
+    这次点击的权重就会按旧的参考时间加到新的尺度上
+    """
+    lock_for_write(db)
+    ref = db.query(User.frecency_ref).filter(User.id == user_id).with_for_update().scalar()
+    if ref is None:
+        ref = now.replace(microsecond=0)
+        db.query(User).filter(User.id == user_id).update({User.frecency_ref: ref}, synchronize_session=False)
+    return ref
+
+def get_frecency_due_users(db: Session, before: datetime, limit: int = 100):
+    """参考时间早于 before、需要重归一化的用户ID"""
+    return [row[0] for row in db.query(User.id).filter(User.frecency_ref < before).order_by(User.frecency_ref).limit(limit).all()]
+
+def renormalize_frecency(db: Session, user_id: int, now: Optional[datetime] = None):
+    """把参考时间移到 now，所有链接分数乘以同一衰减系数（排序不变），返回系数"""
+    now = (now or datetime.now()).replace(microsecond=0)
+    lock_for_write(db)
+    ref = db.query(User.frecency_ref).filter(User.id == user_id).scalar()
+    if ref is None or ref >= now:
+        db.rollback()
+        return None
+    factor = 1 / frecency_weight(now, ref)
+    # 先锁定并缩放该用户的全部链接，最后更新用户行（加锁顺序见 record_change）：
+    # 已锁定链接、正在读取参考时间的点击会先提交，它的权重随后被一起缩放
+    db.query(Link).filter(Link.user_id == user_id).update(
+        {Link.frecency: Link.frecency * factor}, synchronize_session=False
+    )
+    moved = db.query(User).filter(and_(User.id == user_id, User.frecency_ref == ref)).update(
+        {User.frecency_ref: now}, synchronize_session=False
+    )
+    if not moved:
+        db.rollback()  # 参考时间已被其他进程移动
+        return None
+    record_change(db, user_id, "frecency", "rescale", [], {"factor": factor})
+    db.commit()
+    invalidate_user(user_id)
+    return factor
+
+# ========== 公开分享 ==========
+def get_share_token(db: Session, user_id: int):
+    """返回用户的分享令牌，没有时生成一个"""
+    db_user = get_user(db, user_id)
+    if db_user is None:
+        return None
+    if not db_user.share_token:
+        db_user.share_token = share.new_token()
+        db.commit()
+    return db_user.share_token
+
+def reset_share_token(db: Session, user_id: int):
+    """更换分享令牌，旧的分享地址随即失效"""
+    db_user = get_user(db, user_id)
+    if db_user is None:
+        return None
+    old_token = db_user.share_token
+    db_user.share_token = share.new_token()
+    db.commit()
+    if old_token:
+        # 本进程立即失效；其他进程的令牌缓存最多 SHARE_TOKEN_CACHE_SECONDS 秒后失效
+        share.tokens.forget(old_token)
+        share.store.remove(old_token)
+    return db_user.share_token
+
+# ========== 后台任务 ==========
+def get_job(db: Session, job_id: int):
+    return db.query(Job).filter(Job.id == job_id).first()
+
+def count_user_rows(db: Session, user_id: int):
+    """用户的链接和访问历史总数，用于判断删除用户是否转为后台任务"""
+    return (db.query(Link).filter(Link.user_id == user_id).count()
+            + db.query(AccessHistory).filter(AccessHistory.user_id == user_id).count())
+
+# ========== 变更事件 ==========
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+def record_change(db: Session, user_id: int, entity: str, op: str, ids: List[int], fields: Optional[dict] = None):
+    """记录一条变更事件，与业务写入在同一事务中提交
+
+    事件序号在用户行的写锁下分配（users.change_seq 加一），锁持有到提交，所以同一用户的事件
+    按序号顺序可见；自增主键做不到这一点，两个事务可能以与主键相反的顺序提交。
+    先写入本事务的其他改动再锁用户行：所有写操作都是先锁业务数据、最后锁用户行，不会互相死锁。
+    """
+    db.flush()
+    db.query(User).filter(User.id == user_id).update(
+        {User.change_seq: User.change_seq + 1}, synchronize_session=False
+    )
+    seq = db.query(User.change_seq).filter(User.id == user_id).scalar()
+    db.add(ChangeEvent(
+        user_id=user_id,
+        seq=seq,
+        entity=entity,
+        op=op,
+        ids=list(ids),
+        fields=_jsonable(fields) if fields else None,
+        created_at=datetime.now()
+    ))
+
+def get_change_events(db: Session, user_id: int, after_seq: int, limit: int = 500):
+    return db.query(ChangeEvent).filter(
+        and_(ChangeEvent.user_id == user_id, ChangeEvent.seq > after_seq)
+    ).order_by(ChangeEvent.seq).limit(limit).all()
+
+def get_change_event(db: Session, user_id: int, seq: int):
+    return db.query(ChangeEvent).filter(
+        and_(ChangeEvent.user_id == user_id, ChangeEvent.seq == seq)
+    ).first()
+
+def get_latest_change_seq(db: Session, user_id: int):
+    return db.query(User.change_seq).filter(User.id == user_id).scalar() or 0
+
+def prune_change_events(db: Session, before: datetime, limit: int = 1000):
+    """删除最多 limit 条 before 之前的事件（所有用户），返回删除的条数"""
+    ids = [row[0] for row in db.query(ChangeEvent.id).filter(
+        ChangeEvent.created_at < before
+    ).order_by(ChangeEvent.created_at).limit(limit)]
+    if not ids:
+        return 0
+    deleted = db.query(ChangeEvent).filter(ChangeEvent.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -1,46 +1,407 @@
-from sqlalchemy import create_engine
+import contextvars
+import itertools
+import threading
+import time
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import Insert, Update, Delete
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class Settings(BaseSettings):
+    DB_ENGINE: str = "mysql"  # mysql 或 sqlite
     DB_HOST: str = "localhost"
     DB_PORT: int = 3306
     DB_USER: str = "root"
     DB_PASSWORD: str = ""
     DB_NAME: str = "link_portal"
-    
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0  # 等待空闲连接的上限（秒）
+    # 请求内数据库语句超时（毫秒），按 ratelimit.py 的路由类别设置，default 为其余类别；0 表示不限
+    DB_STATEMENT_TIMEOUTS: str = "default=5000,search=2000"
+
+    # SQLite 模式（单机部署 / 测试）
+    SQLITE_PATH: str = "link_portal.sqlite3"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # WAL 模式下 NORMAL 足够安全
+    SQLITE_CACHE_SIZE: int = -65536  # 负数表示 KiB，即 64MB
+    SQLITE_MMAP_SIZE: int = 268435456  # 256MB
+    SQLITE_BUSY_TIMEOUT: int = 5000  # 毫秒
+
+    # 读写分离：逗号分隔的只读副本连接URL，为空表示不启用
+    DB_REPLICA_URLS: str = ""
+    REPLICA_STICKY_SECONDS: float = 5.0  # 客户端带回写入标记（X-Write-Marker）后该时间内的读请求仍走主库
+    REPLICA_RETRY_SECONDS: float = 30.0  # 副本出错后暂停使用的时间
+
+    # 读缓存：none / memory / local / redis，见 cache.py
+    CACHE_BACKEND: str = "none"
+    CACHE_LOCAL_PATH: str = "/tmp/link_portal_cache_versions"
+    CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    CACHE_REDIS_PUBLISH_TIMEOUT: float = 0.5  # 后台发布失效消息时每条命令的超时，失败后退避重发
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_TTL_SECONDS: float = 300.0
+
+    # 变更推送（SSE / WebSocket）
+    CHANGE_FEED_RETENTION_HOURS: float = 24.0  # 变更事件保留时间，超出后客户端需全量重新加载
+    CHANGE_FEED_MAX_BACKLOG: int = 500  # 客户端积压超过该数量时发送 reset 而不是逐条推送
+    CHANGE_FEED_POLL_SECONDS: float = 15.0  # 无通知时的轮询 / 心跳间隔
+    CHANGE_FEED_PRUNE_INTERVAL_MINUTES: float = 10.0  # 清理过期事件的间隔，0 表示不在应用进程内清理
+
+    # 失效链接检查（见 linkcheck.py）
+    LINK_CHECK_ENABLED: bool = False  # 是否在应用进程内后台运行（多 worker 时只在一个进程开启）
+    LINK_CHECK_CONCURRENCY: int = 50  # 全局并发请求数
+    LINK_CHECK_PER_HOST: int = 2  # 单个主机的并发请求数
+    LINK_CHECK_HOST_DELAY: float = 1.0  # 同一主机两次请求之间的最小间隔（秒）
+    LINK_CHECK_TIMEOUT: float = 10.0
+    LINK_CHECK_BATCH: int = 500  # 每轮最多检查的链接数
+    LINK_CHECK_INTERVAL_HOURS: float = 168.0  # 正常链接的复查间隔
+    LINK_CHECK_RETRY_HOURS: float = 1.0  # 失败链接首次重试间隔，之后指数退避
+    LINK_CHECK_MAX_BACKOFF_HOURS: float = 720.0
+    LINK_CHECK_IDLE_SECONDS: float = 60.0  # 没有到期链接时的等待时间
+    LINK_CHECK_ALLOW_PRIVATE_HOSTS: bool = False  # 是否检查指向 localhost / 内网地址的链接（仅用于测试）
+
+    # 网站图标缓存（见 favicon.py）
+    FAVICON_CACHE_DIR: str = "favicon_cache"
+    FAVICON_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    FAVICON_SIZE: int = 32  # 缩放后的边长（需要安装 Pillow）
+    FAVICON_TIMEOUT: float = 5.0
+    FAVICON_TTL_DAYS: float = 30.0  # 图标重新抓取间隔
+    FAVICON_MISSING_TTL_HOURS: float = 24.0  # 抓取失败后的重试间隔
+    FAVICON_ALLOW_PRIVATE_HOSTS: bool = False  # 是否允许抓取 localhost / 内网 IP（仅用于测试）
+
+    # 使用频率排序（见 frecency.py）
+    FRECENCY_HALF_LIFE_DAYS: float = 30.0  # 点击权重的半衰期
+    FRECENCY_RENORMALIZE_DAYS: float = 30.0  # 参考时间早于该天数的用户会被重归一化
+    FRECENCY_RENORMALIZE_ENABLED: bool = True  # 是否在应用进程内定期重归一化
+    FRECENCY_RENORMALIZE_INTERVAL_HOURS: float = 24.0
+
+    # 公开分享页（见 share.py）
+    SHARE_SNAPSHOT_DIR: str = "share_snapshots"  # 快照缓存目录，每台机器各自一份即可
+    SHARE_TOKEN_CACHE_SECONDS: float = 5.0  # 令牌与快照版本的进程内缓存时间，其他机器的修改最多滞后这么久
+    SHARE_SWEEP_INTERVAL_HOURS: float = 1.0  # 清理旧版本 / 已失效令牌快照的间隔，0 表示不在应用进程内清理
+    SHARE_MAX_AGE: int = 60  # 浏览器 / CDN 缓存时间（秒），过期后用 ETag 重新验证
+    SHARE_STALE_SECONDS: int = 600  # 允许 CDN 在后台重新验证期间返回旧内容的时间
+
+    # 后台任务（见 jobs.py）
+    JOB_ENABLED: bool = True  # 是否在应用进程内运行 worker（也可单独运行 python jobs.py）
+    JOB_WORKERS: int = 2  # 每个进程同时执行的任务数
+    JOB_POLL_SECONDS: float = 1.0  # 空闲 worker 查询新任务的间隔（同一进程提交的任务会立即唤醒）
+    JOB_CHUNK: int = 500  # 每批处理的记录数，每批完成后保存进度
+    JOB_INLINE_LIMIT: int = 500  # 批量操作 / 删除用户涉及的记录数不超过该值时直接在请求内执行
+    JOB_STALE_SECONDS: float = 300.0  # 执行中的任务超过该时间没有保存进度，视为 worker 已退出
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_SECONDS: float = 10.0  # 失败后首次重试间隔，之后指数退避
+    JOB_RETENTION_DAYS: float = 7.0  # 已结束任务的保留时间
+
+    # 备份与恢复（见 backup.py）
+    BACKUP_COMPRESSION: str = "auto"  # auto（安装了 zstandard 时用 zstd，否则 gzip）/ zstd / gzip
+    BACKUP_CHUNK: int = 1000  # 备份时每次读取的行数，恢复时每批写入的行数
+
+    # 限流与过载保护（见 ratelimit.py）
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"  # none / memory / local / redis（使用 CACHE_REDIS_URL）
+    RATE_LIMIT_LOCAL_PATH: str = "/tmp/link_portal_rate_limits"
+    # 每个用户（无用户ID的接口按 IP）每个类别的令牌桶：每秒令牌数/桶容量
+    RATE_LIMITS: str = "read=20/60,search=5/15,click=5/20,write=10/30,batch=1/5,auth=1/10,public=50/300"
+    # 反向代理 / CDN 的地址或网段（逗号分隔）；来自这些地址的请求按转发头取客户端 IP，否则所有匿名请求共用一个桶
+    RATE_LIMIT_TRUSTED_PROXIES: str = ""
+    RATE_LIMIT_CLIENT_IP_HEADER: str = "X-Forwarded-For"
+    RATE_LIMIT_CONCURRENCY: str = "search=4,batch=2"  # 每个进程内同时执行的请求数上限
+    RATE_LIMIT_CONCURRENCY_WAIT: float = 0.5  # 等待并发空位的上限（秒），超时返回 503
+    LOAD_SHED_ENABLED: bool = True
+    LOAD_SHED_QUEUE_DEPTH: int = 10  # 处理中的请求超过连接池容量该数量后返回 503
+    LOAD_SHED_RETRY_AFTER: float = 1.0
+
+    # 启动与健康检查（见 lifecycle.py）
+    STARTUP_POOL_WARMUP: int = 5  # 启动时预先建立的数据库连接数（不超过 DB_POOL_SIZE），0 表示不预热
+    STARTUP_RETRY_SECONDS: float = 1.0  # 启动时数据库不可用的首次重试间隔，之后指数退避（最长 30 秒）
+    HEALTH_CACHE_SECONDS: float = 2.0  # 就绪检查中数据库检查结果的缓存时间
+    HEALTH_CHECK_TIMEOUT: float = 2.0  # 数据库检查超过该时间未完成视为不可用
+
+    # 数据库迁移（见 migrations.py）
+    SCHEMA_AUTO_MIGRATE: bool = False  # 启动时自动执行待执行的迁移（单实例部署 / 开发环境）
+    MIGRATION_BACKFILL_CHUNK: int = 1000  # 数据回填每批处理的主键范围
+    MIGRATION_BACKFILL_SLEEP: float = 0.05  # 每批之间的休眠时间（秒），降低对线上写入的影响
+    MIGRATION_LOCK_WAIT_TIMEOUT: int = 5  # MySQL DDL 等待元数据锁的上限（秒），超时后重试
+    MIGRATION_DDL_RETRIES: int = 5
+
     class Config:
         env_file = ".env"
         extra = "ignore"  # 忽略额外的环境变量
 
 settings = Settings()
 
+def build_database_url(settings: Settings) -> str:
+    """根据配置生成数据库连接URL"""
+    if settings.DB_ENGINE == "sqlite":
+        return f"sqlite:///{settings.SQLITE_PATH}"
+    return f"mysql+pymysql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}?charset=utf8mb4"
+
 # 创建数据库连接URL
-DATABASE_URL = f"mysql+pymysql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}?charset=utf8mb4"
+DATABASE_URL = build_database_url(settings)
+
+# ========== SQLite 调优 ==========
+# 每个 SQLite 数据库文件一把写锁：同一进程内的写事务排队执行，
+# 避免并发写入时出现 "database is locked"（跨进程仍依赖 busy_timeout）
+_sqlite_write_locks = {}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size={int(settings.SQLITE_CACHE_SIZE)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")  # 与 MySQL 一致地执行 ON DELETE CASCADE
+    cursor.close()
+
+# ========== 语句超时 ==========
+# 由 ratelimit.py 按请求设置；后台任务等不在请求内的代码为 None（不限时）
+request_statement_timeout = contextvars.ContextVar("request_statement_timeout", default=None)
+
+def _apply_statement_timeout(connection):
+    """每个事务开始时应用当前请求的语句超时，与连接上已有的设置相同时不发送任何语句
+
+    MySQL 使用 max_execution_time（只对 SELECT 生效，单条语句计时）；
+    SQLite 没有语句超时，用 progress handler 在整个事务超过时限后中断执行。
+    """
+    timeout = request_statement_timeout.get() or 0
+    if connection.info.get("statement_timeout", 0) == timeout and not timeout:
+        return
+    if connection.dialect.name == "mysql":
+        if connection.info.get("statement_timeout", 0) != timeout:
+            connection.exec_driver_sql(f"SET SESSION max_execution_time = {int(timeout)}")
+    elif connection.dialect.name == "sqlite":
+        dbapi_connection = connection.connection.dbapi_connection
+        if timeout:
+            deadline = time.monotonic() + timeout / 1000
+            dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        else:
+            dbapi_connection.set_progress_handler(None, 1000)
+    connection.info["statement_timeout"] = timeout
+
+def is_statement_timeout(exc) -> bool:
+    """语句因超时被中断（MySQL 3024 / SQLite interrupted）"""
+    if not isinstance(exc, OperationalError):
+        return False
+    code = exc.orig.args[0] if exc.orig is not None and exc.orig.args else None
+    return code == 3024 or "interrupted" in str(exc.orig)
+
+def make_engine(url: str):
+    """创建数据库引擎，SQLite 会应用 WAL 等 pragma 并启用单写者队列"""
+    if url.startswith("sqlite"):
+        sqlite_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT / 1000},
+            echo=False
+        )
+        event.listen(sqlite_engine, "connect", _set_sqlite_pragmas)
+        event.listen(sqlite_engine, "begin", _apply_statement_timeout)
+        _sqlite_write_locks[str(sqlite_engine.url)] = threading.Lock()
+        return sqlite_engine
+    mysql_engine = create_engine(
+        url,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        echo=False
+    )
+    event.listen(mysql_engine, "begin", _apply_statement_timeout)
+    return mysql_engine
+
+def _write_lock_for(session: Session):
+    bind = session.get_bind()
+    if bind.dialect.name != "sqlite":
+        return None
+    return _sqlite_write_locks.get(str(bind.url))
+
+def _acquire_write_lock(session: Session):
+    if session.info.get("sqlite_write_lock"):
+        return
+    lock = _write_lock_for(session)
+    if lock is None:
+        return
+    # 超时后不再等待，交给 SQLite 的 busy_timeout 处理
+    if lock.acquire(timeout=settings.SQLITE_BUSY_TIMEOUT / 1000):
+        session.info["sqlite_write_lock"] = lock
+
+def lock_for_write(session: Session):
+    """读取将要依据其写入的数据之前调用：SQLite 下先排到单写者队列，读和写之间不会插入其他写事务
+
+    MySQL 不需要，调用方用 SELECT ... FOR UPDATE 锁定要读取的行
+    """
+    session.info["wrote"] = True
+    _acquire_write_lock(session)
+
+@event.listens_for(Session, "before_flush")
+def _before_flush(session, flush_context, instances):
+    session.info["wrote"] = True
+    _acquire_write_lock(session)
+
+@event.listens_for(Session, "do_orm_execute")
+def _before_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+        _acquire_write_lock(orm_execute_state.session)
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_write_lock(session, transaction):
+    if transaction.parent is None:
+        lock = session.info.pop("sqlite_write_lock", None)
+        if lock is not None:
+            lock.release()
+
+# ========== 读写分离 ==========
+WRITE_MARKER_HEADER = "X-Write-Marker"
+
+class ReplicaRouter:
+    """只读副本路由：轮询选择健康的副本"""
+
+    def __init__(self, replicas, sticky_seconds: float, retry_seconds: float):
+        self.replicas = list(replicas)
+        self.sticky_seconds = sticky_seconds
+        self.retry_seconds = retry_seconds
+        self._cycle = itertools.cycle(range(len(self.replicas)))
+        self._down_until = {}
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        # 连接类错误时暂停使用该副本
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, replica):
+        with self._lock:
+            self._down_until[replica] = time.monotonic() + self.retry_seconds
+
+    def pick(self):
+        """返回一个健康的副本，全部不可用时返回 None（回退到主库）"""
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[next(self._cycle)]
+                if self._down_until.get(replica, 0) <= now:
+                    return replica
+        return None
+
+    def is_sticky(self, marker) -> bool:
+        """客户端带回的写入标记（写入时间，毫秒）仍在窗口内：读主库，保证读到自己的写入
+
+        标记由客户端保存，与请求落在哪个 worker 无关；允许少量时钟偏差
+        """
+        try:
+            written = int(marker) / 1000
+        except (TypeError, ValueError):
+            return False
+        return abs(time.time() - written) <= self.sticky_seconds
+
+class RoutingSession(Session):
+    """写操作和普通会话走主库；标记为只读的会话走副本"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            replica_router is None
+            or not self.info.get("read_only")
+            or self.info.get("wrote")
+            or self._flushing
+            or isinstance(clause, (Insert, Update, Delete))
+        ):
+            return super().get_bind(mapper, clause=clause, **kw)
+        replica = self.info.get("replica")
+        if replica is None:
+            replica = replica_router.pick() or engine
+            self.info["replica"] = replica
+        return replica
+
+def use_primary(session: Session):
+    """之后的查询改走主库（只读会话中需要读到最新数据时调用）"""
+    session.info.pop("read_only", None)
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_write(session):
+    # 请求内提交过写入：由 WriteMarkerMiddleware 在响应中返回写入标记
+    request = session.info.get("request")
+    if replica_router is not None and session.info.get("wrote") and request is not None:
+        request.state.write_marker = int(time.time() * 1000)
+
+class WriteMarkerMiddleware:
+    """纯 ASGI 中间件：请求内提交过写入时在响应头 X-Write-Marker 中返回写入时间
+
+    前端在之后的请求中原样带回该标记，get_read_db() 据此在 REPLICA_STICKY_SECONDS 内改读主库
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_marker(message):
+            if message["type"] == "http.response.start":
+                marker = scope.get("state", {}).get("write_marker")
+                if marker is not None:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (WRITE_MARKER_HEADER.lower().encode(), str(marker).encode())
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_marker)
 
 # 创建数据库引擎
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    echo=False
-)
+engine = make_engine(DATABASE_URL)
+
+replica_router = None
+if settings.DB_REPLICA_URLS.strip():
+    replica_router = ReplicaRouter(
+        [make_engine(url.strip()) for url in settings.DB_REPLICA_URLS.split(",") if url.strip()],
+        sticky_seconds=settings.REPLICA_STICKY_SECONDS,
+        retry_seconds=settings.REPLICA_RETRY_SECONDS,
+    )
 
 # 创建会话工厂
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 # 创建基础模型类
 Base = declarative_base()
 
-# 依赖注入：获取数据库会话
-def get_db():
+def _path_user_id(request: Request):
+    user_id = request.path_params.get("user_id") if request is not None else None
+    try:
+        return int(user_id) if user_id is not None else None
+    except ValueError:
+        return None
+
+# 依赖注入：获取数据库会话（主库）
+def get_db(request: Request = None):
     db = SessionLocal()
+    db.info["user_id"] = _path_user_id(request)
+    db.info["request"] = request
     try:
         yield db
     finally:
         db.close()
 
+# 依赖注入：获取只读数据库会话（配置了副本时读副本，客户端刚写入过则仍读主库）
+def get_read_db(request: Request = None):
+    db = SessionLocal()
+    db.info["user_id"] = _path_user_id(request)
+    db.info["request"] = request
+    marker = request.headers.get(WRITE_MARKER_HEADER) if request is not None else None
+    if replica_router is not None and not replica_router.is_sticky(marker):
+        db.info["read_only"] = True
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,93 @@
+"""
+链接域名
+
+links.host 是链接地址中的主机名（小写，非默认端口时带端口），与网站图标的缓存键相同；
+links.domain 是可注册域名（www.example.co.uk -> example.co.uk），用于按网站分组和过滤，
+有 (user_id, domain) 索引。两个字段在创建、修改链接时写入，旧数据由迁移按主键分批回填。
+
+可注册域名按内置的常见多段公共后缀计算，不依赖完整的 Public Suffix List：
+不在列表中的后缀按最后一段处理。IP 地址和 localhost 这类单段主机名的 domain 就是主机名本身。
+"""
+import ipaddress
+from urllib.parse import urlsplit
+from sqlalchemy import select, update, bindparam, and_
+from models import Link
+
+MAX_LENGTH = 255
+
+# 常见的多段公共后缀（含 github.io 这类每个子域名属于不同所有者的托管域名）
+MULTI_PART_SUFFIXES = frozenset({
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "ltd.uk", "plc.uk",
+    "com.cn", "net.cn", "org.cn", "gov.cn", "edu.cn", "ac.cn",
+    "com.hk", "org.hk", "edu.hk", "com.tw", "org.tw", "edu.tw", "com.sg", "edu.sg",
+    "co.jp", "ne.jp", "or.jp", "ac.jp", "go.jp", "co.kr", "or.kr", "ac.kr",
+    "com.au", "net.au", "org.au", "edu.au", "gov.au", "co.nz", "org.nz",
+    "com.br", "net.br", "org.br", "co.in", "net.in", "org.in", "ac.in",
+    "com.mx", "com.ar", "com.tr", "com.ru", "co.za", "co.il", "com.my", "com.vn",
+    "github.io", "gitlab.io", "gitee.io", "herokuapp.com", "vercel.app", "netlify.app",
+    "pages.dev", "workers.dev", "blogspot.com", "appspot.com", "cloudfront.net",
+})
+
+def host_of(url: str):
+    """从链接地址中取出主机名（含端口），无法解析时返回 None"""
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+        port = parts.port
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip(".")
+    host = f"{host}:{port}" if port else host
+    return host if host and len(host) <= MAX_LENGTH else None
+
+def _strip_port(host: str) -> str:
+    name, sep, port = host.rpartition(":")
+    return name if sep and port.isdigit() and ":" not in name else host
+
+def registrable_domain(host: str):
+    """主机名（可带端口） -> 可注册域名"""
+    if not host:
+        return None
+    name = _strip_port(host.lower()).rstrip(".")
+    try:
+        ipaddress.ip_address(name)
+        return name
+    except ValueError:
+        pass
+    labels = [label for label in name.split(".") if label]
+    if len(labels) <= 2:
+        return ".".join(labels) or None
+    suffix = 2 if ".".join(labels[-2:]) in MULTI_PART_SUFFIXES else 1
+    return ".".join(labels[-(suffix + 1):])
+
+def split_url(url: str):
+    """链接地址 -> (host, domain)"""
+    host = host_of(url)
+    return host, registrable_domain(host)
+
+def filter_of(value: str):
+    """链接列表的 domain 参数 -> (domain, host)
+
+    传入可注册域名（python.org）时匹配该网站的所有链接，host 为 None；
+    传入子域名（docs.python.org）时只匹配这个主机。
+    """
+    host = value.strip().lower().rstrip(".")
+    domain = registrable_domain(host)
+    return domain, (host if host != domain else None)
+
+def backfill_link_domains(connection, lo: int, hi: int) -> int:
+    """为 lo < id <= hi 中还没有 host 的链接写入 host 和 domain"""
+    rows = connection.execute(
+        select(Link.id, Link.url).where(and_(Link.id > lo, Link.id <= hi, Link.host.is_(None)))
+    ).all()
+    values = []
+    for link_id, url in rows:
+        host, domain = split_url(url)
+        if host is not None:
+            values.append({"_id": link_id, "host": host, "domain": domain})
+    if values:
+        table = Link.__table__
+        connection.execute(update(table).where(table.c.id == bindparam("_id")), values)
+    return len(values)
@@ -0,0 +1,355 @@
+"""
+网站图标缓存与代理
+
+按域名抓取一次图标（所有用户共享），缩放后以内容哈希为文件名保存在磁盘上：
+
+    FAVICON_CACHE_DIR/
+        objects/ab/abcdef...     图标内容（相同图标只存一份）
+        domains/<sha1(域名)>     域名 -> 内容哈希、类型、抓取时间；抓取失败也会记录，避免反复请求
+
+读取时刷新文件的修改时间作为最近使用时间，总大小超过 FAVICON_CACHE_MAX_BYTES 时
+按最近使用时间从旧到新淘汰。安装了 Pillow 时图标会被缩放为 FAVICON_SIZE 的 PNG，
+否则保存原始内容。
+
+为避免被用来访问内部服务，重定向不自动跟随，而是逐跳处理（最多 MAX_REDIRECTS 次）：
+每一跳（包括重定向目标和首页中的图标地址）连接前都先解析主机名，任一地址为回环、内网、
+链路本地、保留或组播地址即拒绝；请求直接发往校验过的 IP（Host 头和 TLS SNI 仍使用原主机名），
+不会因为再次解析（DNS rebinding）连到别的地址。
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import re
+import socket
+import threading
+import time
+from urllib.parse import urljoin
+import httpx
+from starlette.concurrency import run_in_threadpool
+from database import settings
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 为可选依赖
+    Image = None
+
+USER_AGENT = "LinkPortal-Favicon/1.0"
+MAX_ICON_BYTES = 512 * 1024
+MAX_REDIRECTS = 5
+ICON_LINK_RE = re.compile(r"<link[^>]+rel=[\"']?[^\"'>]*icon[^\"'>]*[\"']?[^>]*>", re.IGNORECASE)
+HREF_RE = re.compile(r"href=[\"']?([^\"' >]+)", re.IGNORECASE)
+DOMAIN_RE = re.compile(r"^[A-Za-z0-9.-]+(:\d+)?$")
+
+def is_public_address(address) -> bool:
+    """是否为公网地址：拒绝回环、内网、链路本地、保留和组播地址"""
+    address = ipaddress.ip_address(address)
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global and not (address.is_loopback or address.is_private or address.is_link_local
+                                       or address.is_reserved or address.is_multicast)
+
+def _is_local_name(host: str) -> bool:
+    host = host.lower().rstrip(".")
+    return host == "localhost" or host.endswith(".localhost")
+
+def is_allowed_domain(domain: str) -> bool:
+    """校验域名格式，并拒绝 localhost 和字面内网 IP；解析后的地址在抓取时逐跳校验"""
+    if not domain or len(domain) > 255 or DOMAIN_RE.match(domain) is None:
+        return False
+    if settings.FAVICON_ALLOW_PRIVATE_HOSTS:
+        return True
+    host = domain.rsplit(":", 1)[0] if ":" in domain else domain
+    if _is_local_name(host):
+        return False
+    try:
+        return is_public_address(host)
+    except ValueError:
+        return True
+
+async def resolve_host(host: str, port: int):
+    """解析主机名，返回全部地址"""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+class BlockedAddressError(Exception):
+    """目标解析到回环、内网等不允许访问的地址"""
+
+async def pinned_request(client: httpx.AsyncClient, method: str, url: str, headers: dict = None,
+                         resolve=resolve_host, allow_private: bool = False):
+    """解析并校验 url 的主机，返回直接发往校验过的 IP 的请求（Host 头和 TLS SNI 仍使用原主机名）
+
+    地址不允许时抛出 BlockedAddressError；URL 无效抛出 httpx.UnsupportedProtocol，解析失败抛出 httpx.ConnectError
+    """
+    try:
+        parsed = httpx.URL(url)
+    except httpx.InvalidURL as exc:
+        raise httpx.UnsupportedProtocol(str(exc))
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise httpx.UnsupportedProtocol(f"不支持的地址: {url}")
+    host = parsed.host
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        if _is_local_name(host) and not allow_private:
+            raise BlockedAddressError(host)
+        try:
+            addresses = [ipaddress.ip_address(address) for address in
+                         await resolve(host, parsed.port or (443 if parsed.scheme == "https" else 80))]
+        except (OSError, ValueError) as exc:
+            raise httpx.ConnectError(f"无法解析 {host}: {exc}")
+    if not addresses:
+        raise httpx.ConnectError(f"无法解析 {host}")
+    if not allow_private and not all(is_public_address(address) for address in addresses):
+        raise BlockedAddressError(host)
+    return client.build_request(
+        method, parsed.copy_with(host=str(addresses[0])),
+        headers={**(headers or {}), "Host": parsed.netloc.decode("ascii")},
+        extensions={"sni_hostname": host} if parsed.scheme == "https" else None,
+    )
+
+class FaviconStore:
+    """内容寻址的磁盘缓存"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # 缓存总大小（字节），首次写入时统计
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _domain_path(self, domain: str) -> str:
+        return os.path.join(self.root, "domains", hashlib.sha1(domain.lower().encode("utf-8")).hexdigest())
+
+    def lookup(self, domain: str):
+        """返回域名记录 {hash, type, fetched_at} 或 {missing: True, fetched_at}，没有记录时返回 None"""
+        try:
+            with open(self._domain_path(domain), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read(self, digest: str):
+        path = self._object_path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # 记录最近使用时间
+        except OSError:
+            pass
+        return data
+
+    def save(self, domain: str, data: bytes = None, content_type: str = None):
+        """保存抓取结果；data 为 None 表示该域名没有可用图标"""
+        record = {"fetched_at": time.time()}
+        if data is None:
+            record["missing"] = True
+        else:
+            digest = hashlib.sha256(data).hexdigest()
+            path = self._object_path(digest)
+            if not os.path.exists(path):
+                self._write_atomic(path, data)
+                self._grow(len(data))
+            record.update({"hash": digest, "type": content_type})
+        self._write_atomic(self._domain_path(domain), json.dumps(record).encode("utf-8"))
+        return record
+
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _objects(self):
+        objects_dir = os.path.join(self.root, "objects")
+        if not os.path.isdir(objects_dir):
+            return
+        for prefix in os.listdir(objects_dir):
+            prefix_dir = os.path.join(objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _grow(self, size: int):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(s for _, s, _ in self._objects())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """按最近使用时间淘汰，直到总大小降到上限的 90%"""
+        objects = sorted(self._objects(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in objects)
+        target = self.max_bytes * 0.9
+        for path, size, _ in objects:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+def _resize(data: bytes):
+    """缩放为 PNG；无法解析时返回 None"""
+    if Image is None:
+        return data, None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format == "ICO":
+                # ICO 文件包含多个尺寸，取最大的一个
+                image.size = max(image.ico.sizes())
+            image = image.convert("RGBA")
+            image.thumbnail((settings.FAVICON_SIZE, settings.FAVICON_SIZE))
+            output = io.BytesIO()
+            image.save(output, format="PNG", optimize=True)
+            return output.getvalue(), "image/png"
+    except Exception:
+        return None, None
+
+class FaviconService:
+    def __init__(self, store: FaviconStore, client: httpx.AsyncClient = None, resolve=resolve_host,
+                 allow_private: bool = None):
+        self.store = store
+        self.client = client
+        self.resolve = resolve
+        self.allow_private = settings.FAVICON_ALLOW_PRIVATE_HOSTS if allow_private is None else allow_private
+        self._inflight = {}
+
+    def _client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                follow_redirects=False,  # 重定向在 _download 中逐跳校验后跟随
+                timeout=settings.FAVICON_TIMEOUT,
+                headers={"User-Agent": USER_AGENT},
+            )
+        return self.client
+
+    def _fresh(self, record) -> bool:
+        if record is None:
+            return False
+        ttl = settings.FAVICON_MISSING_TTL_HOURS * 3600 if record.get("missing") else settings.FAVICON_TTL_DAYS * 86400
+        return time.time() - record.get("fetched_at", 0) < ttl
+
+    async def get(self, domain: str):
+        """返回 (图标内容, content_type, 内容哈希)，没有图标时返回 None"""
+        record = await run_in_threadpool(self.store.lookup, domain)
+        if not self._fresh(record):
+            record = await self._fetch_once(domain)
+        if record is None or record.get("missing"):
+            return None
+        data = await run_in_threadpool(self.store.read, record["hash"])
+        if data is None:
+            # 已被淘汰，重新抓取
+            record = await self._fetch_once(domain)
+            if record is None or record.get("missing"):
+                return None
+            data = await run_in_threadpool(self.store.read, record["hash"])
+            if data is None:
+                return None
+        return data, record.get("type") or "image/png", record["hash"]
+
+    async def _fetch_once(self, domain: str):
+        """同一域名的并发请求只抓取一次"""
+        task = self._inflight.get(domain)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(domain))
+            self._inflight[domain] = task
+            task.add_done_callback(lambda _: self._inflight.pop(domain, None))
+        return await task
+
+    async def _pinned_request(self, url: str):
+        """解析并校验地址，返回直接发往该 IP 的请求；地址不允许时返回 None"""
+        try:
+            return await pinned_request(self._client(), "GET", url, resolve=self.resolve,
+                                        allow_private=self.allow_private)
+        except (BlockedAddressError, httpx.HTTPError):
+            return None
+
+    async def _download(self, url: str):
+        """GET 并逐跳跟随重定向，每一跳连接前都校验地址"""
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                request = await self._pinned_request(url)
+                if request is None:
+                    return None, None
+                response = await self._client().send(request, stream=True)
+                try:
+                    if response.is_redirect:
+                        url = urljoin(url, response.headers["location"])
+                        continue
+                    if response.status_code != 200:
+                        return None, None
+                    chunks, size = [], 0
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > MAX_ICON_BYTES:
+                            return None, None
+                        chunks.append(chunk)
+                    return b"".join(chunks), response.headers.get("content-type", "")
+                finally:
+                    await response.aclose()
+        except httpx.HTTPError:
+            pass
+        return None, None
+
+    async def _candidates(self, base: str):
+        yield urljoin(base, "/favicon.ico")
+        html, content_type = await self._download(base)
+        if html and "html" in content_type:
+            text = html[:65536].decode("utf-8", errors="ignore")
+            for tag in ICON_LINK_RE.findall(text):
+                href = HREF_RE.search(tag)
+                if href:
+                    yield urljoin(base, href.group(1))
+
+    async def _fetch(self, domain: str):
+        for scheme in ("https", "http"):
+            async for url in self._candidates(f"{scheme}://{domain}/"):
+                data, content_type = await self._download(url)
+                if not data:
+                    continue
+                resized, resized_type = await run_in_threadpool(_resize, data)
+                if resized is None:
+                    continue
+                content_type = resized_type or content_type.split(";")[0].strip()
+                if not content_type.startswith("image/"):
+                    continue  # 未安装 Pillow 时只能依据响应类型判断是否为图片
+                return await run_in_threadpool(self.store.save, domain, resized, content_type)
+        return await run_in_threadpool(self.store.save, domain, None)
+
+    async def bundle(self, domains, concurrency: int = 8):
+        """返回 {域名: data URI}，用于一次请求获取整页图标"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(domain):
+            async with semaphore:
+                icon = await self.get(domain)
+            if icon is None:
+                return domain, None
+            data, content_type, _ = icon
+            return domain, f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+        results = await asyncio.gather(*(one(domain) for domain in domains))
+        return {domain: uri for domain, uri in results if uri}
+
+service = FaviconService(FaviconStore(settings.FAVICON_CACHE_DIR, settings.FAVICON_CACHE_MAX_BYTES))
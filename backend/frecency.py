@@ -0,0 +1,140 @@
+"""
+按时间衰减的使用频率（frecency）
+
+每次点击给链接加上权重 exp(λ·(t − ref))，λ = ln2 / FRECENCY_HALF_LIFE_DAYS，
+ref 是用户的参考时间 users.frecency_ref。任意时刻 now 的实际分数为
+
+    links.frecency · exp(−λ·(now − ref))
+
+同一用户的所有链接共用一个 ref，衰减只是整体乘以同一系数，不改变排序，
+因此点击只需一次 UPDATE，按 (user_id, frecency) 索引即可取出前 K 个链接。
+
+参考时间越旧，新点击的权重越大（每个半衰期翻倍）。重归一化把 ref 移到当前时间、
+所有分数乘以 exp(−λ·(now − ref))，避免数值溢出并保持精度：
+
+    python frecency.py               # 持续运行，每 FRECENCY_RENORMALIZE_INTERVAL_HOURS 检查一次
+    python frecency.py --once        # 只执行一轮
+    python frecency.py --replay      # 根据 access_history 重新计算所有链接的分数
+默认也会在应用进程内定期执行（FRECENCY_RENORMALIZE_ENABLED）。
+"""
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, and_, bindparam, text
+from starlette.concurrency import run_in_threadpool
+import crud
+from database import SessionLocal, engine, settings
+from models import User, Link, AccessHistory
+
+# ========== 重归一化 ==========
+def renormalize_due(batch: int = 100) -> int:
+    """重归一化参考时间早于 FRECENCY_RENORMALIZE_DAYS 的用户，返回处理的用户数"""
+    now = datetime.now()
+    before = now - timedelta(days=settings.FRECENCY_RENORMALIZE_DAYS)
+    done = 0
+    db = SessionLocal()
+    try:
+        while True:
+            user_ids = crud.get_frecency_due_users(db, before=before, limit=batch)
+            if not user_ids:
+                return done
+            for user_id in user_ids:
+                # 每个用户一个事务；并发执行时另一个进程会在锁释放后发现参考时间已更新
+                if crud.renormalize_frecency(db, user_id, now) is not None:
+                    done += 1
+            if len(user_ids) < batch:
+                return done
+    finally:
+        db.close()
+
+async def run_forever():
+    while True:
+        try:
+            await run_in_threadpool(renormalize_due)
+        except Exception:
+            pass  # 数据库暂时不可用等情况，下一轮重试
+        await asyncio.sleep(settings.FRECENCY_RENORMALIZE_INTERVAL_HOURS * 3600)
+
+# ========== 回填（migrations.py 使用） ==========
+def backfill_user_refs(connection, lo: int, hi: int) -> int:
+    """为还没有参考时间的用户设置参考时间"""
+    return connection.execute(
+        update(User.__table__).where(and_(User.id > lo, User.id <= hi, User.frecency_ref.is_(None))),
+        {"frecency_ref": datetime.now().replace(microsecond=0)},
+    ).rowcount
+
+def replay_access_history(connection, lo: int, hi: int) -> int:
+    """按 access_history 重新计算 lo < id <= hi 的链接分数
+
+    没有访问历史但有点击次数的链接（历史已被清理），按 clicks 次点击都发生在 last_access 估算。
+    结果只取决于访问历史和参考时间，重复执行得到相同的值。
+    """
+    links = connection.execute(
+        select(Link.id, Link.user_id, Link.url, Link.clicks, Link.last_access, User.frecency_ref)
+        .join(User, User.id == Link.user_id)
+        .where(and_(Link.id > lo, Link.id <= hi))
+    ).all()
+    if not links:
+        return 0
+
+    # 同一用户可能重复添加同一 URL，这些链接共享访问历史
+    by_key = defaultdict(list)
+    for link in links:
+        by_key[(link.user_id, link.url)].append(link)
+    visits = defaultdict(list)
+    for user_id in {link.user_id for link in links}:
+        urls = [url for (uid, url) in by_key if uid == user_id]
+        history = connection.execute(
+            select(AccessHistory.link_url, AccessHistory.timestamp)
+            .where(and_(AccessHistory.user_id == user_id, AccessHistory.link_url.in_(urls)))
+        )
+        for url, timestamp in history:
+            if timestamp is not None:
+                visits[(user_id, url)].append(timestamp)
+
+    rows = []
+    for key, group in by_key.items():
+        for link in group:
+            if link.frecency_ref is None:
+                continue
+            times = visits.get(key)
+            if times:
+                score = sum(crud.frecency_weight(t, link.frecency_ref) for t in times)
+            elif link.clicks and link.last_access:
+                score = link.clicks * crud.frecency_weight(link.last_access, link.frecency_ref)
+            else:
+                score = 0.0
+            rows.append({"link_id": link.id, "score": score})
+    if rows:
+        connection.execute(
+            update(Link.__table__).where(Link.id == bindparam("link_id")).values(frecency=bindparam("score")),
+            rows,
+        )
+    return len(rows)
+
+def replay_all(chunk: int = None) -> int:
+    """对全部链接执行 replay_access_history"""
+    chunk = chunk or settings.MIGRATION_BACKFILL_CHUNK
+    with engine.connect() as connection:
+        high = connection.execute(text("SELECT MAX(id) FROM links")).scalar() or 0
+    updated, last = 0, 0
+    while last < high:
+        with engine.begin() as connection:
+            updated += replay_access_history(connection, last, last + chunk)
+        last += chunk
+    return updated
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="frecency 重归一化")
+    parser.add_argument("--once", action="store_true", help="只执行一轮")
+    parser.add_argument("--replay", action="store_true", help="根据访问历史重新计算所有链接的分数")
+    args = parser.parse_args()
+    if args.replay:
+        start = time.perf_counter()
+        print(f"已重新计算 {replay_all()} 个链接，用时 {time.perf_counter() - start:.2f}s")
+    elif args.once:
+        print(f"已重归一化 {renormalize_due()} 个用户")
+    else:
+        asyncio.run(run_forever())
@@ -1,11 +1,10 @@
 """
 数据库初始化脚本
-用于创建数据库和表结构
+用于创建数据库，并通过迁移创建表结构
 """
 import pymysql
-from sqlalchemy import create_engine, text
-from database import settings, Base
-from models import User, Link, Category, UserSettings, AccessHistory
+from database import settings, engine
+from migrations import MigrationRunner
 
 def create_database_if_not_exists():
     """如果数据库不存在，则创建它"""
@@ -40,23 +39,13 @@ def create_database_if_not_exists():
 
 def init_db():
     """初始化数据库，创建所有表"""
-    # 先创建数据库（如果不存在）
-    create_database_if_not_exists()
+    # 先创建数据库（如果不存在）；SQLite 首次连接时自动创建文件
+    if settings.DB_ENGINE != "sqlite":
+        create_database_if_not_exists()
     
-    # 创建数据库连接URL
-    DATABASE_URL = f"mysql+pymysql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}?charset=utf8mb4"
-    
-    # 创建数据库引擎
-    engine = create_engine(
-        DATABASE_URL,
-        pool_pre_ping=True,
-        pool_recycle=3600,
-        echo=False
-    )
-    
-    # 创建所有表
+    # 执行全部迁移（包含建表）
     print("正在创建数据库表...")
-    Base.metadata.create_all(bind=engine)
+    MigrationRunner(engine).upgrade()
     print("数据库表创建完成！")
 
 if __name__ == "__main__":
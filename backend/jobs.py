@@ -0,0 +1,312 @@
+"""
+后台任务
+
+耗时的操作（大批量链接操作、删除用户、清空访问历史）不在请求内执行：接口写入一条任务记录后
+立即返回 202 和任务ID，客户端轮询 GET /api/v1/jobs/{id} 查看进度。
+
+- 任务记录在 jobs 表中，worker 按 priority（越大越先）和提交顺序领取，
+  领取用条件 UPDATE 完成，多个进程同时运行也不会重复领取
+- 任务处理函数是生成器，每处理完一批（不提交）yield (checkpoint, done)，worker 把本批修改和进度
+  在同一事务中提交，进程崩溃时两者要么都已保存、要么都没有；进程重启后任务从最后保存的
+  checkpoint 继续。任务被取消或被其他 worker 接手时本批修改随之回滚
+- 正常停止时正在执行的任务放回队列；进程崩溃留下的任务在 JOB_STALE_SECONDS 内
+  没有保存进度时会被其他 worker 接手
+- 处理函数抛出异常时按 JOB_RETRY_SECONDS 指数退避重试，超过 JOB_MAX_ATTEMPTS 次后标记失败
+
+运行方式：
+    python jobs.py               # 独立运行 worker
+默认也会在应用进程内运行（JOB_ENABLED，并发数 JOB_WORKERS）。
+"""
+import asyncio
+import itertools
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import crud
+from cache import invalidate_user
+from database import SessionLocal, settings
+from models import Job, Link, Category, UserSettings, AccessHistory, ChangeEvent
+
+PRIORITY_INTERACTIVE = 10  # 用户在页面上等待结果的操作
+PRIORITY_NORMAL = 0
+FINISHED = ("succeeded", "failed", "cancelled")
+
+HANDLERS = {}
+
+def handler(kind: str):
+    """注册任务处理函数：fn(db, job) 是生成器，每批写入后不提交，yield (checkpoint, done)，return 任务结果"""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+class JobContext:
+    """传给处理函数的任务信息；处理函数可以修改 total"""
+
+    def __init__(self, row: Job):
+        self.id = row.id
+        self.kind = row.kind
+        self.user_id = row.user_id
+        self.params = row.params or {}
+        self.checkpoint = row.checkpoint or {}
+        self.total = row.total
+        self.attempts = row.attempts
+
+# ========== 提交与查询 ==========
+def submit(db: Session, kind: str, user_id: int = None, params: dict = None, total: int = None,
+           priority: int = PRIORITY_NORMAL) -> Job:
+    if kind not in HANDLERS:
+        raise ValueError(f"未知的任务类型: {kind}")
+    job = Job(kind=kind, user_id=user_id, params=params or {}, total=total, priority=priority, status="queued")
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    runner.wake()
+    return job
+
+def cancel(db: Session, job_id: int):
+    """取消排队中或执行中的任务；执行中的任务在当前这一批完成后停止"""
+    db.query(Job).filter(and_(Job.id == job_id, Job.status.in_(("queued", "running")))).update(
+        {"status": "cancelled", "finished_at": datetime.now()}, synchronize_session=False
+    )
+    db.commit()
+    return db.query(Job).filter(Job.id == job_id).first()
+
+# ========== 领取与执行 ==========
+def claim_next(worker: str):
+    """领取一个任务并标记为执行中，没有可执行的任务时返回 None"""
+    now = datetime.now()
+    stale = now - timedelta(seconds=settings.JOB_STALE_SECONDS)
+    db = SessionLocal()
+    try:
+        candidates = db.query(Job.id, Job.status, Job.attempts).filter(or_(
+            and_(Job.status == "queued", or_(Job.run_after.is_(None), Job.run_after <= now)),
+            and_(Job.status == "running", Job.heartbeat_at < stale),
+        )).order_by(Job.priority.desc(), Job.id).limit(10).all()
+        for candidate in candidates:
+            # attempts 每次领取都会加一，作为乐观锁：另一个 worker 已经领取时更新不到任何行
+            claimed = db.query(Job).filter(and_(
+                Job.id == candidate.id, Job.status == candidate.status, Job.attempts == candidate.attempts
+            )).update({
+                "status": "running",
+                "worker": worker,
+                "attempts": Job.attempts + 1,
+                "heartbeat_at": now,
+                "started_at": func.coalesce(Job.started_at, now),
+            }, synchronize_session=False)
+            db.commit()
+            if claimed:
+                return JobContext(db.query(Job).filter(Job.id == candidate.id).one())
+        return None
+    finally:
+        db.close()
+
+def _update_owned(db: Session, job: JobContext, worker: str, values: dict) -> bool:
+    """只更新仍由该 worker 持有的任务并提交（连同会话中尚未提交的本批修改）
+
+    任务已被取消或被其他 worker 接手时回滚并返回 False
+    """
+    updated = db.query(Job).filter(and_(
+        Job.id == job.id, Job.status == "running", Job.worker == worker, Job.attempts == job.attempts
+    )).update(values, synchronize_session=False)
+    if updated != 1:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def execute(job: JobContext, worker: str, stopping: threading.Event = None) -> str:
+    """执行任务直到完成、失败或被要求停止，返回任务的最终状态"""
+    fn = HANDLERS.get(job.kind)
+    db = SessionLocal()
+    try:
+        if fn is None:
+            _update_owned(db, job, worker, {"status": "failed", "error": f"未知的任务类型: {job.kind}",
+                                            "finished_at": datetime.now()})
+            return "failed"
+        steps = fn(db, job)
+        try:
+            while True:
+                try:
+                    checkpoint, done = next(steps)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+                job.checkpoint = checkpoint
+                if not _update_owned(db, job, worker, {
+                    "checkpoint": checkpoint, "done": done, "total": job.total, "heartbeat_at": datetime.now(),
+                }):
+                    return "lost"
+                if job.user_id is not None:
+                    invalidate_user(job.user_id)
+                if stopping is not None and stopping.is_set():
+                    _update_owned(db, job, worker, {"status": "queued", "worker": None})
+                    return "queued"
+        finally:
+            steps.close()
+    except Exception as exc:
+        db.rollback()
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            _update_owned(db, job, worker, {"status": "failed", "error": str(exc)[:2000],
+                                            "finished_at": datetime.now()})
+            return "failed"
+        delay = settings.JOB_RETRY_SECONDS * (2 ** (job.attempts - 1))
+        _update_owned(db, job, worker, {"status": "queued", "worker": None, "error": str(exc)[:2000],
+                                        "run_after": datetime.now() + timedelta(seconds=delay)})
+        return "queued"
+    else:
+        finished = {"status": "succeeded", "result": result, "finished_at": datetime.now(), "error": None}
+        if job.total is not None:
+            finished["done"] = job.total
+        return "succeeded" if _update_owned(db, job, worker, finished) else "lost"
+    finally:
+        db.close()
+
+def prune_finished(before: datetime) -> int:
+    db = SessionLocal()
+    try:
+        deleted = db.query(Job).filter(and_(Job.status.in_(FINISHED), Job.finished_at < before)).delete(
+            synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+class JobRunner:
+    """进程内的 worker 池"""
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or settings.JOB_WORKERS
+        self.stopping = threading.Event()
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._wakeup = None
+
+    def wake(self):
+        """有新任务时唤醒空闲的 worker（可在任意线程调用）"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self):
+        """执行中的任务在当前这一批完成后放回队列"""
+        self.stopping.set()
+        self.wake()
+
+    async def _worker(self, name: str):
+        while not self.stopping.is_set():
+            try:
+                job = await run_in_threadpool(claim_next, name)
+                if job is not None:
+                    await run_in_threadpool(execute, job, name, self.stopping)
+                    continue
+            except Exception:
+                pass  # 数据库暂时不可用等情况，稍后重试
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _prune(self):
+        while True:
+            try:
+                await run_in_threadpool(prune_finished,
+                                        datetime.now() - timedelta(days=settings.JOB_RETENTION_DAYS))
+            except Exception:
+                pass
+            await asyncio.sleep(3600)
+
+    async def run_forever(self):
+        self.stopping.clear()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        tasks = [asyncio.create_task(self._worker(f"{prefix}:{next(self._ids)}")) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self._prune()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._loop = None
+
+runner = JobRunner()
+
+# ========== 任务类型 ==========
+BATCH_ACTIONS = {
+    "category": (lambda db, user_id, urls, params: crud.batch_update_category(
+        db, user_id, urls, params["category"], commit=False), "已更新 {} 个链接的分类"),
+    "tags": (lambda db, user_id, urls, params: crud.batch_update_tags(
+        db, user_id, urls, params["tags"], commit=False), "已更新 {} 个链接的标签"),
+    "share": (lambda db, user_id, urls, params: crud.batch_update_share(
+        db, user_id, urls, params["is_private"], commit=False), "已更新 {} 个链接的分享设置"),
+    "delete": (lambda db, user_id, urls, params: crud.batch_delete_links(db, user_id, urls, commit=False),
+               "已删除 {} 个链接"),
+}
+
+@handler("links.batch")
+def run_link_batch(db: Session, job: JobContext):
+    """params: action（BATCH_ACTIONS 的键）、link_urls 及该操作的参数"""
+    apply, message = BATCH_ACTIONS[job.params["action"]]
+    urls = job.params["link_urls"]
+    offset = job.checkpoint.get("offset", 0)
+    affected = job.checkpoint.get("affected", 0)
+    job.total = len(urls)
+    while offset < len(urls):
+        chunk = urls[offset:offset + settings.JOB_CHUNK]
+        affected += apply(db, job.user_id, chunk, job.params)
+        offset += len(chunk)
+        yield {"offset": offset, "affected": affected}, offset
+    return {"affected": affected, "message": message.format(affected)}
+
+def _delete_chunk(db: Session, model, *conditions) -> int:
+    ids = [row[0] for row in db.query(model.id).filter(*conditions).order_by(model.id).limit(settings.JOB_CHUNK)]
+    if not ids:
+        return 0
+    return db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+
+# 删除用户时逐表分批删除，最后删除用户本身
+USER_TABLES = [AccessHistory, ChangeEvent, Link, Category, UserSettings]
+
+@handler("users.delete")
+def run_user_delete(db: Session, job: JobContext):
+    phase = job.checkpoint.get("phase", 0)
+    deleted = job.checkpoint.get("deleted", 0)
+    if job.total is None:
+        job.total = sum(db.query(model).filter(model.user_id == job.user_id).count() for model in USER_TABLES)
+    while phase < len(USER_TABLES):
+        model = USER_TABLES[phase]
+        count = _delete_chunk(db, model, model.user_id == job.user_id)
+        if count:
+            deleted += count
+        else:
+            phase += 1
+        yield {"phase": phase, "deleted": deleted}, deleted
+    crud.delete_user(db, job.user_id)
+    return {"deleted": deleted, "message": "用户已删除"}
+
+@handler("access_history.purge")
+def run_history_purge(db: Session, job: JobContext):
+    """params: before（ISO 时间，只删除此前的记录；为空时全部删除）"""
+    before = job.params.get("before")
+    before = datetime.fromisoformat(before) if before else None
+    deleted = job.checkpoint.get("deleted", 0)
+    if job.total is None:
+        job.total = deleted + crud.count_access_history(db, job.user_id, before)
+    while True:
+        count = crud.purge_access_history(db, job.user_id, before, limit=settings.JOB_CHUNK, commit=False)
+        if not count:
+            break
+        deleted += count
+        yield {"deleted": deleted}, deleted
+    return {"deleted": deleted, "message": f"已删除 {deleted} 条访问历史"}
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(runner.run_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,199 @@
+"""
+启动流程与健康检查
+
+startup 事件不等待数据库，只创建一个后台任务后立即返回，worker 马上可以接受请求。后台任务依次：
+
+1. 检查数据库结构版本（migrations.ensure_schema）；数据库不可用时按 STARTUP_RETRY_SECONDS 指数退避重试
+2. 连接池预热：同时建立 STARTUP_POOL_WARMUP 个连接（不超过连接池大小）并放回连接池，
+   第一批请求不需要再等待建立连接；配置了只读副本时同样预热副本
+3. 标记为就绪，启动 on_ready 中的后台任务（链接检查、frecency、任务 worker）
+
+结构版本落后（且未开启 SCHEMA_AUTO_MIGRATE）或自动迁移出错时进入 failed 状态，就绪检查返回 503，
+滚动发布会停在这个实例上，而不会把流量切到结构不匹配的进程。之后按同样的退避间隔（最长 30 秒）
+重新检查，迁移执行完成（或问题排除）后继续预热并就绪，不需要重启进程。
+
+探针：
+    GET /health/live    存活检查，不访问数据库
+    GET /health/ready   就绪检查：启动完成且数据库可用时返回 200，否则 503。
+                        数据库检查结果缓存 HEALTH_CACHE_SECONDS 秒，同一时间只有一个检查在执行，
+                        超过 HEALTH_CHECK_TIMEOUT 秒未完成视为不可用
+    GET /health         同 /health/ready
+
+两个探针都返回各启动阶段的耗时和最近一次数据库检查的耗时。
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+import migrations
+from database import engine, settings, replica_router
+
+logger = logging.getLogger("uvicorn.error")
+
+class Lifecycle:
+    def __init__(self, engine=engine):
+        self.engine = engine
+        self.phase = "created"  # created / starting / warming / ready / failed
+        self.error = None
+        self.timings = {}
+        self.attempts = 0
+        self._created = time.monotonic()
+        self._started = None
+        self._task = None
+
+    # ========== 启动 ==========
+    def start(self, on_ready=None):
+        """在 startup 事件中调用，立即返回"""
+        self._started = time.monotonic()
+        self.phase = "starting"
+        self._task = asyncio.create_task(self._run(on_ready))
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, on_ready):
+        delay = settings.STARTUP_RETRY_SECONDS
+        while True:
+            self.attempts += 1
+            start = time.monotonic()
+            try:
+                await run_in_threadpool(migrations.ensure_schema, self.engine)
+                break
+            except migrations.SchemaOutdatedError as exc:
+                # 等待在其他地方执行迁移（python migrations.py），之后继续启动，不需要重启进程
+                self._fail(str(exc))
+            except SQLAlchemyError as exc:
+                self.error = f"数据库不可用: {exc.__class__.__name__}"
+            except Exception as exc:  # 自动迁移失败等：同样退避重试，failed 只用于就绪检查的报告
+                self._fail(f"{exc.__class__.__name__}: {exc}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+        self.timings["schema_ms"] = self._ms(start)
+
+        self.phase = "warming"
+        start = time.monotonic()
+        warmed = 0
+        for bind in [self.engine] + (replica_router.replicas if replica_router is not None else []):
+            try:
+                warmed += await run_in_threadpool(warm_pool, bind, settings.STARTUP_POOL_WARMUP)
+            except SQLAlchemyError:
+                pass  # 预热失败不影响就绪，请求会按需建立连接
+        self.timings["warmup_ms"] = self._ms(start)
+        self.timings["warmed_connections"] = warmed
+
+        self.phase = "ready"
+        self.error = None
+        self.timings["ready_ms"] = self._ms(self._started)
+        logger.info("启动完成：结构检查 %sms，连接池预热 %sms（%s 个连接），共 %sms",
+                    self.timings["schema_ms"], self.timings["warmup_ms"], warmed, self.timings["ready_ms"])
+        if on_ready is not None:
+            on_ready()
+
+    def _fail(self, error: str):
+        # 重试期间同一个错误只记录一次
+        if self.phase != "failed" or self.error != error:
+            logger.error("启动失败：%s", error)
+        self.phase = "failed"
+        self.error = error
+
+    @staticmethod
+    def _ms(since: float) -> float:
+        return round((time.monotonic() - since) * 1000, 2)
+
+    @property
+    def ready(self) -> bool:
+        return self.phase == "ready"
+
+    def describe(self) -> dict:
+        return {
+            "phase": self.phase,
+            "uptime_s": round(time.monotonic() - self._created, 3),
+            "startup": dict(self.timings, attempts=self.attempts),
+            **({"error": self.error} if self.error else {}),
+        }
+
+def warm_pool(bind, count: int) -> int:
+    """同时建立 count 个连接（不超过连接池大小）并执行一次查询，返回建立的连接数"""
+    size = bind.pool.size() if hasattr(bind.pool, "size") else 1
+    count = min(count, size)
+    if count <= 0:
+        return 0
+
+    def open_one(_):
+        connection = bind.connect()
+        connection.execute(text("SELECT 1"))
+        return connection
+
+    # 先全部打开再一起放回，否则连接池会重复使用同一个连接
+    with ThreadPoolExecutor(count) as executor:
+        connections = list(executor.map(open_one, range(count)))
+    for connection in connections:
+        connection.close()
+    return len(connections)
+
+# ========== 就绪检查 ==========
+def ping(bind=engine) -> float:
+    """执行 SELECT 1，返回耗时（毫秒）"""
+    start = time.monotonic()
+    with bind.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    return round((time.monotonic() - start) * 1000, 2)
+
+class ReadinessCheck:
+    """缓存数据库检查结果；缓存过期后只有一个检查在执行，其余探针等待同一个结果"""
+
+    def __init__(self, ttl: float, timeout: float, check=ping):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.check = check
+        self.checks = 0
+        self._result = None  # (ok, 耗时或错误, 检查完成时间)
+        self._pending = None
+
+    async def _run(self):
+        self.checks += 1
+        try:
+            result = (True, await run_in_threadpool(self.check))
+        except Exception as exc:
+            result = (False, f"{exc.__class__.__name__}: {exc}"[:200])
+        self._result = (*result, time.monotonic())
+        return self._result
+
+    async def get(self) -> dict:
+        now = time.monotonic()
+        cached = self._result is not None and now - self._result[2] < self.ttl
+        if not cached:
+            if self._pending is None or self._pending.done():
+                self._pending = asyncio.ensure_future(self._run())
+            try:
+                await asyncio.wait_for(asyncio.shield(self._pending), self.timeout)
+            except asyncio.TimeoutError:
+                return {"database": "timeout", "cached": False}
+        ok, detail, checked_at = self._result
+        report = {"database": "ok" if ok else "error", "cached": cached,
+                  "age_ms": round((time.monotonic() - checked_at) * 1000, 2)}
+        report["check_ms" if ok else "error"] = detail
+        return report
+
+startup = Lifecycle()
+readiness = ReadinessCheck(settings.HEALTH_CACHE_SECONDS, settings.HEALTH_CHECK_TIMEOUT)
+
+async def live() -> dict:
+    return {"status": "ok", **startup.describe()}
+
+async def ready():
+    """返回 (是否就绪, 响应内容)"""
+    report = startup.describe()
+    if not startup.ready:
+        return False, {"status": "starting" if startup.phase != "failed" else "error", **report}
+    database_report = await readiness.get()
+    ok = database_report["database"] == "ok"
+    return ok, {"status": "ok" if ok else "error", **report, **database_report}
@@ -0,0 +1,297 @@
+"""
+失效链接检查
+
+后台按 next_check_at 选出到期的链接，同一 URL 只请求一次：
+- 先发 HEAD，服务器不支持（405/501 等）或出错时改用 GET（只读响应头）
+- 带上次的 ETag / Last-Modified 做条件请求，304 视为链接仍然有效
+- 全局并发 + 单主机并发上限，同一主机两次请求之间至少间隔 LINK_CHECK_HOST_DELAY 秒；
+  先排到主机的名额和间隔再占用全局名额，链接很多的主机不会占满全局并发让其他主机的检查干等。
+  重定向逐跳手动跟随，每一跳同样经过目标主机的限制
+- 每一跳连接前都解析并校验地址（与 favicon.py 相同）：目标或重定向目标为回环、内网等地址时
+  不发出请求，状态记为 SKIPPED_STATUS，按正常间隔复查，不计入失效链接
+- 结果按批量 UPDATE 写回（只写回 URL 仍未修改的链接）；正常链接 LINK_CHECK_INTERVAL_HOURS 后复查，
+  失败链接从 LINK_CHECK_RETRY_HOURS 开始指数退避
+
+运行方式：
+    python linkcheck.py          # 持续运行
+    python linkcheck.py --once   # 只检查一轮
+也可设置 LINK_CHECK_ENABLED=true 在应用进程内后台运行。
+"""
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urljoin, urlsplit
+import httpx
+from sqlalchemy import and_, bindparam, update
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal, settings
+from models import Link
+from cache import invalidate_user
+from favicon import BlockedAddressError, pinned_request, resolve_host
+
+USER_AGENT = "LinkPortal-LinkChecker/1.0"
+# HEAD 返回这些状态码时改用 GET 重试
+HEAD_FALLBACK_STATUSES = {400, 403, 405, 406, 429, 500, 501, 502, 503}
+MAX_REDIRECTS = 10
+SKIPPED_STATUS = -1  # 目标为内网等不允许访问的地址，未检查
+
+class _HostState:
+    __slots__ = ("semaphore", "lock", "last_request", "users")
+
+    def __init__(self, per_host: int):
+        self.semaphore = asyncio.Semaphore(per_host)
+        self.lock = asyncio.Lock()
+        self.last_request = 0.0
+        self.users = 0  # 持有或正在等待名额的请求数
+
+class HostLimiter:
+    """单主机并发上限与请求间隔
+
+    没有请求使用、且距上次请求已超过间隔的主机状态会被删除，长时间运行时内存不随检查过的主机数增长
+    """
+
+    def __init__(self, per_host: int, delay: float):
+        self.per_host = per_host
+        self.delay = delay
+        self._hosts = {}
+        self._next_sweep = 0.0
+
+    def __len__(self):
+        """当前保留状态的主机数"""
+        return len(self._hosts)
+
+    async def acquire(self, host: str):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.per_host)
+        state.users += 1
+        try:
+            await state.semaphore.acquire()
+        except BaseException:
+            state.users -= 1
+            raise
+        try:
+            async with state.lock:
+                wait = state.last_request + self.delay - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                state.last_request = time.monotonic()
+        except BaseException:
+            self.release(host)
+            raise
+
+    def release(self, host: str):
+        state = self._hosts[host]
+        state.semaphore.release()
+        state.users -= 1
+        self._sweep()
+
+    def _sweep(self):
+        # 最多每个间隔（至少 1 秒）扫描一次
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + max(self.delay, 1.0)
+        idle = [host for host, state in self._hosts.items()
+                if state.users == 0 and state.last_request + self.delay <= now]
+        for host in idle:
+            del self._hosts[host]
+
+class LinkChecker:
+    def __init__(self, client: httpx.AsyncClient = None, concurrency: int = None, per_host: int = None,
+                 host_delay: float = None, timeout: float = None, resolve=resolve_host, allow_private: bool = None):
+        self.timeout = timeout if timeout is not None else settings.LINK_CHECK_TIMEOUT
+        concurrency = concurrency or settings.LINK_CHECK_CONCURRENCY
+        self.client = client or httpx.AsyncClient(
+            follow_redirects=False,  # 重定向在 _request 中逐跳校验后跟随，每一跳都经过主机限制
+            timeout=self.timeout,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self.resolve = resolve
+        self.allow_private = settings.LINK_CHECK_ALLOW_PRIVATE_HOSTS if allow_private is None else allow_private
+        self._global = asyncio.Semaphore(concurrency)
+        self.hosts = HostLimiter(
+            per_host or settings.LINK_CHECK_PER_HOST,
+            host_delay if host_delay is not None else settings.LINK_CHECK_HOST_DELAY,
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _send(self, method: str, url: str, headers: dict):
+        """发出一个请求：先校验地址，再排到主机的名额和间隔，最后占用全局名额"""
+        request = await pinned_request(self.client, method, url, headers, resolve=self.resolve,
+                                       allow_private=self.allow_private)
+        host = urlsplit(url).hostname or ""
+        await self.hosts.acquire(host)
+        try:
+            async with self._global:
+                response = await self.client.send(request, stream=True)
+                await response.aclose()
+                return response
+        finally:
+            self.hosts.release(host)
+
+    async def _request(self, method: str, url: str, headers: dict):
+        for _ in range(MAX_REDIRECTS + 1):
+            try:
+                response = await self._send(method, url, headers)
+            except BlockedAddressError:
+                return SKIPPED_STATUS, None, {}
+            if not response.is_redirect:
+                return response.status_code, url, response.headers
+            url = urljoin(url, response.headers["location"])
+        raise httpx.TooManyRedirects("重定向次数过多", request=response.request)
+
+    async def check(self, url: str, etag: str = None, last_modified: str = None):
+        """检查一个 URL，返回 {status, final_url, etag, last_modified}
+
+        status 为 0 表示网络错误，为 SKIPPED_STATUS 表示目标或重定向目标是不允许访问的地址
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        try:
+            status, final_url, response_headers = await self._request("HEAD", url, headers)
+            if status in HEAD_FALLBACK_STATUSES:
+                status, final_url, response_headers = await self._request("GET", url, headers)
+        except httpx.HTTPError:
+            try:
+                status, final_url, response_headers = await self._request("GET", url, headers)
+            except httpx.HTTPError:
+                return {"status": 0, "final_url": None, "etag": etag, "last_modified": last_modified}
+
+        return {
+            "status": status,
+            "final_url": final_url,
+            "etag": response_headers.get("etag", etag),
+            "last_modified": response_headers.get("last-modified", last_modified),
+        }
+
+def is_healthy(status: int) -> bool:
+    return status is not None and (200 <= status < 400)
+
+def next_check_time(now: datetime, healthy: bool, failures: int) -> datetime:
+    if healthy:
+        return now + timedelta(hours=settings.LINK_CHECK_INTERVAL_HOURS)
+    hours = settings.LINK_CHECK_RETRY_HOURS * (2 ** max(0, failures - 1))
+    return now + timedelta(hours=min(hours, settings.LINK_CHECK_MAX_BACKOFF_HOURS))
+
+def load_due_links(limit: int):
+    """选出到期的链接（从未检查过的优先）
+
+    两类分开查询，都能直接按 next_check_at 索引取出，不需要对整表排序
+    """
+    db = SessionLocal()
+    try:
+        columns = (Link.id, Link.user_id, Link.url, Link.http_status, Link.etag, Link.last_modified,
+                   Link.check_failures)
+        rows = db.query(*columns).filter(Link.next_check_at.is_(None)).limit(limit).all()
+        if len(rows) < limit:
+            rows += db.query(*columns).filter(
+                Link.next_check_at <= datetime.now()
+            ).order_by(Link.next_check_at).limit(limit - len(rows)).all()
+        return [row._asdict() for row in rows]
+    finally:
+        db.close()
+
+def save_results(rows, user_ids):
+    """按主键批量写回检查结果，并让相关用户的缓存失效
+
+    检查期间链接地址被修改的行不写回（WHERE url = 检查时的地址），新地址会在下一轮检查
+    """
+    if not rows:
+        return
+    table = Link.__table__
+    statement = update(table).where(and_(
+        table.c.id == bindparam("b_id"), table.c.url == bindparam("b_url"),
+    )).values({column: bindparam(column) for column in rows[0] if column not in ("b_id", "b_url")})
+    db = SessionLocal()
+    try:
+        db.execute(statement, rows)
+        db.commit()
+    finally:
+        db.close()
+    for user_id in user_ids:
+        invalidate_user(user_id)
+
+async def check_due_links(checker: LinkChecker, limit: int = None):
+    """检查一轮到期的链接，返回检查的链接数"""
+    links = await run_in_threadpool(load_due_links, limit or settings.LINK_CHECK_BATCH)
+    if not links:
+        return 0
+
+    # 同一 URL 只请求一次
+    by_url = defaultdict(list)
+    for link in links:
+        by_url[link["url"]].append(link)
+
+    async def check_url(url, group):
+        first = group[0]
+        return url, await checker.check(url, first["etag"], first["last_modified"])
+
+    results = await asyncio.gather(*(check_url(url, group) for url, group in by_url.items()))
+
+    now = datetime.now()
+    rows = []
+    for url, result in results:
+        for link in by_url[url]:
+            status = result["status"]
+            if status == 304:
+                # 未修改：保留上次的状态码
+                status = link["http_status"] if is_healthy(link["http_status"]) else 200
+            skipped = status == SKIPPED_STATUS
+            healthy = is_healthy(status)
+            failures = 0 if healthy or skipped else (link["check_failures"] or 0) + 1
+            final_url = result["final_url"] if result["final_url"] and result["final_url"] != url else None
+            rows.append({
+                "b_id": link["id"],
+                "b_url": url,
+                "http_status": status,
+                "final_url": final_url[:500] if final_url else None,
+                "checked_at": now,
+                "etag": result["etag"][:200] if result["etag"] else None,
+                "last_modified": result["last_modified"][:100] if result["last_modified"] else None,
+                "check_failures": failures,
+                "next_check_at": next_check_time(now, healthy or skipped, failures),
+            })
+    await run_in_threadpool(save_results, rows, {link["user_id"] for link in links})
+    return len(rows)
+
+async def run_forever(checker: LinkChecker = None):
+    """持续检查，没有到期链接时休眠"""
+    checker = checker or LinkChecker()
+    try:
+        while True:
+            try:
+                checked = await check_due_links(checker)
+            except Exception:
+                checked = 0  # 数据库暂时不可用等情况，稍后重试
+            if checked == 0:
+                await asyncio.sleep(settings.LINK_CHECK_IDLE_SECONDS)
+    finally:
+        await checker.close()
+
+async def _main(once: bool):
+    checker = LinkChecker()
+    if once:
+        try:
+            start = time.perf_counter()
+            checked = await check_due_links(checker)
+            print(f"已检查 {checked} 个链接，用时 {time.perf_counter() - start:.2f}s")
+        finally:
+            await checker.close()
+    else:
+        await run_forever(checker)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="检查失效链接")
+    parser.add_argument("--once", action="store_true", help="只检查一轮")
+    args = parser.parse_args()
+    asyncio.run(_main(args.once))
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from typing import List, Optional
+from datetime import datetime
 import schemas
 import crud
-from database import get_db, engine, Base
+from cache import cached
+import changefeed
+import linkcheck
+import frecency
+import favicon
+import share
+import jobs
+import ratelimit
+import lifecycle
+from database import get_db, get_read_db, engine, settings, SessionLocal, is_statement_timeout, replica_router, WriteMarkerMiddleware
 from pydantic_settings import BaseSettings
 import os
+import asyncio
 import traceback
 from dotenv import load_dotenv
 
@@ -20,6 +32,16 @@ app = FastAPI(
     version="1.0.0"
 )
 
+API_PREFIX = os.getenv("API_PREFIX", "/api/v1")
+
+# 限流与过载保护（见 ratelimit.py），在 CORS 之前添加，429 / 503 响应也会带上 CORS 头
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(ratelimit.RateLimitMiddleware, prefix=API_PREFIX)
+
+# 读写分离：写入后返回写入标记，前端带回后短时间内读主库（见 database.py）
+if replica_router is not None:
+    app.add_middleware(WriteMarkerMiddleware)
+
 # 配置 CORS - 必须在所有路由之前
 # 注意：如果使用 allow_credentials=True，不能使用 allow_origins=["*"]
 # 必须明确指定允许的来源
@@ -53,6 +75,17 @@ app.add_middleware(
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """全局异常处理，确保 CORS 头始终返回"""
+    cors_headers = {
+        "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
+        "Access-Control-Allow-Credentials": "true",
+    }
+    if is_statement_timeout(exc):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "查询超时，请稍后再试", "type": type(exc).__name__},
+            headers={**cors_headers, "Retry-After": str(int(settings.LOAD_SHED_RETRY_AFTER) or 1)},
+        )
+    
     error_detail = str(exc)
     if isinstance(exc, SQLAlchemyError):
         error_detail = "数据库错误: " + str(exc)
@@ -65,28 +98,41 @@ async def global_exception_handler(request, exc):
             "detail": error_detail,
             "type": type(exc).__name__
         },
-        headers={
-            "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
-            "Access-Control-Allow-Credentials": "true",
-        }
+        headers=cors_headers
     )
 
-# 初始化数据库（延迟初始化，避免启动时错误）
-try:
-    Base.metadata.create_all(bind=engine)
-    pass
-except Exception as e:
-    pass  # 将在首次请求时重试
-
-API_PREFIX = os.getenv("API_PREFIX", "/api/v1")
+# 后台任务
+background_tasks = []
+
+def start_background_tasks():
+    if settings.LINK_CHECK_ENABLED:
+        background_tasks.append(asyncio.create_task(linkcheck.run_forever()))
+    if settings.FRECENCY_RENORMALIZE_ENABLED:
+        background_tasks.append(asyncio.create_task(frecency.run_forever()))
+    if settings.JOB_ENABLED:
+        background_tasks.append(asyncio.create_task(jobs.runner.run_forever()))
+    if settings.CHANGE_FEED_PRUNE_INTERVAL_MINUTES > 0:
+        background_tasks.append(asyncio.create_task(changefeed.run_forever()))
+    if settings.SHARE_SWEEP_INTERVAL_HOURS > 0:
+        background_tasks.append(asyncio.create_task(share.run_forever()))
+
+@app.on_event("startup")
+async def start_lifecycle():
+    """不等待数据库：结构检查和连接池预热在后台进行，完成后启动后台任务（见 lifecycle.py）"""
+    lifecycle.startup.start(on_ready=start_background_tasks)
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await lifecycle.startup.stop()
+    jobs.runner.stop()  # 执行中的任务放回队列，下次启动后从 checkpoint 继续
+    for task in background_tasks:
+        task.cancel()
 
 # ========== 用户相关接口 ==========
 @app.get(API_PREFIX + "/users", response_model=List[schemas.UserResponse])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """获取所有用户列表"""
     try:
-        # 确保数据库表存在
-        Base.metadata.create_all(bind=engine)
         users = crud.get_users(db, skip=skip, limit=limit)
         return users
     except Exception as e:
@@ -94,7 +140,7 @@ def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"获取用户列表失败: {str(e)}")
 
 @app.get(API_PREFIX + "/users/{user_id}", response_model=schemas.UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
     """获取指定用户信息"""
     db_user = crud.get_user(db, user_id=user_id)
     if db_user is None:
@@ -132,9 +178,11 @@ def login(credentials: schemas.UserLogin, db: Session = Depends(get_db)):
 @app.delete(API_PREFIX + "/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_user(user_id: int, db: Session = Depends(get_db)):
     """删除用户"""
-    db_user = crud.delete_user(db, user_id=user_id)
-    if db_user is None:
+    if not crud.get_user(db, user_id):
         raise HTTPException(status_code=404, detail="用户不存在")
+    if crud.count_user_rows(db, user_id) > settings.JOB_INLINE_LIMIT:
+        return _accepted(jobs.submit(db, "users.delete", user_id=user_id))
+    crud.delete_user(db, user_id=user_id)
     return None
 
 # ========== 链接相关接口 ==========
@@ -145,18 +193,30 @@ def read_links(
     limit: int = 1000,
     category: Optional[str] = None,
     search: Optional[str] = None,
-    db: Session = Depends(get_db)
+    sort: Optional[str] = None,
+    domain: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
-    """获取用户的链接列表"""
-    # 验证用户存在
-    if not crud.get_user(db, user_id):
-        raise HTTPException(status_code=404, detail="用户不存在")
+    """获取用户的链接列表（sort=frecency 按使用频率倒序，配合 limit 取最常用的链接；
+    domain 为可注册域名时返回该网站的所有链接，为子域名时只返回该主机的链接）"""
+    if sort not in (None, "frecency"):
+        raise HTTPException(status_code=400, detail="不支持的排序方式")
     
-    links = crud.get_links(db, user_id=user_id, skip=skip, limit=limit, category=category, search=search)
+    def load():
+        # 验证用户存在
+        if not crud.get_user(db, user_id):
+            return None
+        links = crud.get_links(db, user_id=user_id, skip=skip, limit=limit, category=category, search=search, sort=sort,
+                               domain=domain)
+        return [schemas.LinkResponse.model_validate(link) for link in links]
+    
+    links = cached("links", user_id, (skip, limit, category, search, sort, domain), load, db)
+    if links is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
     return links
 
 @app.get(API_PREFIX + "/users/{user_id}/links/{link_id}", response_model=schemas.LinkResponse)
-def read_link(user_id: int, link_id: int, db: Session = Depends(get_db)):
+def read_link(user_id: int, link_id: int, db: Session = Depends(get_read_db)):
     """获取指定链接"""
     db_link = crud.get_link(db, link_id=link_id, user_id=user_id)
     if db_link is None:
@@ -193,22 +253,50 @@ def delete_link(user_id: int, link_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="链接不存在")
     return None
 
+@app.get(API_PREFIX + "/users/{user_id}/link-health", response_model=schemas.LinkHealthResponse)
+def read_link_health(user_id: int, limit: int = 100, db: Session = Depends(get_read_db)):
+    """获取链接健康状况（失效链接由后台检查任务发现，最多返回 limit 个）"""
+    if not crud.get_user(db, user_id):
+        raise HTTPException(status_code=404, detail="用户不存在")
+    
+    return crud.get_link_health(db, user_id=user_id, limit=limit)
+
+@app.get(API_PREFIX + "/users/{user_id}/domains", response_model=List[schemas.DomainStats])
+def read_domains(user_id: int, sort: str = "links", limit: int = 100, db: Session = Depends(get_read_db)):
+    """按网站（可注册域名）汇总链接数、点击数和失效链接数，sort 为 links / clicks / recent"""
+    if sort not in ("links", "clicks", "recent"):
+        raise HTTPException(status_code=400, detail="不支持的排序方式")
+    
+    def load():
+        if not crud.get_user(db, user_id):
+            return None
+        return crud.get_domain_stats(db, user_id=user_id, sort=sort, limit=limit)
+    
+    stats = cached("domains", user_id, (sort, limit), load, db)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return stats
+
 @app.post(API_PREFIX + "/users/{user_id}/links/{link_id}/click")
 def click_link(user_id: int, link_id: int, db: Session = Depends(get_db)):
     """记录链接点击"""
     db_link = crud.increment_link_clicks(db, link_id=link_id, user_id=user_id)
     if db_link is None:
         raise HTTPException(status_code=404, detail="链接不存在")
-    return {"message": "点击已记录", "clicks": db_link.clicks}
+    return {"message": "点击已记录", "clicks": db_link.clicks, "frecency": db_link.frecency}
 
 # ========== 分类相关接口 ==========
 @app.get(API_PREFIX + "/users/{user_id}/categories", response_model=List[schemas.CategoryResponse])
-def read_categories(user_id: int, db: Session = Depends(get_db)):
+def read_categories(user_id: int, db: Session = Depends(get_read_db)):
     """获取用户的分类列表"""
-    if not crud.get_user(db, user_id):
-        raise HTTPException(status_code=404, detail="用户不存在")
+    def load():
+        if not crud.get_user(db, user_id):
+            return None
+        return [schemas.CategoryResponse.model_validate(c) for c in crud.get_categories(db, user_id=user_id)]
     
-    categories = crud.get_categories(db, user_id=user_id)
+    categories = cached("categories", user_id, None, load, db)
+    if categories is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
     return categories
 
 @app.post(API_PREFIX + "/users/{user_id}/categories", response_model=schemas.CategoryResponse, status_code=status.HTTP_201_CREATED)
@@ -237,12 +325,17 @@ def delete_category(user_id: int, category_id: int, db: Session = Depends(get_db
 
 # ========== 用户设置相关接口 ==========
 @app.get(API_PREFIX + "/users/{user_id}/settings", response_model=schemas.UserSettingsResponse)
-def read_user_settings(user_id: int, db: Session = Depends(get_db)):
+def read_user_settings(user_id: int, db: Session = Depends(get_read_db)):
     """获取用户设置"""
-    if not crud.get_user(db, user_id):
-        raise HTTPException(status_code=404, detail="用户不存在")
+    def load():
+        if not crud.get_user(db, user_id):
+            return None
+        return schemas.UserSettingsResponse.model_validate(crud.get_user_settings(db, user_id=user_id))
     
-    return crud.get_user_settings(db, user_id=user_id)
+    user_settings = cached("settings", user_id, None, load, db)
+    if user_settings is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return user_settings
 
 @app.put(API_PREFIX + "/users/{user_id}/settings", response_model=schemas.UserSettingsResponse)
 def update_user_settings(user_id: int, settings: schemas.UserSettingsUpdate, db: Session = Depends(get_db)):
@@ -262,70 +355,239 @@ def create_access_history(user_id: int, history: schemas.AccessHistoryCreate, db
     return crud.create_access_history(db, user_id=user_id, history=history)
 
 @app.get(API_PREFIX + "/users/{user_id}/access-history", response_model=List[schemas.AccessHistoryResponse])
-def read_access_history(user_id: int, limit: int = 100, db: Session = Depends(get_db)):
+def read_access_history(user_id: int, limit: int = 100, db: Session = Depends(get_read_db)):
     """获取访问历史"""
     if not crud.get_user(db, user_id):
         raise HTTPException(status_code=404, detail="用户不存在")
     
     return crud.get_access_history(db, user_id=user_id, limit=limit)
 
+@app.delete(API_PREFIX + "/users/{user_id}/access-history")
+def purge_access_history(user_id: int, before: Optional[datetime] = None, db: Session = Depends(get_db)):
+    """清空访问历史（before 不为空时只删除此前的记录）"""
+    if not crud.get_user(db, user_id):
+        raise HTTPException(status_code=404, detail="用户不存在")
+    
+    if crud.count_access_history(db, user_id=user_id, before=before) > settings.JOB_INLINE_LIMIT:
+        params = {"before": before.isoformat() if before else None}
+        return _accepted(jobs.submit(db, "access_history.purge", user_id=user_id, params=params))
+    deleted = crud.purge_access_history(db, user_id=user_id, before=before, limit=settings.JOB_INLINE_LIMIT)
+    return {"message": f"已删除 {deleted} 条访问历史"}
+
 # ========== 批量操作接口 ==========
-@app.post(API_PREFIX + "/users/{user_id}/links/batch/category")
-def batch_update_category(user_id: int, batch: schemas.BatchUpdateCategory, db: Session = Depends(get_db)):
-    """批量更新分类"""
+def _run_batch(db: Session, user_id: int, action: str, link_urls: List[str], **params):
+    """链接数超过 JOB_INLINE_LIMIT 时转为后台任务并返回 202"""
     if not crud.get_user(db, user_id):
         raise HTTPException(status_code=404, detail="用户不存在")
     
-    updated = crud.batch_update_category(db, user_id=user_id, link_urls=batch.link_urls, category=batch.category)
-    return {"message": f"已更新 {updated} 个链接的分类"}
+    if len(link_urls) > settings.JOB_INLINE_LIMIT:
+        job = jobs.submit(db, "links.batch", user_id=user_id, params={"action": action, "link_urls": link_urls, **params},
+                          total=len(link_urls), priority=jobs.PRIORITY_INTERACTIVE)
+        return _accepted(job)
+    apply, message = jobs.BATCH_ACTIONS[action]
+    return {"message": message.format(apply(db, user_id, link_urls, params))}
+
+@app.post(API_PREFIX + "/users/{user_id}/links/batch/category")
+def batch_update_category(user_id: int, batch: schemas.BatchUpdateCategory, db: Session = Depends(get_db)):
+    """批量更新分类"""
+    return _run_batch(db, user_id, "category", batch.link_urls, category=batch.category)
 
 @app.post(API_PREFIX + "/users/{user_id}/links/batch/tags")
 def batch_update_tags(user_id: int, batch: schemas.BatchUpdateTags, db: Session = Depends(get_db)):
     """批量更新标签"""
-    if not crud.get_user(db, user_id):
-        raise HTTPException(status_code=404, detail="用户不存在")
-    
-    updated = crud.batch_update_tags(db, user_id=user_id, link_urls=batch.link_urls, tags=batch.tags)
-    return {"message": f"已更新 {updated} 个链接的标签"}
+    return _run_batch(db, user_id, "tags", batch.link_urls, tags=batch.tags)
 
 @app.post(API_PREFIX + "/users/{user_id}/links/batch/share")
 def batch_update_share(user_id: int, batch: schemas.BatchUpdateShare, db: Session = Depends(get_db)):
     """批量更新分享设置"""
-    if not crud.get_user(db, user_id):
-        raise HTTPException(status_code=404, detail="用户不存在")
-    
-    updated = crud.batch_update_share(db, user_id=user_id, link_urls=batch.link_urls, is_private=batch.is_private)
-    return {"message": f"已更新 {updated} 个链接的分享设置"}
+    return _run_batch(db, user_id, "share", batch.link_urls, is_private=batch.is_private)
 
 @app.post(API_PREFIX + "/users/{user_id}/links/batch/delete")
 def batch_delete_links(user_id: int, batch: schemas.BatchDelete, db: Session = Depends(get_db)):
     """批量删除链接"""
-    if not crud.get_user(db, user_id):
+    return _run_batch(db, user_id, "delete", batch.link_urls)
+
+# ========== 后台任务 ==========
+def _accepted(job) -> JSONResponse:
+    """202：任务已提交，客户端轮询 status_url 查看进度"""
+    status_url = f"{API_PREFIX}/jobs/{job.id}"
+    body = schemas.JobAccepted(job_id=job.id, status_url=status_url, message="任务已提交，正在后台处理")
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=body.model_dump(), headers={"Location": status_url})
+
+def _job_response(job) -> schemas.JobResponse:
+    response = schemas.JobResponse.model_validate(job)
+    if job.total:
+        response.progress = min(1.0, job.done / job.total)
+    elif job.status == "succeeded":
+        response.progress = 1.0
+    return response
+
+@app.get(API_PREFIX + "/jobs/{job_id}", response_model=schemas.JobResponse)
+def read_job(job_id: int, db: Session = Depends(get_db)):
+    """查询后台任务进度"""
+    job = crud.get_job(db, job_id=job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return _job_response(job)
+
+@app.delete(API_PREFIX + "/jobs/{job_id}", response_model=schemas.JobResponse)
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    """取消后台任务（已完成的批次不会回滚）"""
+    job = jobs.cancel(db, job_id=job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return _job_response(job)
+
+# ========== 变更推送 ==========
+@app.get(API_PREFIX + "/users/{user_id}/changes")
+async def stream_changes(user_id: int, request: Request, last_event_id: Optional[int] = None):
+    """订阅用户数据变更（SSE），支持 Last-Event-ID 续传"""
+    if not await run_in_threadpool(changefeed.user_exists, user_id):
         raise HTTPException(status_code=404, detail="用户不存在")
     
-    deleted = crud.batch_delete_links(db, user_id=user_id, link_urls=batch.link_urls)
-    return {"message": f"已删除 {deleted} 个链接"}
+    header = request.headers.get("last-event-id")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(
+        changefeed.sse_stream(user_id, last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket(API_PREFIX + "/users/{user_id}/changes/ws")
+async def websocket_changes(websocket: WebSocket, user_id: int, last_event_id: Optional[int] = None):
+    """订阅用户数据变更（WebSocket），消息内容与 SSE 相同"""
+    if not await run_in_threadpool(changefeed.user_exists, user_id):
+        await websocket.close(code=4404)
+        return
+    
+    await websocket.accept()
+    disconnected = asyncio.Event()
+    
+    async def watch_disconnect():
+        # 客户端不需要发送消息，这里只用来感知断开
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            disconnected.set()
+    
+    async def is_disconnected():
+        return disconnected.is_set()
+    
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        async for kind, payload in changefeed.iter_changes(user_id, last_event_id, is_disconnected):
+            await websocket.send_json({"event": kind, **(payload or {})})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        watcher.cancel()
+
+# ========== 网站图标 ==========
+@app.get(API_PREFIX + "/favicons/{domain}")
+async def read_favicon(domain: str, request: Request):
+    """获取网站图标（服务端按域名缓存）"""
+    if not favicon.is_allowed_domain(domain):
+        raise HTTPException(status_code=400, detail="域名无效")
+    
+    icon = await favicon.service.get(domain.lower())
+    if icon is None:
+        return Response(status_code=404, headers={"Cache-Control": "public, max-age=3600"})
+    
+    data, content_type, digest = icon
+    headers = {"Cache-Control": "public, max-age=604800", "ETag": f'"{digest[:32]}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=content_type, headers=headers)
+
+@app.get(API_PREFIX + "/users/{user_id}/favicons")
+async def read_favicon_bundle(user_id: int):
+    """一次获取用户所有链接的图标，返回 {域名: data URI}"""
+    def load_hosts():
+        db = SessionLocal()
+        try:
+            if not crud.get_user(db, user_id):
+                return None
+            return crud.get_link_hosts(db, user_id=user_id)
+        finally:
+            db.close()
+    
+    hosts = await run_in_threadpool(load_hosts)
+    if hosts is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return await favicon.service.bundle(sorted(host for host in hosts if favicon.is_allowed_domain(host)))
+
+# ========== 公开分享 ==========
+def _share_urls(token: str) -> schemas.ShareLinkResponse:
+    return schemas.ShareLinkResponse(
+        token=token,
+        html_url=f"{API_PREFIX}/share/{token}",
+        json_url=f"{API_PREFIX}/share/{token}.json",
+    )
+
+@app.get(API_PREFIX + "/users/{user_id}/share", response_model=schemas.ShareLinkResponse)
+def read_share_link(user_id: int, db: Session = Depends(get_db)):
+    """获取公开分享地址（首次调用时生成令牌）"""
+    token = crud.get_share_token(db, user_id=user_id)
+    if token is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return _share_urls(token)
+
+@app.post(API_PREFIX + "/users/{user_id}/share/reset", response_model=schemas.ShareLinkResponse)
+def reset_share_link(user_id: int, db: Session = Depends(get_db)):
+    """更换分享令牌，旧地址失效"""
+    token = crud.reset_share_token(db, user_id=user_id)
+    if token is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return _share_urls(token)
+
+def _share_response(request: Request, token: str, fmt: str, category: Optional[str]):
+    page = share.get_page(token, fmt, category, request.headers.get("accept-encoding", ""))
+    if page is None:
+        raise HTTPException(status_code=404, detail="分享不存在")
+    body, etag, encoding, content_type = page
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.SHARE_MAX_AGE}, "
+                         f"stale-while-revalidate={settings.SHARE_STALE_SECONDS}",
+        "Vary": "Accept-Encoding",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=content_type, headers=headers)
+
+# 先注册 .json，避免被 /share/{token} 匹配
+@app.get(API_PREFIX + "/share/{token}.json")
+def read_shared_json(token: str, request: Request, category: Optional[str] = None):
+    """公开分享（JSON），不需要登录"""
+    return _share_response(request, token, "json", category)
+
+@app.get(API_PREFIX + "/share/{token}")
+def read_shared_page(token: str, request: Request, category: Optional[str] = None):
+    """公开分享页（HTML），不需要登录"""
+    return _share_response(request, token, "html", category)
 
 # ========== 健康检查 ==========
+@app.get("/health/live")
+async def liveness_probe():
+    """存活检查（不访问数据库）"""
+    return await lifecycle.live()
+
+@app.get("/health/ready")
+async def readiness_probe():
+    """就绪检查：启动完成且数据库可用时返回 200，否则 503（数据库检查结果短时间缓存）"""
+    ok, report = await lifecycle.ready()
+    return JSONResponse(status_code=200 if ok else 503, content=report)
+
 @app.get("/health")
-def health_check():
-    """健康检查"""
-    try:
-        # 测试数据库连接
-        db = next(get_db())
-        db.execute("SELECT 1")
-        db.close()
-        return {
-            "status": "ok",
-            "message": "API is running",
-            "database": "connected"
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": "API is running but database connection failed",
-            "error": str(e)
-        }
+async def health_check():
+    """健康检查（同 /health/ready）"""
+    return await readiness_probe()
 
 @app.get("/")
 def root():
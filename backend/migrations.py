@@ -0,0 +1,475 @@
+"""
+数据库迁移
+
+每个迁移有一个递增的版本号和若干步骤，执行状态记录在 schema_migrations 表中：
+
+- 步骤都是幂等的（字段、索引、表已存在时跳过），旧库没有迁移记录时可以直接执行全部迁移
+- MySQL 上的 DDL 尽量在线执行：加字段依次尝试 ALGORITHM=INSTANT、ALGORITHM=INPLACE, LOCK=NONE，
+  建索引使用 ALGORITHM=INPLACE, LOCK=NONE；都不支持时拒绝执行，确认可以锁表后加 --allow-lock
+- DDL 等待元数据锁最多 MIGRATION_LOCK_WAIT_TIMEOUT 秒，超时后退避重试，不会让排在后面的读写长时间阻塞
+- 数据回填按主键范围分批提交，每批与进度（checkpoint）在同一事务中写入，中断后从上次位置继续；
+  批次之间休眠 MIGRATION_BACKFILL_SLEEP 秒
+- 应用启动时只读取一次 schema_migrations 检查版本，不再调用 create_all
+
+运行方式：
+    python migrations.py             # 执行全部待执行的迁移
+    python migrations.py --dry-run   # 只列出待执行的步骤和预计耗时
+    python migrations.py --status    # 查看各版本状态
+"""
+import math
+import time
+from datetime import datetime
+from sqlalchemy import (
+    Table, Column, Integer, BigInteger, String, DateTime, MetaData,
+    inspect, select, insert, update, text,
+)
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from database import engine, settings
+from models import User, Link, Category, UserSettings, AccessHistory, ChangeEvent, Job
+import frecency
+import domains
+import changefeed
+
+# 迁移状态表不属于 Base.metadata，create_all / drop_all 不会影响它
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(200), nullable=False),
+    Column("status", String(20), nullable=False),  # running / done
+    Column("step", Integer, nullable=False, default=0),  # 已完成的步骤数
+    Column("checkpoint", BigInteger),  # 当前回填步骤已处理到的主键
+    Column("started_at", DateTime),
+    Column("finished_at", DateTime),
+)
+
+# MySQL 错误码
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_NOT_SUPPORTED = {1064, 1235, 1845, 1846}  # 语法不支持 / 该操作不支持指定的 ALGORITHM、LOCK
+
+# 估算耗时用的经验速率（行/秒），只用于 --dry-run
+ONLINE_REBUILD_ROWS_PER_SECOND = 100000
+INDEX_BUILD_ROWS_PER_SECOND = 200000
+BACKFILL_ROWS_PER_SECOND = 20000
+
+class MigrationError(RuntimeError):
+    pass
+
+class SchemaOutdatedError(RuntimeError):
+    """数据库结构落后于代码"""
+
+def _mysql_error_code(error: DBAPIError):
+    args = getattr(error.orig, "args", ())
+    return args[0] if args and isinstance(args[0], int) else None
+
+def _table_rows(connection, table: str) -> int:
+    """表的大致行数（MySQL 读取统计信息，不扫描表）；表尚未创建时为 0"""
+    if not inspect(connection).has_table(table):
+        return 0
+    if connection.dialect.name == "mysql":
+        rows = connection.execute(text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+        ), {"table": table}).scalar()
+        return int(rows or 0)
+    return connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() or 0
+
+# ========== 迁移步骤 ==========
+class Step:
+    def describe(self) -> str:
+        raise NotImplementedError
+
+    def applied(self, connection) -> bool:
+        """已经生效时返回 True（用于跳过和 --dry-run）"""
+        return False
+
+    def apply(self, runner, context):
+        raise NotImplementedError
+
+    def estimate(self, connection) -> float:
+        """预计耗时（秒）"""
+        return 0.0
+
+class CreateTable(Step):
+    """按模型建表（连同模型上定义的索引）
+
+    新库直接按当前模型建表，后续步骤发现字段、索引已存在会跳过。
+    """
+
+    def __init__(self, model):
+        self.table = model.__table__
+
+    def describe(self):
+        return f"创建表 {self.table.name}"
+
+    def applied(self, connection):
+        return inspect(connection).has_table(self.table.name)
+
+    def apply(self, runner, context):
+        with runner.engine.begin() as connection:
+            self.table.create(connection, checkfirst=True)
+
+class AddColumn(Step):
+    def __init__(self, table: str, column: str, ddl: str, after: str = None):
+        self.table = table
+        self.column = column
+        self.ddl = ddl
+        self.after = after
+
+    def describe(self):
+        return f"添加字段 {self.table}.{self.column}"
+
+    def applied(self, connection):
+        inspector = inspect(connection)
+        return inspector.has_table(self.table) and self.column in {c["name"] for c in inspector.get_columns(self.table)}
+
+    def apply(self, runner, context):
+        sql = f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.ddl}"
+        if runner.dialect != "mysql":
+            runner.execute_ddl([sql])  # SQLite 不支持 AFTER，加字段只修改表定义
+            return
+        if self.after:
+            sql += f" AFTER {self.after}"
+        runner.execute_ddl([
+            f"{sql}, ALGORITHM=INSTANT",
+            f"{sql}, ALGORITHM=INPLACE, LOCK=NONE",
+        ], locking=sql)
+
+    def estimate(self, connection):
+        if connection.dialect.name != "mysql":
+            return 0.0
+        # 支持 INSTANT 时接近 0，这里按 INPLACE 重建表估算上限
+        return _table_rows(connection, self.table) / ONLINE_REBUILD_ROWS_PER_SECOND
+
+class CreateIndex(Step):
+    def __init__(self, table: str, name: str, columns, unique: bool = False):
+        self.table = table
+        self.name = name
+        self.columns = list(columns)
+        self.unique = unique
+
+    def describe(self):
+        return f"创建索引 {self.name} ON {self.table} ({', '.join(self.columns)})"
+
+    def applied(self, connection):
+        inspector = inspect(connection)
+        return inspector.has_table(self.table) and self.name in {i["name"] for i in inspector.get_indexes(self.table)}
+
+    def apply(self, runner, context):
+        sql = f"CREATE {'UNIQUE ' if self.unique else ''}INDEX {self.name} ON {self.table} ({', '.join(self.columns)})"
+        if runner.dialect != "mysql":
+            runner.execute_ddl([sql])
+            return
+        runner.execute_ddl([f"{sql} ALGORITHM=INPLACE LOCK=NONE"], locking=sql)
+
+    def estimate(self, connection):
+        return _table_rows(connection, self.table) / INDEX_BUILD_ROWS_PER_SECOND
+
+class Backfill(Step):
+    """按主键范围分批回填数据
+
+    fn(connection, lo, hi) 处理 lo < id <= hi 的行并返回更新的行数，必须是幂等的
+    （例如只更新目标字段仍为 NULL 的行）。回填开始之后新写入的行应由应用代码直接写好。
+    """
+
+    def __init__(self, name: str, table: str, fn, chunk: int = None):
+        self.name = name
+        self.table = table
+        self.fn = fn
+        self.chunk = chunk
+
+    def describe(self):
+        return f"回填 {self.table}：{self.name}"
+
+    def _bounds(self, connection):
+        row = connection.execute(text(f"SELECT MIN(id), MAX(id) FROM {self.table}")).first()
+        return row[0], row[1]
+
+    def apply(self, runner, context):
+        chunk = self.chunk or settings.MIGRATION_BACKFILL_CHUNK
+        with runner.engine.connect() as connection:
+            low, high = self._bounds(connection)
+        if high is None:
+            return
+        last = context.checkpoint if context.checkpoint is not None else low - 1
+        total = high - low + 1
+        updated = 0
+        while last < high:
+            upper = min(last + chunk, high)
+            with runner.engine.begin() as connection:
+                updated += self.fn(connection, last, upper) or 0
+                runner.save_progress(connection, context.version, context.step, upper)
+            last = upper
+            runner.log(f"    {self.name}: {min(100.0, (last - low + 1) * 100 / total):.1f}%（已更新 {updated} 行）")
+            if last < high and settings.MIGRATION_BACKFILL_SLEEP > 0:
+                time.sleep(settings.MIGRATION_BACKFILL_SLEEP)
+
+    def estimate(self, connection):
+        if not inspect(connection).has_table(self.table):
+            return 0.0
+        low, high = self._bounds(connection)
+        if high is None:
+            return 0.0
+        chunk = self.chunk or settings.MIGRATION_BACKFILL_CHUNK
+        chunks = math.ceil((high - low + 1) / chunk)
+        # 只读估算：不调用 fn，按行数和经验速率计算，dry-run 不会写入任何数据
+        rows = connection.execute(text(f"SELECT COUNT(*) FROM {self.table}")).scalar()
+        return rows / BACKFILL_ROWS_PER_SECOND + chunks * settings.MIGRATION_BACKFILL_SLEEP
+
+class Migration:
+    def __init__(self, version: int, name: str, steps):
+        self.version = version
+        self.name = name
+        self.steps = list(steps)
+
+class StepContext:
+    def __init__(self, version: int, step: int, checkpoint):
+        self.version = version
+        self.step = step
+        self.checkpoint = checkpoint
+
+# ========== 迁移列表（只追加，不修改已发布的版本） ==========
+MIGRATIONS = [
+    Migration(1, "initial_schema", [
+        CreateTable(User),
+        CreateTable(Link),
+        CreateTable(Category),
+        CreateTable(UserSettings),
+        CreateTable(AccessHistory),
+    ]),
+    Migration(2, "add_page_title", [
+        AddColumn("user_settings", "page_title", "VARCHAR(200) DEFAULT '我的链接门户'", after="current_view"),
+    ]),
+    Migration(3, "add_page_subtitle", [
+        AddColumn("user_settings", "page_subtitle", "VARCHAR(200) DEFAULT '快速访问常用网站'", after="page_title"),
+    ]),
+    Migration(4, "add_link_health", [
+        AddColumn("links", "http_status", "INTEGER"),
+        AddColumn("links", "final_url", "VARCHAR(500)"),
+        AddColumn("links", "checked_at", "DATETIME"),
+        AddColumn("links", "etag", "VARCHAR(200)"),
+        AddColumn("links", "last_modified", "VARCHAR(100)"),
+        AddColumn("links", "check_failures", "INTEGER DEFAULT 0"),
+        AddColumn("links", "next_check_at", "DATETIME"),
+        CreateIndex("links", "ix_links_next_check_at", ["next_check_at"]),
+    ]),
+    Migration(5, "add_change_events", [
+        CreateTable(ChangeEvent),
+    ]),
+    Migration(6, "add_frecency", [
+        AddColumn("users", "frecency_ref", "DATETIME"),
+        Backfill("users.frecency_ref", "users", frecency.backfill_user_refs),
+        AddColumn("links", "frecency", "DOUBLE NOT NULL DEFAULT 0"),
+        Backfill("按 access_history 计算 frecency", "links", frecency.replay_access_history),
+        # 回填完成后再建索引，避免回填时逐行维护索引
+        CreateIndex("links", "ix_links_user_id_frecency", ["user_id", "frecency"]),
+    ]),
+    Migration(7, "add_share_token", [
+        AddColumn("users", "share_token", "VARCHAR(32)"),
+        CreateIndex("users", "ix_users_share_token", ["share_token"], unique=True),
+    ]),
+    Migration(8, "add_jobs", [
+        CreateTable(Job),
+    ]),
+    Migration(9, "add_link_domain", [
+        AddColumn("links", "host", "VARCHAR(255)"),
+        AddColumn("links", "domain", "VARCHAR(255)"),
+        Backfill("links.host / links.domain", "links", domains.backfill_link_domains),
+        CreateIndex("links", "ix_links_user_id_domain", ["user_id", "domain"]),
+    ]),
+    Migration(10, "add_share_epoch", [
+        AddColumn("users", "share_epoch", "INTEGER NOT NULL DEFAULT 0", after="share_token"),
+    ]),
+    Migration(11, "add_change_seq", [
+        AddColumn("users", "change_seq", "BIGINT NOT NULL DEFAULT 0", after="share_epoch"),
+        AddColumn("change_events", "seq", "BIGINT", after="user_id"),
+        Backfill("change_events.seq", "change_events", changefeed.backfill_event_seqs),
+        Backfill("users.change_seq", "users", changefeed.backfill_user_seqs),
+        CreateIndex("change_events", "ix_change_events_user_id_seq", ["user_id", "seq"], unique=True),
+    ]),
+]
+
+def latest_version(migrations=None) -> int:
+    return max(m.version for m in (migrations or MIGRATIONS))
+
+# ========== 执行 ==========
+class MigrationRunner:
+    def __init__(self, engine, migrations=None, allow_lock: bool = False, log=print):
+        self.engine = engine
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+        self.allow_lock = allow_lock
+        self.log = log
+        self.dialect = engine.dialect.name
+
+    def _states(self, create: bool = True):
+        if create:
+            schema_migrations.create(self.engine, checkfirst=True)
+        elif not inspect(self.engine).has_table("schema_migrations"):
+            return {}
+        with self.engine.connect() as connection:
+            return {row.version: row for row in connection.execute(select(schema_migrations))}
+
+    def save_progress(self, connection, version: int, step: int, checkpoint=None):
+        connection.execute(
+            update(schema_migrations).where(schema_migrations.c.version == version),
+            {"step": step, "checkpoint": checkpoint},
+        )
+
+    def execute_ddl(self, statements, locking: str = None):
+        """依次尝试 statements；都不支持时，只有 allow_lock 才执行会锁表的 locking"""
+        candidates = list(statements)
+        if locking and self.allow_lock:
+            candidates.append(locking)
+        last_error = None
+        for sql in candidates:
+            for attempt in range(settings.MIGRATION_DDL_RETRIES):
+                try:
+                    with self.engine.connect() as connection:
+                        if self.dialect == "mysql":
+                            connection.exec_driver_sql(
+                                f"SET SESSION lock_wait_timeout = {int(settings.MIGRATION_LOCK_WAIT_TIMEOUT)}"
+                            )
+                        connection.exec_driver_sql(sql)
+                        connection.commit()
+                    return
+                except DBAPIError as e:
+                    code = _mysql_error_code(e) if self.dialect == "mysql" else None
+                    if code == ER_LOCK_WAIT_TIMEOUT:
+                        # 有长事务持有元数据锁：放弃本次等待，避免阻塞后续读写
+                        last_error = e
+                        self.log(f"    等待元数据锁超时，{2 ** attempt}s 后重试...")
+                        time.sleep(2 ** attempt)
+                        continue
+                    if code in ER_NOT_SUPPORTED and sql != locking:
+                        last_error = e
+                        break
+                    raise
+            else:
+                raise MigrationError(f"多次等待元数据锁超时: {sql}") from last_error
+        raise MigrationError(
+            f"无法在线执行，确认可以锁表后使用 --allow-lock: {locking or candidates[-1]}"
+        ) from last_error
+
+    def pending(self):
+        states = self._states(create=False)
+        return [m for m in self.migrations if getattr(states.get(m.version), "status", None) != "done"]
+
+    def upgrade(self, target: int = None):
+        """执行待执行的迁移，返回执行的版本列表"""
+        states = self._states()
+        executed = []
+        for migration in self.migrations:
+            if target is not None and migration.version > target:
+                break
+            state = states.get(migration.version)
+            if state is not None and state.status == "done":
+                continue
+
+            start = time.perf_counter()
+            if state is None:
+                with self.engine.begin() as connection:
+                    connection.execute(insert(schema_migrations), {
+                        "version": migration.version, "name": migration.name, "status": "running",
+                        "step": 0, "checkpoint": None, "started_at": datetime.now(),
+                    })
+                first_step, checkpoint = 0, None
+                self.log(f"[{migration.version}] {migration.name}")
+            else:
+                first_step, checkpoint = state.step, state.checkpoint
+                self.log(f"[{migration.version}] {migration.name}（从第 {first_step + 1} 步继续）")
+
+            for index, step in enumerate(migration.steps):
+                if index < first_step:
+                    continue
+                with self.engine.connect() as connection:
+                    skip = step.applied(connection)
+                if skip:
+                    self.log(f"  - {step.describe()}：已存在，跳过")
+                else:
+                    self.log(f"  - {step.describe()}")
+                    step.apply(self, StepContext(migration.version, index, checkpoint if index == first_step else None))
+                with self.engine.begin() as connection:
+                    self.save_progress(connection, migration.version, index + 1)
+
+            with self.engine.begin() as connection:
+                connection.execute(
+                    update(schema_migrations).where(schema_migrations.c.version == migration.version),
+                    {"status": "done", "finished_at": datetime.now()},
+                )
+            self.log(f"  完成，用时 {time.perf_counter() - start:.2f}s")
+            executed.append(migration.version)
+        return executed
+
+    def dry_run(self):
+        """列出待执行的步骤及预计耗时，只读取数据库，返回预计总耗时（秒）"""
+        total = 0.0
+        for migration in self.pending():
+            self.log(f"[{migration.version}] {migration.name}")
+            for step in migration.steps:
+                with self.engine.connect() as connection:
+                    if step.applied(connection):
+                        self.log(f"  - {step.describe()}：已存在，跳过")
+                        continue
+                    seconds = step.estimate(connection)
+                total += seconds
+                self.log(f"  - {step.describe()}：预计 {seconds:.2f}s")
+        self.log(f"预计总耗时 {total:.2f}s")
+        return total
+
+    def status(self):
+        states = self._states(create=False)
+        for migration in self.migrations:
+            state = states.get(migration.version)
+            if state is None:
+                label = "待执行"
+            elif state.status == "done":
+                label = f"已完成 {state.finished_at:%Y-%m-%d %H:%M:%S}"
+            else:
+                label = f"进行中（已完成 {state.step}/{len(migration.steps)} 步）"
+            self.log(f"[{migration.version}] {migration.name}: {label}")
+
+# ========== 启动检查 ==========
+def pending_versions(engine=engine, migrations=None):
+    """读取一次 schema_migrations，返回未完成的版本号列表"""
+    migrations = migrations or MIGRATIONS
+    try:
+        with engine.connect() as connection:
+            done = set(connection.execute(
+                select(schema_migrations.c.version).where(schema_migrations.c.status == "done")
+            ).scalars())
+    except SQLAlchemyError:
+        # 只有查询失败时才检查表是否存在，区分"未迁移的库"与"数据库不可用"
+        if inspect(engine).has_table("schema_migrations"):
+            raise
+        done = set()
+    return [m.version for m in migrations if m.version not in done]
+
+def ensure_schema(engine=engine):
+    """应用启动时调用：SCHEMA_AUTO_MIGRATE 时执行迁移，否则版本落后直接报错"""
+    pending = pending_versions(engine)
+    if not pending:
+        return
+    if settings.SCHEMA_AUTO_MIGRATE:
+        MigrationRunner(engine).upgrade()
+        return
+    raise SchemaOutdatedError(
+        f"数据库结构需要迁移（待执行版本: {', '.join(map(str, pending))}），请先运行 python migrations.py"
+    )
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="数据库迁移")
+    parser.add_argument("--dry-run", action="store_true", help="只列出待执行的步骤和预计耗时")
+    parser.add_argument("--status", action="store_true", help="查看各版本状态")
+    parser.add_argument("--target", type=int, help="只迁移到指定版本")
+    parser.add_argument("--allow-lock", action="store_true", help="无法在线执行时允许锁表执行 DDL")
+    args = parser.parse_args()
+
+    runner = MigrationRunner(engine, allow_lock=args.allow_lock)
+    if args.status:
+        runner.status()
+    elif args.dry_run:
+        runner.dry_run()
+    else:
+        print("开始数据库迁移...")
+        executed = runner.upgrade(args.target)
+        print(f"迁移完成！执行了 {len(executed)} 个版本" if executed else "数据库已是最新版本")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, Double, String, Text, DateTime, Boolean, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -10,6 +10,10 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(100), nullable=False, unique=True, index=True)
     password_hash = Column(String(255), nullable=True)  # 密码哈希，可为空以兼容旧用户
+    frecency_ref = Column(DateTime)  # 链接 frecency 分数的参考时间（见 frecency.py）
+    share_token = Column(String(32), unique=True, index=True)  # 公开分享页令牌（见 share.py）
+    share_epoch = Column(Integer, nullable=False, default=0, server_default="0")  # 分享快照版本，内容变化时加一
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")  # 最近一条变更事件的序号
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
@@ -36,8 +40,29 @@ class Link(Base):
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
+    # 链接健康检查（见 linkcheck.py）
+    http_status = Column(Integer)  # 最近一次检查的状态码，0 表示网络错误
+    final_url = Column(String(500))  # 跟随重定向后的最终地址
+    checked_at = Column(DateTime)
+    etag = Column(String(200))
+    last_modified = Column(String(100))
+    check_failures = Column(Integer, default=0)  # 连续失败次数
+    next_check_at = Column(DateTime, index=True)
+    
+    # 按时间衰减的使用频率，相对于 users.frecency_ref（见 frecency.py）
+    frecency = Column(Double, nullable=False, default=0, server_default="0")
+    
+    # 主机名与可注册域名（见 domains.py）
+    host = Column(String(255))
+    domain = Column(String(255))
+    
     # 关系
     user = relationship("User", back_populates="links")
+    
+    __table_args__ = (
+        Index("ix_links_user_id_frecency", "user_id", "frecency"),
+        Index("ix_links_user_id_domain", "user_id", "domain"),
+    )
 
 class Category(Base):
     """分类表（用于存储自定义分类和文件夹结构）"""
@@ -81,3 +106,47 @@ class AccessHistory(Base):
     link_name = Column(String(200))
     timestamp = Column(DateTime, server_default=func.now(), index=True)
 
+class ChangeEvent(Base):
+    """变更事件表（推送给客户端的变更流，按保留时间定期清理）"""
+    __tablename__ = "change_events"
+    
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(BigInteger)  # 用户内递增的序号，推送按序号续传（见 crud.record_change）
+    entity = Column(String(30), nullable=False)  # link / category / settings / access_history / frecency / backup
+    op = Column(String(10), nullable=False)  # upsert / delete
+    ids = Column(JSON)  # 受影响的记录ID列表
+    fields = Column(JSON)  # 变更的字段及新值
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+    
+    __table_args__ = (
+        Index("ix_change_events_user_id_id", "user_id", "id"),
+        Index("ix_change_events_user_id_seq", "user_id", "seq", unique=True),
+    )
+
+class Job(Base):
+    """后台任务表（见 jobs.py）"""
+    __tablename__ = "jobs"
+    
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    user_id = Column(Integer, index=True)  # 不设外键：删除用户的任务需要在用户删除后保留
+    kind = Column(String(50), nullable=False)
+    params = Column(JSON)
+    status = Column(String(20), nullable=False, default="queued")  # queued / running / succeeded / failed / cancelled
+    priority = Column(Integer, nullable=False, default=0)  # 越大越先执行
+    total = Column(Integer)  # 需要处理的总数，未知时为空
+    done = Column(Integer, nullable=False, default=0)
+    checkpoint = Column(JSON)  # 最后一批完成后的进度，重启后从这里继续
+    result = Column(JSON)
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0)
+    worker = Column(String(100))  # 正在执行的 worker
+    run_after = Column(DateTime)  # 失败重试的最早时间
+    heartbeat_at = Column(DateTime)  # 最近一次保存进度的时间
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime, index=True)
+    
+    __table_args__ = (
+        Index("ix_jobs_status_priority", "status", "priority", "id"),
+    )
@@ -0,0 +1,358 @@
+"""
+限流与过载保护
+
+RateLimitMiddleware 在路由之前按请求路径把请求归入一个路由类别，然后依次检查：
+
+1. 过载保护：本进程正在处理的请求数超过连接池容量（DB_POOL_SIZE + DB_MAX_OVERFLOW）
+   再加 LOAD_SHED_QUEUE_DEPTH 时直接返回 503 + Retry-After，而不是排队等待连接池超时
+2. 令牌桶：按 (用户, 类别) 限速，没有用户ID的接口（登录、公开分享）按客户端 IP。
+   超出时返回 429 + Retry-After。速率见 RATE_LIMITS，格式为 "类别=每秒令牌数/桶容量"。
+   直接连接方属于 RATE_LIMIT_TRUSTED_PROXIES（反向代理 / CDN）时，客户端 IP 取自
+   RATE_LIMIT_CLIENT_IP_HEADER 中从右往左第一个不属于可信代理的地址
+3. 并发上限：开销大的类别（RATE_LIMIT_CONCURRENCY，例如搜索）在本进程内同时执行的请求数，
+   RATE_LIMIT_CONCURRENCY_WAIT 秒内等不到空位时返回 503
+4. 语句超时：按类别设置本次请求的数据库语句超时（DB_STATEMENT_TIMEOUTS，见 database.py）
+
+令牌桶状态（RATE_LIMIT_BACKEND）：
+- memory  进程内，每个 worker 单独计数（默认）
+- local   共享内存（mmap 文件），同一台机器上的 worker 共用一个桶
+- redis   Redis 上的 Lua 脚本，多台机器共用；使用 asyncio 连接，不阻塞事件循环，
+          Redis 不可用或超过 0.2 秒未响应时临时退回进程内计数
+"""
+import asyncio
+import fcntl
+import ipaddress
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from cache import _AsyncRespConnection
+from database import settings, request_statement_timeout
+
+EXEMPT_PATHS = {"/", "/health", "/health/live", "/health/ready", "/docs", "/redoc", "/openapi.json"}
+
+def parse_classes(text: str, parse=float) -> dict:
+    """解析 "a=1,b=2" 形式的配置"""
+    result = {}
+    for part in text.split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            result[name.strip()] = parse(value.strip())
+    return result
+
+def parse_rate(value: str):
+    """"每秒令牌数/桶容量" -> (rate, burst)"""
+    rate, _, burst = value.partition("/")
+    return float(rate), float(burst or rate)
+
+# ========== 路由分类 ==========
+class RouteClassifier:
+    def __init__(self, prefix: str):
+        prefix = re.escape(prefix)
+        self._user_path = re.compile(rf"^{prefix}/users/(\d+)(/.*)?$")
+        self._public = re.compile(rf"^{prefix}/share/")
+        self._favicons = re.compile(rf"^{prefix}/favicons/")
+        self._auth = re.compile(rf"^{prefix}/auth/")
+
+    def classify(self, method: str, path: str, query_string: bytes):
+        """返回 (类别, 限流键)；返回 None 表示不限流（健康检查、长连接推送等）"""
+        if path in EXEMPT_PATHS:
+            return None
+        match = self._user_path.match(path)
+        if match:
+            user_id, rest = match.group(1), match.group(2) or ""
+            if rest.startswith("/changes"):
+                return None  # SSE 长连接
+            if rest.endswith("/click"):
+                kind = "click"
+            elif rest.startswith("/links/batch/"):
+                kind = "batch"
+            elif method == "GET" and rest == "/links" and b"search=" in query_string \
+                    and parse_qs(query_string.decode("latin-1")).get("search", [""])[0]:
+                kind = "search"
+            elif method in ("GET", "HEAD"):
+                kind = "read"
+            else:
+                kind = "write"
+            return kind, f"u{user_id}"
+        if self._favicons.match(path):
+            return None  # 图标带长时间缓存头，页面加载时会一次请求很多个，且不访问数据库
+        if self._auth.match(path):
+            return "auth", None
+        if self._public.match(path):
+            return "public", None
+        return ("read" if method in ("GET", "HEAD") else "write"), None
+
+# ========== 客户端地址 ==========
+class ClientAddress:
+    """取请求的客户端 IP：直接连接方是可信代理时，从转发头中取代理之前的地址"""
+
+    def __init__(self, trusted_proxies: str = "", header: str = "X-Forwarded-For"):
+        self.networks = [ipaddress.ip_network(part.strip(), strict=False)
+                         for part in trusted_proxies.split(",") if part.strip()]
+        self.header = header.lower().encode("latin-1")
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in self.networks)
+
+    def __call__(self, scope) -> str:
+        client = scope.get("client")
+        peer = client[0] if client else ""
+        if not self.networks or not self._trusted(peer):
+            return peer
+        values = [value.decode("latin-1") for name, value in scope.get("headers", []) if name == self.header]
+        hops = [hop.strip() for value in values for hop in value.split(",") if hop.strip()]
+        # 从右往左跳过可信代理；左侧的地址可以由客户端伪造，不能直接取第一个
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                try:
+                    return str(ipaddress.ip_address(hop))
+                except ValueError:
+                    return peer  # 格式错误的转发头按直接连接方计数
+        return hops[0] if hops else peer
+
+# ========== 令牌桶状态 ==========
+class BucketStore:
+    """令牌桶状态基类"""
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """取一个令牌：成功返回 0，否则返回需要等待的秒数"""
+        raise NotImplementedError
+
+    async def take_async(self, key: str, rate: float, burst: float) -> float:
+        """在事件循环中取令牌（中间件使用）；进程内和共享内存的实现不会阻塞，直接调用 take()"""
+        return self.take(key, rate, burst)
+
+def _refill(tokens: float, updated: float, now: float, rate: float, burst: float):
+    """返回 (剩余令牌数, 需要等待的秒数)"""
+    if updated <= 0:
+        tokens = burst  # 新桶是满的
+    else:
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+class MemoryBuckets(BucketStore):
+    """进程内令牌桶，超过 max_entries 时淘汰最久未使用的桶（被淘汰的桶相当于重新装满）"""
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, 0.0))
+            tokens, wait = _refill(tokens, updated, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return wait
+
+class LocalBuckets(BucketStore):
+    """同机多进程令牌桶：状态保存在 mmap 共享文件中，按键的 CRC32 取模分槽
+
+    不同的键落在同一槽位时共用一个桶，只会让限流更严格。
+    """
+
+    SLOT = struct.Struct("dd")  # 剩余令牌数, 更新时间（time.time）
+
+    def __init__(self, path: str, slots: int = 65536):
+        self.slots = slots
+        size = slots * self.SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._file = os.fdopen(fd, "r+b")
+        except Exception:
+            os.close(fd)
+            raise
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        offset = (zlib.crc32(key.encode("utf-8")) % self.slots) * self.SLOT.size
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            now = time.time()
+            tokens, updated = self.SLOT.unpack_from(self._map, offset)
+            tokens, wait = _refill(tokens, updated, now, rate, burst)
+            self.SLOT.pack_into(self._map, offset, tokens, now)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        return wait
+
+# 令牌桶在 Redis 中原子地更新；使用 Redis 服务器时间，各机器的时钟不需要一致
+TAKE_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 't', 'u')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = burst
+else
+  tokens = math.min(burst, tokens + math.max(0, now - tonumber(state[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 'u', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RedisBuckets(BucketStore):
+    """跨主机令牌桶：asyncio 连接，不阻塞事件循环
+
+    每个 worker 一个连接，命令依次发送；连接或命令超过 timeout 秒、或 Redis 出错后，
+    retry_seconds 内改用进程内令牌桶，等待中的请求也立即改用进程内令牌桶
+    """
+
+    def __init__(self, url: str, prefix: str = "link_portal:ratelimit:", retry_seconds: float = 5.0,
+                 timeout: float = 0.2):
+        self.url = url
+        self.prefix = prefix
+        self.retry_seconds = retry_seconds
+        self.timeout = timeout
+        self.fallback = MemoryBuckets()
+        self._connection = None
+        self._down_until = 0.0
+        self._loop = None
+        self._lock = None
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """同步调用（不在事件循环中）只能使用进程内令牌桶"""
+        return self.fallback.take(key, rate, burst)
+
+    async def take_async(self, key: str, rate: float, burst: float) -> float:
+        if time.monotonic() < self._down_until:
+            return self.fallback.take(key, rate, burst)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 连接和锁属于创建它们的事件循环
+            self._close()
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            if time.monotonic() < self._down_until:
+                return self.fallback.take(key, rate, burst)
+            try:
+                if self._connection is None:
+                    self._connection = await asyncio.wait_for(_AsyncRespConnection.open(self.url), self.timeout)
+                result = await asyncio.wait_for(
+                    self._connection.command("EVAL", TAKE_SCRIPT, 1, self.prefix + key, rate, burst), self.timeout)
+                return float(result)
+            except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError,
+                    TypeError):
+                self._close()
+                self._down_until = time.monotonic() + self.retry_seconds
+        return self.fallback.take(key, rate, burst)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+
+def create_store(backend: str):
+    if backend == "memory":
+        return MemoryBuckets()
+    if backend == "local":
+        return LocalBuckets(settings.RATE_LIMIT_LOCAL_PATH)
+    if backend == "redis":
+        return RedisBuckets(settings.CACHE_REDIS_URL)
+    return None
+
+# ========== 中间件 ==========
+class RateLimitMiddleware:
+    """纯 ASGI 中间件；需要加在 CORS 中间件之前（即更内层），429 / 503 响应才会带上 CORS 头"""
+
+    def __init__(self, app, prefix: str, store: BucketStore = None, limits: dict = None,
+                 concurrency: dict = None, timeouts: dict = None, max_in_flight: int = None,
+                 client_address: ClientAddress = None):
+        self.app = app
+        self.classifier = RouteClassifier(prefix)
+        self.client_address = client_address or ClientAddress(settings.RATE_LIMIT_TRUSTED_PROXIES,
+                                                               settings.RATE_LIMIT_CLIENT_IP_HEADER)
+        self.store = store if store is not None else create_store(settings.RATE_LIMIT_BACKEND)
+        if limits is None:
+            limits = {name: parse_rate(value) for name, value in parse_classes(settings.RATE_LIMITS, str).items()}
+        self.limits = limits
+        if concurrency is None:
+            concurrency = parse_classes(settings.RATE_LIMIT_CONCURRENCY, int)
+        self._semaphores = {name: asyncio.Semaphore(limit) for name, limit in concurrency.items() if limit > 0}
+        self.timeouts = timeouts if timeouts is not None else parse_classes(settings.DB_STATEMENT_TIMEOUTS, int)
+        if max_in_flight is None and settings.LOAD_SHED_ENABLED:
+            max_in_flight = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW + settings.LOAD_SHED_QUEUE_DEPTH
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.stats = {"limited": 0, "shed": 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self.classifier.classify(scope["method"], scope["path"], scope.get("query_string", b""))
+        if route is None or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        kind, key = route
+        if key is None:
+            key = f"ip{self.client_address(scope)}"
+
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            self.stats["shed"] += 1
+            await self._reject(send, 503, "服务器繁忙，请稍后再试", settings.LOAD_SHED_RETRY_AFTER)
+            return
+
+        limit = self.limits.get(kind)
+        if self.store is not None and limit is not None:
+            wait = await self.store.take_async(f"{kind}:{key}", *limit)
+            if wait > 0:
+                self.stats["limited"] += 1
+                await self._reject(send, 429, "请求过于频繁，请稍后再试", wait)
+                return
+
+        semaphore = self._semaphores.get(kind)
+        if semaphore is not None:
+            try:
+                await asyncio.wait_for(semaphore.acquire(), settings.RATE_LIMIT_CONCURRENCY_WAIT)
+            except asyncio.TimeoutError:
+                self.stats["shed"] += 1
+                await self._reject(send, 503, "服务器繁忙，请稍后再试", settings.LOAD_SHED_RETRY_AFTER)
+                return
+
+        timeout = self.timeouts.get(kind, self.timeouts.get("default"))
+        token = request_statement_timeout.set(timeout or None)
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            request_statement_timeout.reset(token)
+            if semaphore is not None:
+                semaphore.release()
+
+    async def _reject(self, send, status: int, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -56,10 +56,38 @@ class LinkResponse(LinkBase):
     add_time: datetime
     created_at: datetime
     updated_at: Optional[datetime] = None
+    http_status: Optional[int] = None
+    final_url: Optional[str] = None
+    checked_at: Optional[datetime] = None
+    frecency: float = 0.0  # 同一用户的链接之间可直接比较
+    host: Optional[str] = None
+    domain: Optional[str] = None
     
     class Config:
         from_attributes = True
 
+class LinkHealthResponse(BaseModel):
+    total: int
+    checked: int
+    healthy: int
+    redirected: int
+    broken: int
+    skipped: int = 0  # 指向内网等地址，未检查
+    broken_links: List[LinkResponse]
+
+class DomainStats(BaseModel):
+    domain: str
+    hosts: int
+    links: int
+    clicks: int
+    broken: int
+    last_access: Optional[datetime] = None
+
+class ShareLinkResponse(BaseModel):
+    token: str
+    html_url: str
+    json_url: str
+
 # 分类相关
 class CategoryBase(BaseModel):
     name: str
@@ -139,3 +167,26 @@ class BatchUpdateShare(BaseModel):
 class BatchDelete(BaseModel):
     link_urls: List[str]
 
+
+# 后台任务
+class JobAccepted(BaseModel):
+    job_id: int
+    status_url: str
+    message: str
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    priority: int
+    total: Optional[int] = None
+    done: int
+    progress: Optional[float] = None  # 0 ~ 1，总数未知时为空
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
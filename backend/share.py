@@ -0,0 +1,446 @@
+"""
+公开分享页
+
+每个用户有一个随机的分享令牌（users.share_token），只包含 is_private 为 False 的链接：
+
+    GET /api/v1/share/{token}                HTML 页面
+    GET /api/v1/share/{token}.json           JSON
+    ?category=名称                            只包含该分类（分类不存在时返回 404）
+
+快照版本保存在数据库中（users.share_epoch）：crud.py 中会改变分享内容的写操作（增删改非私有链接、
+批量操作、修改页面标题）在同一事务中调用 invalidate() 让版本加一。令牌 -> (用户ID, 版本) 在进程内缓存
+SHARE_TOKEN_CACHE_SECONDS 秒，过期后按唯一索引查询一次；本进程的写入通过 cache.subscribe 立即生效。
+所以不论快照目录是否共享，任何机器上的旧内容、已更换的令牌和已删除的用户最多保留 SHARE_TOKEN_CACHE_SECONDS 秒。
+
+快照按版本预先生成在 SHARE_SNAPSHOT_DIR，只是缓存，每台机器各自一份即可：
+
+    pages/<sha256(令牌)>/<版本>/<key>.meta        各格式的内容哈希与压缩格式（完整快照还包含分类列表）
+    pages/<sha256(令牌)>/<版本>/<key>.json[.gz|.br] / <key>.html[.gz|.br]
+
+完整快照从数据库生成（同一进程内只生成一次），分类页从完整快照在内存中过滤，不访问数据库；
+分类必须是完整快照中出现过的分类，随意构造的参数直接返回 404。生成新版本后删除该令牌的旧版本，
+后台每 SHARE_SWEEP_INTERVAL_HOURS 小时清理已更换的令牌和已删除用户的快照。
+正文预先压缩为 gzip 和 brotli（安装了 Brotli 时）。
+"""
+import asyncio
+import gzip
+import hashlib
+import html
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+from sqlalchemy import and_
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal, settings
+from models import User, Link, UserSettings
+import cache
+
+try:
+    import brotli
+except ImportError:  # Brotli 为可选依赖
+    brotli = None
+
+FORMATS = {
+    "json": "application/json; charset=utf-8",
+    "html": "text/html; charset=utf-8",
+}
+SAFE_SCHEMES = {"http", "https", "ftp", "mailto"}
+TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+ALL = "all"
+
+def new_token() -> str:
+    return secrets.token_urlsafe(16)
+
+def encodings():
+    """可用的预压缩格式（按优先级）"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def _snapshot_key(category) -> str:
+    if category is None:
+        return ALL
+    return "c-" + hashlib.sha1(category.encode("utf-8")).hexdigest()[:16]
+
+def _token_dir(token: str) -> str:
+    # 目录名不直接使用令牌，快照目录泄露时不会暴露分享地址
+    return hashlib.sha256(token.encode("ascii")).hexdigest()[:32]
+
+# ========== 令牌 ==========
+class TokenCache:
+    """令牌 -> (用户ID, 分享版本) 的进程内缓存，过期后重新查询数据库"""
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # 令牌 -> (用户ID, 版本, 过期时间)；无效令牌的用户ID为 None
+        self._by_user = {}
+        self._lock = threading.Lock()
+        self._loading = {}  # 令牌 -> 锁，缓存过期时同一令牌只查询一次
+
+    def lookup(self, token: str):
+        """返回 (用户ID, 版本)，令牌无效时返回 None"""
+        entry = self._entries.get(token)
+        if entry is None or entry[2] <= time.monotonic():
+            with self._lock:
+                loading = self._loading.setdefault(token, threading.Lock())
+            with loading:
+                entry = self._entries.get(token)
+                if entry is None or entry[2] <= time.monotonic():
+                    entry = self._load(token)
+            with self._lock:
+                self._loading.pop(token, None)
+        return None if entry[0] is None else entry[:2]
+
+    def _load(self, token: str):
+        db = SessionLocal()
+        try:
+            row = db.query(User.id, User.share_epoch).filter(User.share_token == token).first()
+        finally:
+            db.close()
+        return self.put(token, *(row or (None, None)))
+
+    def put(self, token: str, user_id, epoch):
+        entry = (user_id, epoch, time.monotonic() + self.ttl)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+                self._by_user.clear()
+            self._entries[token] = entry
+            if user_id is not None:
+                self._by_user[user_id] = token
+        return entry
+
+    def forget(self, token: str):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def forget_user(self, user_id: int):
+        with self._lock:
+            token = self._by_user.pop(user_id, None)
+            if token is not None:
+                self._entries.pop(token, None)
+
+# ========== 快照存储 ==========
+class SnapshotStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._locks = defaultdict(threading.Lock)
+
+    def _pages_dir(self) -> str:
+        return os.path.join(self.root, "pages")
+
+    def _dir(self, token: str, epoch: int) -> str:
+        return os.path.join(self._pages_dir(), _token_dir(token), str(epoch))
+
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _read(self, path: str):
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def load_meta(self, token: str, epoch: int, key: str):
+        data = self._read(os.path.join(self._dir(token, epoch), f"{key}.meta"))
+        return json.loads(data) if data is not None else None
+
+    def load_body(self, token: str, epoch: int, key: str, fmt: str, encoding: str = None):
+        name = f"{key}.{fmt}" + (f".{encoding}" if encoding else "")
+        return self._read(os.path.join(self._dir(token, epoch), name))
+
+    def save(self, token: str, epoch: int, key: str, bodies: dict, **extra):
+        """bodies: {格式: 未压缩正文}；meta 最后写入，读到 meta 时正文一定已经就绪"""
+        directory = self._dir(token, epoch)
+        meta = {"epoch": epoch, "etag": {}, "encodings": encodings(), **extra}
+        for fmt, body in bodies.items():
+            meta["etag"][fmt] = hashlib.sha256(body).hexdigest()[:32]
+            self._write_atomic(os.path.join(directory, f"{key}.{fmt}"), body)
+            for encoding in meta["encodings"]:
+                self._write_atomic(os.path.join(directory, f"{key}.{fmt}.{encoding}"), _compress(body, encoding))
+        self._write_atomic(os.path.join(directory, f"{key}.meta"), json.dumps(meta).encode("utf-8"))
+        return meta
+
+    def prune(self, token: str, epoch: int):
+        """删除该令牌早于 epoch 的版本"""
+        return self._prune_dir(os.path.join(self._pages_dir(), _token_dir(token)), epoch)
+
+    def _prune_dir(self, directory: str, epoch: int) -> int:
+        removed = 0
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return 0
+        for name in names:
+            if not name.isdigit() or int(name) < epoch:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def remove(self, token: str):
+        shutil.rmtree(os.path.join(self._pages_dir(), _token_dir(token)), ignore_errors=True)
+
+    def sweep(self, current: dict) -> int:
+        """current: {令牌目录: 当前版本}；删除不在其中的令牌目录和旧版本，返回删除的目录数"""
+        removed = 0
+        try:
+            names = os.listdir(self._pages_dir())
+        except OSError:
+            return 0
+        for name in names:
+            directory = os.path.join(self._pages_dir(), name)
+            if name not in current:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed += 1
+            else:
+                removed += self._prune_dir(directory, current[name])
+        return removed
+
+    def lock(self, token: str, key: str):
+        return self._locks[(_token_dir(token), key)]
+
+store = SnapshotStore(settings.SHARE_SNAPSHOT_DIR)
+tokens = TokenCache(settings.SHARE_TOKEN_CACHE_SECONDS)
+# 本进程（配置了跨机器总线时包括其他机器）的写入提交后立即生效，不必等缓存过期
+cache.subscribe(tokens.forget_user)
+
+def invalidate(db, user_id: int):
+    """分享内容变化时在写操作的事务中调用（crud.py），提交后旧快照在所有机器上失效"""
+    db.query(User).filter(User.id == user_id).update(
+        {User.share_epoch: User.share_epoch + 1}, synchronize_session=False
+    )
+
+def sweep() -> int:
+    """清理已更换的令牌、已删除用户和旧版本的快照"""
+    db = SessionLocal()
+    try:
+        current = {
+            _token_dir(token): epoch
+            for token, epoch in db.query(User.share_token, User.share_epoch).filter(User.share_token.isnot(None))
+        }
+    finally:
+        db.close()
+    return store.sweep(current)
+
+async def run_forever():
+    while True:
+        try:
+            await run_in_threadpool(sweep)
+        except Exception:
+            pass  # 数据库暂时不可用等情况，下一轮重试
+        await asyncio.sleep(settings.SHARE_SWEEP_INTERVAL_HOURS * 3600)
+
+# ========== 生成 ==========
+def build_snapshot(user_id: int, token: str):
+    """从数据库读取分享内容，返回 (版本, 快照)；令牌已失效时返回 (None, None)
+
+    版本和内容在同一个事务中读取，快照与版本号一致
+    """
+    db = SessionLocal()
+    try:
+        epoch = db.query(User.share_epoch).filter(and_(User.id == user_id, User.share_token == token)).scalar()
+        if epoch is None:
+            return None, None
+        user_settings = db.query(UserSettings.page_title, UserSettings.page_subtitle).filter(
+            UserSettings.user_id == user_id
+        ).first()
+        links = db.query(Link.name, Link.url, Link.icon, Link.note, Link.category, Link.tags).filter(
+            and_(Link.user_id == user_id, Link.is_private == False)
+        ).order_by(Link.category, Link.id).all()
+    finally:
+        db.close()
+    return epoch, {
+        "title": (user_settings.page_title if user_settings else None) or "我的链接分享",
+        "subtitle": user_settings.page_subtitle if user_settings else None,
+        "category": None,
+        "links": [{
+            "name": link.name,
+            "url": link.url,
+            "icon": link.icon,
+            "note": link.note,
+            "category": link.category or "未分类",
+            "tags": link.tags or [],
+        } for link in links],
+    }
+
+def filter_snapshot(snapshot: dict, category: str) -> dict:
+    """从完整快照中取出一个分类"""
+    return dict(snapshot, category=category, links=[link for link in snapshot["links"] if link["category"] == category])
+
+def _safe_url(url):
+    try:
+        return url if url and urlsplit(url).scheme.lower() in SAFE_SCHEMES else None
+    except ValueError:
+        return None
+
+def render_html(snapshot: dict) -> str:
+    escape = html.escape
+    groups = defaultdict(list)
+    for link in snapshot["links"]:
+        groups[link["category"]].append(link)
+
+    sections = []
+    for category, links in groups.items():
+        cards = []
+        for link in links:
+            url = _safe_url(link["url"])
+            icon = _safe_url(link["icon"])
+            icon_html = (
+                f'<img class="link-icon" src="{escape(icon)}" alt="" loading="lazy" referrerpolicy="no-referrer">'
+                if icon else f'<div class="icon-placeholder">{escape(link["name"][:1].upper())}</div>'
+            )
+            note_html = f'<div class="link-note">{escape(link["note"])}</div>' if link["note"] else ""
+            tag = "a" if url else "div"
+            href = f' href="{escape(url)}" target="_blank" rel="noopener noreferrer nofollow"' if url else ""
+            cards.append(
+                f'<{tag} class="link-card"{href}>{icon_html}'
+                f'<div class="link-name">{escape(link["name"])}</div>{note_html}'
+                f'<div class="link-url">{escape(link["url"])}</div></{tag}>'
+            )
+        sections.append(
+            f'<section class="category-section"><h2 class="category-title">{escape(category)}</h2>'
+            f'<div class="links-grid">{"".join(cards)}</div></section>'
+        )
+
+    title = snapshot["title"] + (f" - {snapshot['category']}" if snapshot["category"] else "")
+    subtitle = snapshot["subtitle"] or f"共 {len(snapshot['links'])} 个链接"
+    return f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{escape(title)}</title>
+<style>
+*{{margin:0;padding:0;box-sizing:border-box}}
+body{{font-family:-apple-system,BlinkMacSystemFont,'Segoe UI',Roboto,'Helvetica Neue',Arial,sans-serif;background:linear-gradient(135deg,#667eea 0%,#764ba2 100%);min-height:100vh;padding:40px 20px}}
+.container{{max-width:1200px;margin:0 auto}}
+.header{{text-align:center;color:#fff;margin-bottom:40px}}
+.header h1{{font-size:2.5rem;margin-bottom:10px}}
+.header p{{font-size:1.1rem;opacity:.9}}
+.category-section{{margin-bottom:40px}}
+.category-title{{color:#fff;font-size:1.5rem;margin-bottom:20px;padding-bottom:10px;border-bottom:2px solid rgba(255,255,255,.3)}}
+.links-grid{{display:grid;grid-template-columns:repeat(auto-fill,minmax(200px,1fr));gap:20px}}
+.link-card{{background:#fff;border-radius:12px;padding:20px;text-align:center;text-decoration:none;color:inherit;display:block;transition:transform .2s,box-shadow .2s}}
+a.link-card:hover{{transform:translateY(-4px);box-shadow:0 10px 30px rgba(0,0,0,.2)}}
+.link-icon,.icon-placeholder{{width:48px;height:48px;border-radius:8px;margin:0 auto 12px}}
+.link-icon{{object-fit:cover;display:block}}
+.icon-placeholder{{background:linear-gradient(135deg,#667eea 0%,#764ba2 100%);color:#fff;display:flex;align-items:center;justify-content:center;font-size:24px;font-weight:600}}
+.link-name{{font-size:1.1rem;font-weight:600;color:#1e293b;margin-bottom:8px}}
+.link-note{{font-size:.9rem;color:#64748b;margin-bottom:8px}}
+.link-url{{font-size:.85rem;color:#94a3b8;word-break:break-all}}
+@media (max-width:768px){{.links-grid{{grid-template-columns:repeat(auto-fill,minmax(150px,1fr));gap:15px}}.header h1{{font-size:2rem}}}}
+</style>
+</head>
+<body>
+<div class="container">
+<div class="header"><h1>{escape(title)}</h1><p>{escape(subtitle)}</p></div>
+{"".join(sections)}
+</div>
+</body>
+</html>
+"""
+
+def _bodies(snapshot: dict) -> dict:
+    return {
+        "json": json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        "html": render_html(snapshot).encode("utf-8"),
+    }
+
+def _ensure_full(token: str, user_id: int, epoch: int):
+    """返回 (版本, 完整快照 meta)，不存在时从数据库生成；令牌已失效时返回 None"""
+    meta = store.load_meta(token, epoch, ALL)
+    if meta is not None:
+        return epoch, meta
+    with store.lock(token, ALL):
+        # 等待锁期间其他线程可能已经生成
+        meta = store.load_meta(token, epoch, ALL)
+        if meta is not None:
+            return epoch, meta
+        current, snapshot = build_snapshot(user_id, token)
+        if snapshot is None:
+            tokens.forget(token)
+            return None
+        if current != epoch:
+            tokens.put(token, user_id, current)  # 缓存中的版本已落后
+            meta = store.load_meta(token, current, ALL)
+            if meta is not None:
+                return current, meta
+        categories = sorted({link["category"] for link in snapshot["links"]})
+        meta = store.save(token, current, ALL, _bodies(snapshot), categories=categories)
+        store.prune(token, current)
+        return current, meta
+
+def _ensure_category(token: str, epoch: int, category: str):
+    """返回 (key, 分类快照 meta)，从完整快照过滤生成；完整快照已被清理时返回 None"""
+    key = _snapshot_key(category)
+    meta = store.load_meta(token, epoch, key)
+    if meta is not None:
+        return key, meta
+    with store.lock(token, key):
+        meta = store.load_meta(token, epoch, key)
+        if meta is not None:
+            return key, meta
+        full = store.load_body(token, epoch, ALL, "json")
+        if full is None:
+            return None
+        return key, store.save(token, epoch, key, _bodies(filter_snapshot(json.loads(full), category)))
+
+def _read(token: str, epoch: int, key: str, meta: dict, fmt: str, accepted: set):
+    for encoding in meta.get("encodings", []):
+        if encoding in accepted:
+            body = store.load_body(token, epoch, key, fmt, encoding)
+            if body is not None:
+                return body, f'"{meta["etag"][fmt]}-{encoding}"', encoding, FORMATS[fmt]
+    body = store.load_body(token, epoch, key, fmt)
+    if body is None:
+        return None
+    return body, f'"{meta["etag"][fmt]}"', None, FORMATS[fmt]
+
+def get_page(token: str, fmt: str, category=None, accept_encoding: str = ""):
+    """返回 (正文, ETag, Content-Encoding, Content-Type)，令牌或分类无效时返回 None"""
+    if not TOKEN_RE.match(token):
+        return None
+    if category == "全部":
+        category = None
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in accept_encoding.split(",")
+        if part.strip() and not part.replace(" ", "").endswith(";q=0")
+    }
+    for _ in range(2):
+        entry = tokens.lookup(token)
+        if entry is None:
+            return None
+        page = _ensure_full(token, *entry)
+        if page is None:
+            return None
+        epoch, meta = page
+        key = ALL
+        if category is not None:
+            if category not in meta.get("categories", ()):
+                return None
+            page = _ensure_category(token, epoch, category)
+            if page is not None:
+                key, meta = page
+        if page is not None:
+            result = _read(token, epoch, key, meta, fmt, accepted)
+            if result is not None:
+                return result
+        # 读取期间这个版本被其他进程清理（已有更新的版本），重新确认版本后再读一次
+        tokens.forget(token)
+    return None
@@ -118,6 +118,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         initializeCategories();
         setupViewToggle(); // 先设置视图切换，再渲染
         renderLinks();
+        startChangeFeed();
         setupSearch();
         setupDragAndDrop();
         setupModal();
@@ -459,6 +460,10 @@ function applySort() {
                 const bClicks = b.clicks || b.clickCount || 0;
                 comparison = aClicks - bClicks;
                 break;
+            case 'frecency':
+                // 按使用频率排序（服务端按时间衰减计算，近期访问权重更高）
+                comparison = (a.frecency || 0) - (b.frecency || 0);
+                break;
             case 'lastAccess':
                 // 按最后访问时间排序
                 const aLastAccess = a.lastAccess || a.lastAccessTime || 0;
@@ -996,13 +1001,24 @@ function getFaviconUrl(url) {
     try {
         const urlObj = new URL(url);
         const domain = urlObj.hostname;
-        // 使用Google的favicon服务
+        // 连接后端时使用服务端图标缓存，否则使用Google的favicon服务
+        if (useBackendAPI && api) {
+            return api.getFaviconUrl(urlObj.host);
+        }
         return `https://www.google.com/s2/favicons?domain=${domain}&sz=64`;
     } catch (e) {
         return '';
     }
 }
 
+// 已保存的 Google favicon 地址改为走服务端图标缓存
+function localizeFaviconUrl(icon, url) {
+    if (useBackendAPI && api && icon && icon.startsWith('https://www.google.com/s2/favicons')) {
+        return getFaviconUrl(url) || icon;
+    }
+    return icon;
+}
+
 // 获取网站信息（标题、描述、图标）- 使用Open Graph
 async function fetchWebsiteInfo(url) {
     try {
@@ -1988,24 +2004,42 @@ function saveLinksOrder() {
     }
 }
 
+// 把后端返回的链接转换为本地链接对象
+function fromBackendLink(link) {
+    return {
+        name: link.name,
+        url: link.url,
+        icon: localizeFaviconUrl(link.icon, link.url),
+        note: link.note,
+        category: link.category || '未分类',
+        tags: link.tags || [],
+        private: link.is_private,
+        clicks: link.clicks || 0,
+        frecency: link.frecency || 0,
+        lastAccess: link.last_access ? new Date(link.last_access).getTime() : null,
+        addTime: link.add_time ? new Date(link.add_time).getTime() : Date.now(),
+        id: link.id // 保存后端返回的 ID
+    };
+}
+
+// 用写入接口的返回值就地更新本地链接（变更推送可能已先一步加入同一条链接，按 ID 合并）
+function upsertLocalLink(link) {
+    const local = fromBackendLink(link);
+    const existing = allLinks.find(item => item.id === local.id);
+    if (existing) {
+        Object.assign(existing, local);
+    } else {
+        allLinks.push(local);
+    }
+    saveLinksOrder();
+}
+
 // 从本地存储或后端加载链接顺序
 async function loadLinksOrder() {
     if (useBackendAPI && api && currentUserId) {
         try {
             const links = await api.getLinks(currentUserId);
-            allLinks = links.map(link => ({
-                name: link.name,
-                url: link.url,
-                icon: link.icon,
-                note: link.note,
-                category: link.category || '未分类',
-                tags: link.tags || [],
-                private: link.is_private,
-                clicks: link.clicks || 0,
-                lastAccess: link.last_access ? new Date(link.last_access).getTime() : null,
-                addTime: link.add_time ? new Date(link.add_time).getTime() : Date.now(),
-                id: link.id // 保存后端返回的 ID
-            }));
+            allLinks = links.map(fromBackendLink);
             
             // 尝试从 localStorage 加载保存的顺序
             try {
@@ -2488,15 +2522,15 @@ async function saveLink() {
         try {
             if (editingLinkIndex !== null && allLinks[editingLinkIndex].id) {
                 // 编辑模式
-                await api.updateLink(currentUserId, allLinks[editingLinkIndex].id, linkData);
+                const updatedLink = await api.updateLink(currentUserId, allLinks[editingLinkIndex].id, linkData);
+                upsertLocalLink(updatedLink);
                 showNotification('链接已更新', 'success');
             } else {
                 // 添加模式
                 const createdLink = await api.createLink(currentUserId, linkData);
+                upsertLocalLink(createdLink);
                 showNotification('链接已添加', 'success');
             }
-            // 重新加载链接列表
-            await loadLinksOrder();
             // 更新标签
             updateAllTags();
             updateTagFilters();
@@ -2561,8 +2595,8 @@ async function deleteLink(index) {
         try {
             await api.deleteLink(currentUserId, link.id);
             showNotification('链接已删除', 'success');
-            // 重新加载链接列表
-            await loadLinksOrder();
+            allLinks = allLinks.filter(item => item.id !== link.id);
+            saveLinksOrder();
             initializeCategories();
             filterLinks(document.getElementById('searchInput').value);
             return;
@@ -3545,6 +3579,92 @@ async function loadAllUserData() {
     initializeCategories();
     renderLinks();
     updateDataInfo();
+    startChangeFeed();
+}
+
+// ========== 变更推送 ==========
+let changeFeed = null;
+let changeFeedUserId = null;
+
+// 订阅当前用户的变更（其他标签页或设备的修改），就地更新本地数据而不是重新下载全部链接
+function startChangeFeed() {
+    if (!useBackendAPI || !api || !currentUserId) return;
+    if (changeFeed && changeFeedUserId === currentUserId) return;
+    if (changeFeed) {
+        changeFeed.close();
+    }
+    changeFeedUserId = currentUserId;
+    changeFeed = api.subscribeChanges(currentUserId, {
+        onChange: applyRemoteChange,
+        onReset: () => loadLinksOrder().then(() => renderLinks())
+    });
+}
+
+// 把后端字段名转换为本地链接对象的字段名
+function toLocalLinkFields(fields) {
+    const result = {};
+    Object.entries(fields || {}).forEach(([key, value]) => {
+        if (key === 'is_private') {
+            result.private = value;
+        } else if (key === 'last_access') {
+            result.lastAccess = value ? new Date(value).getTime() : null;
+        } else if (key === 'tags') {
+            result.tags = value || [];
+        } else {
+            result[key] = value;
+        }
+    });
+    return result;
+}
+
+function applyRemoteChange(change) {
+    if (change.entity === 'frecency') {
+        // 服务端重归一化：所有分数乘以同一系数，排序不变
+        const factor = (change.fields || {}).factor || 1;
+        allLinks.forEach(link => { link.frecency = (link.frecency || 0) * factor; });
+        return;
+    }
+    if (change.entity === 'backup') {
+        // 从备份恢复：所有数据都可能变化，与 reset 一样全量重新加载
+        loadCustomCategories().then(() => renderCategoryList());
+        loadLinksOrder().then(() => renderLinks());
+        return;
+    }
+    if (change.entity !== 'link') {
+        // 分类、设置等变化较少，直接重新加载
+        if (change.entity === 'category') {
+            loadCustomCategories().then(() => renderCategoryList());
+        }
+        return;
+    }
+    
+    const ids = new Set(change.ids);
+    if (change.op === 'delete') {
+        allLinks = allLinks.filter(link => !ids.has(link.id));
+    } else {
+        const fields = toLocalLinkFields(change.fields);
+        let found = false;
+        allLinks.forEach(link => {
+            if (ids.has(link.id)) {
+                Object.assign(link, fields);
+                found = true;
+            }
+        });
+        // 新建的链接：事件中带有完整字段
+        if (!found && change.ids.length === 1 && fields.url && !allLinks.some(link => link.url === fields.url)) {
+            allLinks.push({
+                category: '未分类',
+                tags: [],
+                private: false,
+                clicks: 0,
+                lastAccess: null,
+                addTime: Date.now(),
+                ...fields,
+                id: change.ids[0]
+            });
+        }
+    }
+    renderLinks();
 }
 
 // 更新用户界面
@@ -5318,7 +5438,10 @@ async function recordLinkAccess(url) {
         // 如果使用后端 API，更新链接的点击次数
         if (useBackendAPI && api && currentUserId && link.id) {
             try {
-                await api.clickLink(currentUserId, link.id);
+                const result = await api.clickLink(currentUserId, link.id);
+                if (result && typeof result.frecency === 'number') {
+                    link.frecency = result.frecency;
+                }
             } catch (error) {
                 console.error('记录链接点击失败:', error);
             }
@@ -5471,6 +5594,11 @@ function showAccessHistory() {
         if (confirm('确定要清空所有访问历史吗？')) {
             accessHistory = [];
             saveAccessHistory();
+            if (useBackendAPI && api && currentUserId) {
+                api.clearAccessHistory(currentUserId).catch(error => {
+                    console.error('清空服务端访问历史失败:', error);
+                });
+            }
             document.body.removeChild(modal);
             showNotification('访问历史已清空', 'success');
         }
@@ -5914,6 +6042,13 @@ function showShareModal() {
             </div>
             <div class="modal-body">
                 <div class="share-options">
+                    ${useBackendAPI && api && currentUserId ? `
+                    <div class="share-option">
+                        <h3>公开分享链接</h3>
+                        <p>复制一个公开地址，他人无需登录即可查看所有非私有链接，内容随修改自动更新</p>
+                        <button class="btn-submit" id="copyPublicShareLinkBtn">复制公开链接</button>
+                        <button class="btn-cancel" id="resetPublicShareLinkBtn">更换链接</button>
+                    </div>` : ''}
                     <div class="share-option">
                         <h3>生成分享页面</h3>
                         <p>生成一个独立的HTML页面，包含所有链接，可以分享给他人</p>
@@ -5948,6 +6083,21 @@ function showShareModal() {
         }
     });
     
+    // 公开分享链接
+    const copyPublicBtn = modal.querySelector('#copyPublicShareLinkBtn');
+    if (copyPublicBtn) {
+        copyPublicBtn.addEventListener('click', () => {
+            copyPublicShareLink(false);
+            document.body.removeChild(modal);
+        });
+        modal.querySelector('#resetPublicShareLinkBtn').addEventListener('click', () => {
+            if (confirm('更换后旧的公开链接将失效，确定更换吗？')) {
+                copyPublicShareLink(true);
+                document.body.removeChild(modal);
+            }
+        });
+    }
+    
     // 生成分享页面
     modal.querySelector('#generateSharePageBtn').addEventListener('click', () => {
         generateSharePage();
@@ -5967,6 +6117,18 @@ function showShareModal() {
     });
 }
 
+// 复制公开分享链接（reset 为 true 时先更换令牌）
+async function copyPublicShareLink(reset) {
+    try {
+        const link = reset ? await api.resetShareLink(currentUserId) : await api.getShareLink(currentUserId);
+        await navigator.clipboard.writeText(link.html_url);
+        showNotification('公开链接已复制到剪贴板', 'success');
+    } catch (error) {
+        console.error('获取公开链接失败:', error);
+        showNotification('获取公开链接失败', 'error');
+    }
+}
+
 // 生成分享页面
 function generateSharePage() {
     const html = `<!DOCTYPE html>